@@ -0,0 +1,90 @@
+# 对比各种条目编码的体积和编解码速度（ESFHouseItem 形状的数据）
+#
+#   python benchmarks/bench_codec.py -n 100000
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from scrapy_fangtianxia.codec import ItemCodec, train_dictionary
+from scrapy_fangtianxia.items import ESFHouseItem
+
+PROVINCES = {'北京': ['北京'], '广东': ['广州', '深圳', '佛山'], '四川': ['成都', '绵阳'], '湖北': ['武汉', '宜昌']}
+ROADS = ['人民路', '建设大道', '解放路', '中山路', '长江路', '滨江路']
+TOWARDS = ['南北向', '南向', '东南向', '东西向', '北向']
+
+
+def make_items(n, seed=0):
+    rnd = random.Random(seed)
+    items = []
+    for i in range(n):
+        province = rnd.choice(list(PROVINCES))
+        area = rnd.randint(40, 220)
+        price = rnd.randint(60, 2000)
+        items.append(ESFHouseItem(
+            province=province,
+            city=rnd.choice(PROVINCES[province]),
+            name=f'{rnd.choice(ROADS)}{rnd.randint(1, 99)}号院',
+            rooms=f'{rnd.randint(1, 5)}室{rnd.randint(1, 2)}厅',
+            area=f'{area}㎡',
+            floor=f'{rnd.choice(["低", "中", "高"])}层（共{rnd.randint(6, 33)}层）',
+            toward=rnd.choice(TOWARDS),
+            year=f'{rnd.randint(1985, 2022)}年建',
+            address=f'{rnd.choice(ROADS)}{rnd.randint(1, 999)}号',
+            price=f'{price}万',
+            unit_price=f'{price * 10000 // area}元/㎡',
+            origin_url=f'https://esf.fang.com/chushou/3_{rnd.randint(10 ** 8, 10 ** 9)}.htm',
+        ))
+    return items
+
+
+def bench(name, codec, items, baseline=None):
+    start = time.perf_counter()
+    encoded = [codec.encode(item) for item in items]
+    encode_time = time.perf_counter() - start
+    # 读的一方只知道字典和 schema，格式靠自动识别
+    reader = ItemCodec(zstd_dict=codec.zstd_dict, schemas=codec.schemas)
+    start = time.perf_counter()
+    for data in encoded:
+        reader.decode(data)
+    decode_time = time.perf_counter() - start
+    size = sum(len(data) for data in encoded) / len(items)
+    ratio = size / baseline if baseline else 1.0
+    print(f'{name:<18} {size:8.1f} B/条 ({ratio:5.1%})  编码 {len(items) / encode_time:10.0f} 条/s  '
+          f'解码 {len(items) / decode_time:10.0f} 条/s')
+    return size
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', type=int, default=50000)
+    parser.add_argument('--dict-size', type=int, default=16384)
+    parser.add_argument('--save-dict', help='把训练出的 zstd 字典保存到这个文件（ITEM_CODEC_ZSTD_DICT）')
+    args = parser.parse_args()
+
+    items = make_items(args.n)
+    # 字典用另一批数据训练，避免高估压缩率
+    msgpack_codec = ItemCodec('msgpack')
+    zstd_dict = train_dictionary([msgpack_codec.encode(item) for item in make_items(5000, seed=1)],
+                                 args.dict_size)
+    if args.save_dict:
+        with open(args.save_dict, 'wb') as f:
+            f.write(zstd_dict)
+
+    codecs = [
+        ('json', ItemCodec('json')),
+        ('json+zstd', ItemCodec('json', compress=True)),
+        ('msgpack', ItemCodec('msgpack')),
+        ('msgpack+zstd', ItemCodec('msgpack', compress=True)),
+        ('msgpack+zstd+dict', ItemCodec('msgpack', compress=True, zstd_dict=zstd_dict)),
+    ]
+    baseline = None
+    for name, codec in codecs:
+        size = bench(name, codec, items, baseline)
+        baseline = baseline or size
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+# 对比 scrapy_redis 的集合去重和布隆过滤器去重的内存占用和误判率
+#
+# 需要一个可以随便写的 Redis（会写入 bench:* 键，结束后删除）：
+#   python benchmarks/bench_dupefilter.py -n 1000000 --host 127.0.0.1 --port 6379
+import argparse
+import hashlib
+import os
+import sys
+import time
+
+import redis
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from scrapy_fangtianxia.dupefilter import BloomFilter
+
+
+def fingerprints(n, prefix):
+    # 和 RFPDupeFilter 一样是 40 位的 SHA1
+    for i in range(n):
+        yield hashlib.sha1(f'{prefix}{i}'.encode()).hexdigest()
+
+
+def memory_usage(r, key):
+    try:
+        return r.memory_usage(key, samples=0) or 0
+    except redis.ResponseError:
+        return 0
+
+
+def bench_set(r, n, batch):
+    key = 'bench:dupefilter:set'
+    r.delete(key)
+    start = time.perf_counter()
+    pipe = r.pipeline(transaction=False)
+    for i, fp in enumerate(fingerprints(n, 'req'), 1):
+        pipe.sadd(key, fp)
+        if i % batch == 0:
+            pipe.execute()
+    pipe.execute()
+    elapsed = time.perf_counter() - start
+    size = memory_usage(r, key)
+    r.delete(key)
+    return elapsed, size
+
+
+def bench_bloom(r, n, capacity, error_rate, probes):
+    bloom = BloomFilter(r, 'bench:dupefilter:bloom', capacity, error_rate)
+    bloom.clear()
+    start = time.perf_counter()
+    for fp in fingerprints(n, 'req'):
+        bloom.add(fp)
+    elapsed = time.perf_counter() - start
+    size = bloom.memory_usage()
+    # 用没加过的指纹测误判率
+    false_positives = sum(fp in bloom for fp in fingerprints(probes, 'probe'))
+    bloom.clear()
+    return elapsed, size, false_positives / probes
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', type=int, default=200000, help='加入的指纹数量')
+    parser.add_argument('--capacity', type=int, default=1000000)
+    parser.add_argument('--error-rate', type=float, default=0.001)
+    parser.add_argument('--probes', type=int, default=100000, help='测误判率用的指纹数量')
+    parser.add_argument('--batch', type=int, default=1000)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=6379)
+    args = parser.parse_args()
+
+    r = redis.Redis(host=args.host, port=args.port)
+    set_time, set_size = bench_set(r, args.n, args.batch)
+    bloom_time, bloom_size, fp_rate = bench_bloom(r, args.n, args.capacity, args.error_rate, args.probes)
+
+    print(f'指纹数量: {args.n}')
+    print(f'集合:       {set_size / 1024 / 1024:8.2f} MB  {set_size / args.n:6.1f} B/条  写入 {set_time:6.2f}s')
+    print(f'布隆过滤器: {bloom_size / 1024 / 1024:8.2f} MB  {bloom_size / args.n:6.1f} B/条  写入 {bloom_time:6.2f}s')
+    print(f'误判率: {fp_rate:.5f}（目标 {args.error_rate}）')
+
+
+if __name__ == '__main__':
+    main()
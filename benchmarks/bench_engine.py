@@ -0,0 +1,91 @@
+# 对比一次读成 DataFrame 和分块统计（fang_analysis.engine）的耗时和内存峰值，并检查结果一致
+#
+#   python benchmarks/bench_engine.py -n 500000 --workers 4
+import argparse
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from fang_analysis.engine import aggregate
+from fang_analysis.loader import decode_chunk, listing_type
+from fang_analysis.parsing import AGE_ORDER, PRICE_ORDER, age_ranges, numeric_column, parse_prices, price_ranges
+from scrapy_fangtianxia.codec import ItemCodec
+
+CITIES = ['北京', '上海', '广州', '深圳', '成都', '武汉']
+DISTRICTS = ['朝阳区', '海淀区', '天河区', '南山区', '武侯区', '江汉区']
+
+
+def make_chunks(codec, n, chunk_size, seed=0):
+    # 按块生成编码后的记录，和从 Redis 分块读出来的一样
+    rnd = random.Random(seed)
+    for start in range(0, n, chunk_size):
+        chunk = []
+        for _ in range(min(chunk_size, n - start)):
+            item = {'name': '示例', 'city': rnd.choice(CITIES), 'price_wan': rnd.uniform(50, 2000)}
+            if rnd.random() < 0.4:
+                item.update(district=rnd.choice(DISTRICTS), sale='在售')
+            else:
+                item.update(unit_price_yuan=rnd.randint(8000, 90000), year_built=rnd.randint(1980, 2024))
+            chunk.append(codec.encode(item))
+        yield chunk
+
+
+def counts_in_memory(codec, chunks):
+    # complete_demo 原来的做法：所有记录读成列表再建 DataFrame
+    frames = {'newhouse': [], 'esf': []}
+    for chunk in chunks:
+        for item in decode_chunk(codec, chunk):
+            frames[listing_type(item)].append(item)
+    nh, esf = pd.DataFrame(frames['newhouse']), pd.DataFrame(frames['esf'])
+    nh_price = numeric_column(nh, 'price_wan', 'price', parse_prices)
+    esf_price = numeric_column(esf, 'price_wan', 'price', parse_prices)
+    return {
+        'newhouse_city': nh['city'].value_counts(),
+        'esf_city': esf['city'].value_counts(),
+        'newhouse_price': price_ranges(nh_price).value_counts().reindex(PRICE_ORDER),
+        'esf_price': price_ranges(esf_price).value_counts().reindex(PRICE_ORDER),
+        'newhouse_district': nh['district'].value_counts(),
+        'esf_age': age_ranges(esf['year_built']).value_counts().reindex(AGE_ORDER),
+    }
+
+
+def measured(func):
+    # tracemalloc 会让 Python 代码慢好几倍，耗时和内存峰值分两次测
+    start = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, elapsed, peak / 2 ** 20
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', type=int, default=500000)
+    parser.add_argument('--chunk-size', type=int, default=5000)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    codec = ItemCodec('msgpack')
+    chunks = lambda: make_chunks(codec, args.n, args.chunk_size)
+    expected, slow, slow_peak = measured(lambda: counts_in_memory(codec, chunks()))
+    print(f'{args.n} 条，每块 {args.chunk_size} 条（内存峰值只统计主进程）')
+    print(f'{"一次读入":<8} {slow:7.2f}s  {slow_peak:8.1f}MB')
+    for workers in sorted({1, args.workers}):
+        result, fast, peak = measured(lambda: aggregate(chunks(), codec=codec, workers=workers))
+        for name, counts in result.counts().items():
+            want = expected[name].dropna()
+            if dict(counts) != dict(want[want > 0].astype('int64')):
+                raise SystemExit(f'{name} 结果不一致')
+        print(f'{f"分块 x{workers}":<8} {fast:7.2f}s  {peak:8.1f}MB')
+
+
+if __name__ == '__main__':
+    main()
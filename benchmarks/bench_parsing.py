@@ -0,0 +1,78 @@
+# 对比逐行 apply 和按列计算的价格/年份解析、区间划分的耗时；两者结果一致由 tests/test_parsing.py 检查
+#
+#   python benchmarks/bench_parsing.py -n 1000000
+import argparse
+import os
+import random
+import sys
+import time
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from fang_analysis.parsing import (
+    age_ranges, get_age_range_label, get_price_range_label, parse_price_to_wan, parse_prices,
+    parse_year, parse_years, price_ranges,
+)
+
+
+def make_prices(n, seed=0):
+    rnd = random.Random(seed)
+    units = ['万', '万/套', '亿', '元/㎡', '元', '', '万起']
+    values = []
+    for _ in range(n):
+        r = rnd.random()
+        if r < 0.02:
+            values.append(None)
+        elif r < 0.04:
+            values.append('价格待定')
+        elif r < 0.1:
+            values.append(rnd.randint(50, 3000))
+        else:
+            values.append(f'{rnd.uniform(10, 5000):.{rnd.randint(0, 2)}f}{rnd.choice(units)}')
+    return values
+
+
+def make_years(n, seed=0):
+    rnd = random.Random(seed)
+    values = []
+    for _ in range(n):
+        r = rnd.random()
+        if r < 0.05:
+            values.append(None)
+        elif r < 0.1:
+            values.append(rnd.randint(1950, 2025))
+        else:
+            values.append(f'{rnd.randint(1880, 2030)}年建')
+    return values
+
+
+def timed(func):
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', type=int, default=1000000)
+    args = parser.parse_args()
+
+    prices = pd.Series(make_prices(args.n), dtype=object)
+    years = pd.Series(make_years(args.n), dtype=object)
+    price_wan = parse_prices(prices)
+    year_built = parse_years(years)
+    cases = [
+        ('price', lambda: prices.apply(parse_price_to_wan), lambda: parse_prices(prices)),
+        ('price_range', lambda: price_wan.apply(get_price_range_label), lambda: price_ranges(price_wan)),
+        ('year', lambda: years.apply(parse_year), lambda: parse_years(years)),
+        ('age_range', lambda: year_built.astype(float).apply(get_age_range_label), lambda: age_ranges(year_built)),
+    ]
+    print(f'\n{args.n} 条')
+    for name, row_wise, vectorized in cases:
+        slow, fast = timed(row_wise), timed(vectorized)
+        print(f'{name:<12} apply {slow:7.2f}s  按列 {fast:7.2f}s  {slow / fast:6.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -7,122 +7,62 @@ import random
 import os
 from datetime import datetime
 
+from scrapy.utils.project import get_project_settings
+from scrapy_redis import connection
 
-import matplotlib.pyplot as plt
+from scrapy_fangtianxia.aggregates import AggregateCounters
+from scrapy_fangtianxia.buckets import UNKNOWN
+from scrapy_fangtianxia.codec import ItemCodec
+from scrapy_fangtianxia.sketches import SketchStore
+from scrapy_fangtianxia.store import ListingStore
+from fang_analysis.engine import aggregate
+from fang_analysis.loader import iter_raw_chunks, iter_records, listing_type
+from fang_analysis.parsing import (
+    AGE_ORDER, PRICE_ORDER, age_ranges, numeric_column, parse_prices, parse_year, parse_years, price_ranges,
+)
+from fang_analysis.render import render_charts
 
 
-plt.rcParams['font.sans-serif'] = ['SimHei'] 
-plt.rcParams['axes.unicode_minus'] = False
+SPIDER_NAME = 'fang'
 
-def parse_price_to_wan(price_str):
-    if pd.isna(price_str) or price_str == '':
-        return np.nan
-    
-    try:
-        if isinstance(price_str, (int, float)):
-            return float(price_str)
-    except:
-        pass
-    
-    if isinstance(price_str, str):
-        num_match = re.search(r'([\d\.]+)', price_str)
-        if not num_match:
-            return np.nan
-        
-        value = float(num_match.group(1))
-        
-        if '万' in price_str:
-            return value
-        elif '亿' in price_str:
-            return value * 10000
-        elif '元' in price_str:
-            return value / 10000
-        else:
-            return value 
-    
-    return np.nan
 
-def parse_year(year_str):
-    if pd.isna(year_str) or year_str == '':
-        return np.nan
-    
-    try:
-        if isinstance(year_str, (int, float)):
-            return int(year_str)
-    except:
-        pass
-    
-    if isinstance(year_str, str):
-        year_match = re.search(r'(\d{4})', year_str)
-        if year_match:
-            year = int(year_match.group(1))
-            current_year = datetime.now().year
-            if 1900 <= year <= current_year:
-                return year
-    
-    return np.nan
+def items_key(settings):
+    # RedisBatchPipeline 写条目的列表，schema 在 <列表>:schemas 哈希里
+    return settings.get('REDIS_ITEMS_KEY', '%(spider)s:items') % {'spider': SPIDER_NAME}
 
-def get_price_range_label(price):
-    if pd.isna(price):
-        return '未知'
-    
-    if price < 150:
-        return '150万以下'
-    elif price < 300:
-        return '150-300万'
-    elif price < 500:
-        return '300-500万'
-    elif price < 1000:
-        return '500-1000万'
-    else:
-        return '1000万以上'
-
-def get_age_range_label(year):
-    if pd.isna(year):
-        return '未知'
-    
-    current_year = datetime.now().year
-    age = current_year - year
-    
-    if age <= 5:
-        return '5年以内'
-    elif age <= 10:
-        return '5-10年'
-    elif age <= 20:
-        return '10-20年'
-    else:
-        return '20年以上'
 
-def main():
-    print("=== 房源数据分析与可视化 ===\n")
-    
+def load_frames(settings):
     # 从Redis读取数据
     new_houses = []
     esf_houses = []
     
     try:
-        r = redis.Redis(host='localhost', port=6379, db=0, decode_responses=True)
+        # 和爬虫用同一份连接配置（REDIS_URL 或 REDIS_HOST/REDIS_PORT）；条目可能是 msgpack/zstd 编码的二进制，
+        # 不能让 redis-py 按 utf-8 解码（scrapy_redis 默认不解码）
+        r = connection.from_settings(settings)
         print('成功连接到Redis数据库')
+        # 和爬虫用同一份编码配置（zstd 字典等）
+        key = items_key(settings)
+        codec = ItemCodec.from_settings(settings)
+        codec.load_schemas(r, f'{key}:schemas')
         
-        keys = r.keys('*')
-        print(f'Redis中共有{len(keys)}条数据')
-       
-        for key in keys:
-            try:
-                data = r.get(key)
-                if data:
-                    item = json.loads(data)
-                    
-                    if 'price' not in item or 'name' not in item:
-                        print(f'警告: 数据项缺少必要字段: {item}')
-                        continue
-
-                    if 'unit_price' in item:
-                        esf_houses.append(item)
-                    else:
-                        new_houses.append(item)
-            except Exception as e:
-                print(f'处理数据项时出错: {e}')
+        # 分块 LRANGE / SCAN + MGET，不用 KEYS，也不逐个 GET
+        errors = []
+        for records in iter_records(r, codec, list_keys=(key,), errors=errors):
+            for item in records:
+                has_price = 'price' in item or 'price_wan' in item or 'unit_price_yuan' in item
+                if not has_price or 'name' not in item:
+                    print(f'警告: 数据项缺少必要字段: {item}')
+                    continue
+
+                if listing_type(item) == 'esf':
+                    esf_houses.append(item)
+                else:
+                    new_houses.append(item)
+        for e in errors[:10]:
+            print(f'处理数据项时出错: {e}')
+        if len(errors) > 10:
+            print(f'... 共{len(errors)}条数据解码失败')
         
         print(f'处理完成，共读取{len(new_houses)}条新房数据和{len(esf_houses)}条二手房数据')
 
@@ -133,9 +73,9 @@ def main():
             reclassified_indices = []
             
             for i, item in enumerate(esf_houses):
-                if 'year' in item:
+                if 'year_built' in item or 'year' in item:
                     try:
-                        year = parse_year(item['year'])
+                        year = item.get('year_built') or parse_year(item['year'])
                         if not pd.isna(year) and (current_year - year) <= 2:
                             reclassified_indices.append(i)
                     except:
@@ -242,193 +182,229 @@ def main():
         print("共有字段: ['province', 'city', 'name', 'price', 'rooms', 'area', 'address', 'origin_url']")
     
     if not nh_df.empty:
-        if 'price' in nh_df.columns:
-            nh_df['price_wan'] = nh_df['price'].apply(parse_price_to_wan)
-            nh_df['price_range'] = nh_df['price_wan'].apply(get_price_range_label)
+        price_wan = numeric_column(nh_df, 'price_wan', 'price', parse_prices)
+        if price_wan is not None:
+            nh_df['price_wan'] = price_wan
+            nh_df['price_range'] = price_ranges(price_wan)
         else:
-            print("警告: 新房数据中没有'price'字段，无法计算价格区间")
+            print("警告: 新房数据中没有价格字段，无法计算价格区间")
     
     if not esf_df.empty:
-        if 'price' in esf_df.columns:
-            esf_df['price_wan'] = esf_df['price'].apply(parse_price_to_wan)
-            esf_df['price_range'] = esf_df['price_wan'].apply(get_price_range_label)
+        price_wan = numeric_column(esf_df, 'price_wan', 'price', parse_prices)
+        if price_wan is not None:
+            esf_df['price_wan'] = price_wan
+            esf_df['price_range'] = price_ranges(price_wan)
         else:
-            print("警告: 二手房数据中没有'price'字段，无法计算价格区间")
+            print("警告: 二手房数据中没有价格字段，无法计算价格区间")
             
-        if 'year' in esf_df.columns:
-            esf_df['year_built'] = esf_df['year'].apply(parse_year)
-            esf_df['age_range'] = esf_df['year_built'].apply(get_age_range_label)
-        else:
-            print("警告: 二手房数据中没有'year'字段，无法计算房龄区间")
-    
-    print("\n开始生成可视化图表...")
-    
-    output_dir = 'output_charts'
-    os.makedirs(output_dir, exist_ok=True)
-    
-    # 任务1: 城市房源对比饼状图
-    fig1, (ax1, ax2) = plt.subplots(1, 2, figsize=(16, 7))
-    fig1.suptitle('城市房源对比', fontsize=20, y=1.02)
-    
-    # 检查是否有city字段，如果有则按城市分析，否则显示总数
-    if 'city' in nh_df.columns and not nh_df.empty:
-        nh_city_counts = nh_df['city'].value_counts()
-        ax1.pie(nh_city_counts, labels=nh_city_counts.index, autopct='%1.1f%%',
-                startangle=90, textprops={'fontsize': 12}, shadow=True)
-        ax1.set_title('新房房源城市占比', fontsize=16, pad=20)
-    else:
-        # 如果没有city字段，显示新房总数
-        ax1.text(0.5, 0.5, f'新房总数: {len(nh_df)}', 
-                 horizontalalignment='center', verticalalignment='center', fontsize=16)
-        ax1.set_title('新房数据', fontsize=16, pad=20)
-        ax1.axis('off')
-    
-    if 'city' in esf_df.columns and not esf_df.empty:
-        esf_city_counts = esf_df['city'].value_counts()
-        ax2.pie(esf_city_counts, labels=esf_city_counts.index, autopct='%1.1f%%',
-                startangle=90, textprops={'fontsize': 12}, shadow=True)
-        ax2.set_title('二手房房源城市占比', fontsize=16, pad=20)
-    else:
-        # 如果没有city字段，显示二手房总数
-        ax2.text(0.5, 0.5, f'二手房总数: {len(esf_df)}', 
-                 horizontalalignment='center', verticalalignment='center', fontsize=16)
-        ax2.set_title('二手房数据', fontsize=16, pad=20)
-        ax2.axis('off')
-    
-    # 保存图表
-    fig1.savefig(os.path.join(output_dir, '城市房源占比.png'), dpi=300, bbox_inches='tight')
-    
-    # 任务2: 新老房子价格区间对比饼状图
-    fig2, (ax3, ax4) = plt.subplots(1, 2, figsize=(16, 7))
-    fig2.suptitle('房源价格区间对比 (单位: 万元)', fontsize=20, y=1.02)
-    
-    price_order = ['150万以下', '150-300万', '300-500万', '500-1000万', '1000万以上', '未知']
-    
-    # 检查是否有price_range字段
-    if 'price_range' in nh_df.columns and not nh_df.empty:
-        nh_price_counts = nh_df['price_range'].value_counts().reindex(price_order).dropna()
-        if not nh_price_counts.empty:
-            ax3.pie(nh_price_counts, labels=nh_price_counts.index, autopct='%1.1f%%',
-                    startangle=90, textprops={'fontsize': 12}, shadow=True)
-            ax3.set_title('新房价格区间占比', fontsize=16, pad=20)
-        else:
-            ax3.text(0.5, 0.5, '没有价格区间数据', 
-                     horizontalalignment='center', verticalalignment='center', fontsize=16)
-            ax3.set_title('新房价格区间', fontsize=16, pad=20)
-            ax3.axis('off')
-    else:
-        ax3.text(0.5, 0.5, '缺少价格区间数据', 
-                 horizontalalignment='center', verticalalignment='center', fontsize=16)
-        ax3.set_title('新房价格区间', fontsize=16, pad=20)
-        ax3.axis('off')
-    
-    # 检查是否有price_range字段
-    if 'price_range' in esf_df.columns and not esf_df.empty:
-        esf_price_counts = esf_df['price_range'].value_counts().reindex(price_order).dropna()
-        if not esf_price_counts.empty:
-            ax4.pie(esf_price_counts, labels=esf_price_counts.index, autopct='%1.1f%%',
-                    startangle=90, textprops={'fontsize': 12}, shadow=True)
-            ax4.set_title('二手房价格区间占比', fontsize=16, pad=20)
-        else:
-            ax4.text(0.5, 0.5, '没有价格区间数据', 
-                     horizontalalignment='center', verticalalignment='center', fontsize=16)
-            ax4.set_title('二手房价格区间', fontsize=16, pad=20)
-            ax4.axis('off')
-    else:
-        ax4.text(0.5, 0.5, '缺少价格区间数据', 
-                 horizontalalignment='center', verticalalignment='center', fontsize=16)
-        ax4.set_title('二手房价格区间', fontsize=16, pad=20)
-        ax4.axis('off')
-    
-    # 保存图表
-    fig2.savefig(os.path.join(output_dir, '价格区间占比.png'), dpi=300, bbox_inches='tight')
-    
-    # 任务3: 新房行政区分布饼状图
-    fig3, ax5 = plt.subplots(figsize=(10, 8))
-    
-    # 检查是否有district字段
-    if 'district' in nh_df.columns and not nh_df.empty:
-        nh_district_counts = nh_df['district'].value_counts()
-        if not nh_district_counts.empty:
-            ax5.pie(nh_district_counts, labels=nh_district_counts.index, autopct='%1.1f%%',
-                    startangle=90, textprops={'fontsize': 12}, shadow=True)
-            ax5.set_title('新房房源行政区分布', fontsize=18, pad=20)
-        else:
-            ax5.text(0.5, 0.5, '没有行政区数据', 
-                     horizontalalignment='center', verticalalignment='center', fontsize=16)
-            ax5.set_title('新房行政区分布', fontsize=18, pad=20)
-    else:
-        ax5.text(0.5, 0.5, '缺少行政区数据', 
-                 horizontalalignment='center', verticalalignment='center', fontsize=16)
-        ax5.set_title('新房行政区分布', fontsize=18, pad=20)
-    ax5.axis('equal')  # 保证饼图是正圆形
-    
-    # 保存图表
-    fig3.savefig(os.path.join(output_dir, '新房行政区分布.png'), dpi=300, bbox_inches='tight')
-    
-    # 任务4: 二手房房龄结构饼状图
-    fig4, ax6 = plt.subplots(figsize=(10, 8))
-    age_order = ['5年以内', '5-10年', '10-20年', '20年以上', '未知']
-    
-    # 检查是否有age_range字段
-    if 'age_range' in esf_df.columns and not esf_df.empty:
-        esf_age_counts = esf_df['age_range'].value_counts().reindex(age_order).dropna()
-        if not esf_age_counts.empty:
-            ax6.pie(esf_age_counts, labels=esf_age_counts.index, autopct='%1.1f%%',
-                    startangle=90, textprops={'fontsize': 12}, shadow=True)
-            ax6.set_title('二手房房龄结构分布', fontsize=18, pad=20)
+        year_built = numeric_column(esf_df, 'year_built', 'year', parse_years, dtype='Int64')
+        if year_built is not None:
+            esf_df['year_built'] = year_built
+            esf_df['age_range'] = age_ranges(esf_df['year_built'])
         else:
-            ax6.text(0.5, 0.5, '没有房龄数据', 
-                     horizontalalignment='center', verticalalignment='center', fontsize=16)
-            ax6.set_title('二手房房龄结构', fontsize=18, pad=20)
-    else:
-        ax6.text(0.5, 0.5, '缺少房龄数据', 
-                 horizontalalignment='center', verticalalignment='center', fontsize=16)
-        ax6.set_title('二手房房龄结构', fontsize=18, pad=20)
-    ax6.axis('equal')
-    
-    # 保存图表
-    fig4.savefig(os.path.join(output_dir, '二手房房龄结构.png'), dpi=300, bbox_inches='tight')
-    
-    print(f"\n图表已保存到 {os.path.abspath(output_dir)} 目录")
-    
-    # 尝试显示图表（在某些环境中可能不起作用）
+            print("警告: 二手房数据中没有年代字段，无法计算房龄区间")
+
+    return nh_df, esf_df
+
+
+def value_counts(df, column, order=None):
+    # 没有这一列时返回 None，和“有这一列但没有数据”区分开
+    if column not in df.columns or df.empty:
+        return None
+    counts = df[column].value_counts()
+    if order is not None:
+        counts = counts.reindex(order)
+        counts = counts[counts > 0]
+    return counts
+
+
+def frame_summary(df):
+    summary = {'count': len(df)}
+    if 'price_wan' in df.columns and not df.empty:
+        summary.update(price_mean=df['price_wan'].mean(), price_max=df['price_wan'].max(),
+                       price_min=df['price_wan'].min(), price_p50=df['price_wan'].quantile(0.5),
+                       price_p90=df['price_wan'].quantile(0.9))
+    if 'year_built' in df.columns and not df.empty:
+        summary.update(year_mean=df['year_built'].mean(), year_max=df['year_built'].max(),
+                       year_min=df['year_built'].min())
+    return summary
+
+
+def counts_from_frames(nh_df, esf_df):
+    counts = {
+        'newhouse_city': value_counts(nh_df, 'city'),
+        'esf_city': value_counts(esf_df, 'city'),
+        'newhouse_price': value_counts(nh_df, 'price_range', PRICE_ORDER),
+        'esf_price': value_counts(esf_df, 'price_range', PRICE_ORDER),
+        'newhouse_district': value_counts(nh_df, 'district'),
+        'esf_age': value_counts(esf_df, 'age_range', AGE_ORDER),
+    }
+    return counts, {'newhouse': frame_summary(nh_df), 'esf': frame_summary(esf_df)}
+
+
+def counts_from_store(store):
+    # 分组统计都在 SQLite 里做，不用把房源读进内存
+    def series(pairs):
+        return pd.Series(dict((value, n) for value, n in pairs if value is not None), dtype='int64')
+
+    counts = {
+        'newhouse_city': series(store.count_by('city', 'newhouse')),
+        'esf_city': series(store.count_by('city', 'esf')),
+        'newhouse_price': series(store.price_ranges('newhouse')),
+        'esf_price': series(store.price_ranges('esf')),
+        'newhouse_district': series(store.count_by('district', 'newhouse')),
+        'esf_age': series(store.age_ranges('esf')),
+    }
+    summary = {t: {k: v for k, v in store.summary(t).items() if v is not None} for t in ('newhouse', 'esf')}
+    return counts, summary
+
+
+def counts_from_redis(counters, sketches=None):
+    # 爬取时累加好的计数（AggregateCounterPipeline），只读每个维度的一个哈希；
+    # 有分位数草图（QuantileSketchPipeline）时加上价格中位数和 p90
+    def series(pairs):
+        return pd.Series(dict((value, n) for value, n in pairs if value != UNKNOWN), dtype='int64')
+
+    counts = {
+        'newhouse_city': series(counters.count_by('city', 'newhouse')),
+        'esf_city': series(counters.count_by('city', 'esf')),
+        'newhouse_price': pd.Series(dict(counters.price_ranges('newhouse')), dtype='int64'),
+        'esf_price': pd.Series(dict(counters.price_ranges('esf')), dtype='int64'),
+        'newhouse_district': series(counters.count_by('district', 'newhouse')),
+        'esf_age': pd.Series(dict(counters.age_ranges('esf')), dtype='int64'),
+    }
+    summary = {t: counters.summary(t) for t in ('newhouse', 'esf')}
+    if sketches is not None:
+        for t in summary:
+            digest = sketches.digest(t)
+            if len(digest):
+                summary[t]['price_p50'], summary[t]['price_p90'] = digest.quantiles((0.5, 0.9))
+    return counts, summary
+
+
+def counts_from_chunks(settings):
+    # 分块读取、在进程池里分块统计再合并，内存只和块大小有关；Redis 里没有数据时返回 None
     try:
-        plt.show()
-    except Exception as e:
-        print(f"显示图表时出错: {e}")
-        print("请查看保存的图片文件")
-    
-    # 数据统计摘要
+        r = connection.from_settings(settings)
+        key = items_key(settings)
+        codec = ItemCodec.from_settings(settings)
+        codec.load_schemas(r, f'{key}:schemas')
+        chunks = iter_raw_chunks(r, list_keys=(key,), chunk_size=settings.getint('ANALYSIS_CHUNK_SIZE', 5000))
+        result = aggregate(chunks, codec=codec, workers=settings.getint('ANALYSIS_WORKERS', os.cpu_count() or 1))
+    except redis.ConnectionError as e:
+        print(f'从Redis读取数据时出错: {e}')
+        return None
+    if not result.total:
+        return None
+    print(f'分块统计完成，共{result.partials["newhouse"].count}条新房数据和{result.partials["esf"].count}条二手房数据')
+    if result.skipped:
+        print(f'警告: {result.skipped}条数据缺少必要字段')
+    if result.errors:
+        print(f'共{result.errors}条数据解码失败')
+    return result.counts(), result.summary()
+
+
+def print_city_quantiles(sketches):
+    # 每个城市的总价、单价中位数和 p90，每个数只合并一次各节点的草图
+    for t, title in (('newhouse', '新房'), ('esf', '二手房')):
+        cities = sketches.scopes(t)
+        if not cities:
+            continue
+        print(f"\n{title}各城市价格分位数（中位数 / 90%分位）：")
+        for scope in cities:
+            price = sketches.quantiles(t, 'price_wan', scope)
+            unit = sketches.quantiles(t, 'unit_price_yuan', scope)
+            line = f"{scope[len('city:'):]}: 总价 {price[0]:.1f} / {price[1]:.1f}万元"
+            if not any(pd.isna(unit)):
+                line += f"，单价 {unit[0]:.0f} / {unit[1]:.0f}元/㎡"
+            print(line)
+
+
+def print_summary(summary):
     print("\n数据统计摘要：")
-    total_houses = len(new_houses) + len(esf_houses)
+    nh, esf = summary['newhouse'], summary['esf']
+    total_houses = nh['count'] + esf['count']
     print(f"总房源数: {total_houses}套")
-    
+
     if total_houses > 0:
-        print(f"新房数量: {len(new_houses)}套，占比: {len(new_houses)/total_houses*100:.1f}%")
-        print(f"二手房数量: {len(esf_houses)}套，占比: {len(esf_houses)/total_houses*100:.1f}%")
+        print(f"新房数量: {nh['count']}套，占比: {nh['count']/total_houses*100:.1f}%")
+        print(f"二手房数量: {esf['count']}套，占比: {esf['count']/total_houses*100:.1f}%")
     else:
         print("没有房源数据")
-    
-    if 'price_wan' in nh_df.columns and not nh_df.empty:
+
+    if 'price_mean' in nh:
         print(f"\n新房价格统计：")
-        print(f"平均价格: {nh_df['price_wan'].mean():.1f}万元")
-        print(f"最高价格: {nh_df['price_wan'].max():.1f}万元")
-        print(f"最低价格: {nh_df['price_wan'].min():.1f}万元")
-    
-    if 'price_wan' in esf_df.columns and not esf_df.empty:
+        print(f"平均价格: {nh['price_mean']:.1f}万元")
+        print(f"最高价格: {nh['price_max']:.1f}万元")
+        print(f"最低价格: {nh['price_min']:.1f}万元")
+        if 'price_p50' in nh:
+            print(f"价格中位数: {nh['price_p50']:.1f}万元，90%分位: {nh['price_p90']:.1f}万元")
+
+    if 'price_mean' in esf:
         print(f"\n二手房价格统计：")
-        print(f"平均价格: {esf_df['price_wan'].mean():.1f}万元")
-        print(f"最高价格: {esf_df['price_wan'].max():.1f}万元")
-        print(f"最低价格: {esf_df['price_wan'].min():.1f}万元")
-    
-    if 'year_built' in esf_df.columns and not esf_df.empty:
+        print(f"平均价格: {esf['price_mean']:.1f}万元")
+        print(f"最高价格: {esf['price_max']:.1f}万元")
+        print(f"最低价格: {esf['price_min']:.1f}万元")
+        if 'price_p50' in esf:
+            print(f"价格中位数: {esf['price_p50']:.1f}万元，90%分位: {esf['price_p90']:.1f}万元")
+
+    if 'year_mean' in esf:
         print(f"\n二手房房龄统计：")
         current_year = datetime.now().year
-        avg_age = current_year - esf_df['year_built'].mean()
+        avg_age = current_year - esf['year_mean']
         print(f"平均房龄: {avg_age:.1f}年")
-        print(f"最新建造: {esf_df['year_built'].max()}年")
-        print(f"最早建造: {esf_df['year_built'].min()}年")
+        print(f"最新建造: {esf['year_max']}年")
+        print(f"最早建造: {esf['year_min']}年")
+
+
+def main():
+    print("=== 房源数据分析与可视化 ===\n")
+    settings = get_project_settings()
+
+    # 优先用爬取时累加的计数，其次在本地房源库里分组统计，再其次分块读取 Redis 里的全部数据，
+    # 都没有数据时用示例数据
+    counters = AggregateCounters(connection.from_settings(settings),
+                                 settings.get('AGGREGATES_KEY', '%(spider)s:agg') % {'spider': SPIDER_NAME})
+    store_dir = settings.get('LISTING_STORE_DIR')
+    store_path = os.path.join(store_dir, 'listings.db') if store_dir else None
+    try:
+        use_counters = counters.exists()
+    except redis.ConnectionError:
+        use_counters = False
+    sketches = SketchStore(counters.server, settings.get('SKETCHES_KEY', '%(spider)s:sketch') % {'spider': SPIDER_NAME},
+                           ttl=settings.getfloat('SKETCHES_NODE_TTL', 7 * 86400))
+    if use_counters:
+        print(f'从 Redis 里的统计计数 {counters.key} 画图')
+        counts, summary = counts_from_redis(counters, sketches)
+    elif store_path and os.path.exists(store_path):
+        print(f'从本地房源库 {store_path} 统计')
+        store = ListingStore(store_path)
+        counts, summary = counts_from_store(store)
+        store.close()
+    else:
+        result = counts_from_chunks(settings)
+        if result is not None:
+            counts, summary = result
+        else:
+            nh_df, esf_df = load_frames(settings)
+            counts, summary = counts_from_frames(nh_df, esf_df)
+
+    print("\n开始生成可视化图表...")
+
+    # 统计数据没变的图不重画，需要重画的在进程池里画
+    output_dir = 'output_charts'
+    rendered, skipped = render_charts(counts, summary, output_dir,
+                                      workers=settings.getint('ANALYSIS_WORKERS', os.cpu_count() or 1))
+    for name in rendered:
+        print(f"已生成 {name}")
+    if skipped:
+        print(f"数据没有变化，跳过: {', '.join(skipped)}")
+
+    print(f"\n图表已保存到 {os.path.abspath(output_dir)} 目录")
+
+    print_summary(summary)
+    if use_counters:
+        print_city_quantiles(sketches)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1 @@
+# 房源数据分析用到的工具，complete_demo.py 使用
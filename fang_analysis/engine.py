@@ -0,0 +1,228 @@
+# 分块统计：每块记录折叠成可合并的部分统计，内存只和块大小有关
+#
+#   result = aggregate(iter_raw_chunks(r), codec=codec, workers=4)
+#   counts, summary = result.counts(), result.summary()
+#
+# 每块单独计算条目数、城市/行政区计数、价格区间和房源龄区间的直方图，以及价格和建造年份的
+# 数量/总和/最小/最大值，这些都可以直接相加（或取最小最大）合并，块之间的顺序不影响结果。
+# 结果和把所有数据读成 DataFrame 之后的 counts_from_frames 一致；价格分位数用 t-digest 估计
+# （按全部、城市、行政区），合并之后和精确值的排名误差一般在千分之几以内。
+# workers > 1 时在进程池里计算，传给子进程的是未解码的记录，解码也在子进程里做。
+import math
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from functools import partial
+
+import pandas as pd
+
+from fang_analysis.loader import decode_chunk, listing_type
+from fang_analysis.parsing import AGE_ORDER, PRICE_ORDER, age_ranges, numeric_column, parse_prices, parse_years, price_ranges
+from scrapy_fangtianxia.sketches import TDigest
+
+LISTING_TYPES = ('newhouse', 'esf')
+
+
+class Moments:
+    # 数量、总和、最小、最大值
+    def __init__(self, n=0, total=0.0, low=math.inf, high=-math.inf):
+        self.n = n
+        self.total = total
+        self.low = low
+        self.high = high
+
+    def update(self, values):
+        values = values.dropna().astype(float)
+        if len(values):
+            self.n += len(values)
+            self.total += float(values.sum())
+            self.low = min(self.low, float(values.min()))
+            self.high = max(self.high, float(values.max()))
+
+    def merge(self, other):
+        self.n += other.n
+        self.total += other.total
+        self.low = min(self.low, other.low)
+        self.high = max(self.high, other.high)
+        return self
+
+    def summary(self, name):
+        if not self.n:
+            return {f'{name}_mean': math.nan, f'{name}_max': math.nan, f'{name}_min': math.nan}
+        return {f'{name}_mean': self.total / self.n, f'{name}_max': self.high, f'{name}_min': self.low}
+
+
+class Partial:
+    # 一种房源的部分统计；seen 记录出现过哪些维度，和 DataFrame 缺少某一列的情况对应
+    DIMENSIONS = ('city', 'district', 'price_range', 'age_range')
+
+    def __init__(self):
+        self.count = 0
+        self.seen = set()
+        self.counters = {name: Counter() for name in self.DIMENSIONS}
+        self.price = Moments()
+        self.year = Moments()
+        # 价格的 t-digest，键和 sketches.scopes 一样：all、city:<城市>、district:<城市>:<行政区>
+        self.sketches = {}
+
+    def update(self, df, current_year=None):
+        self.count += len(df)
+        for name in ('city', 'district'):
+            if name in df.columns:
+                self._count(name, df[name])
+        price_wan = numeric_column(df, 'price_wan', 'price', parse_prices)
+        if price_wan is not None:
+            self.price.update(price_wan)
+            self._count('price_range', price_ranges(price_wan))
+            self._sketch(df, price_wan.dropna())
+        year_built = numeric_column(df, 'year_built', 'year', partial(parse_years, current_year=current_year),
+                                    dtype='Int64')
+        if year_built is not None:
+            self.year.update(year_built)
+            self._count('age_range', age_ranges(year_built, current_year))
+
+    def _sketch(self, df, price):
+        groups = [('all', price)]
+        if 'city' in df.columns:
+            cities = df.loc[price.index, 'city']
+            groups += [(f'city:{city}', values) for city, values in price.groupby(cities)]
+            if 'district' in df.columns:
+                districts = df.loc[price.index, 'district']
+                groups += [(f'district:{city}:{district}', values)
+                           for (city, district), values in price.groupby([cities, districts])]
+        for scope, values in groups:
+            if scope not in self.sketches:
+                self.sketches[scope] = TDigest()
+            self.sketches[scope].update(values.tolist())
+
+    def _count(self, name, values):
+        self.seen.add(name)
+        self.counters[name].update(values.value_counts().to_dict())
+
+    def merge(self, other):
+        self.count += other.count
+        self.seen |= other.seen
+        for name, counter in other.counters.items():
+            self.counters[name].update(counter)
+        self.price.merge(other.price)
+        self.year.merge(other.year)
+        for scope, digest in other.sketches.items():
+            if scope in self.sketches:
+                self.sketches[scope].merge(digest)
+            else:
+                self.sketches[scope] = digest
+        return self
+
+    def quantiles(self, scope='all', qs=(0.5, 0.9)):
+        digest = self.sketches.get(scope)
+        return digest.quantiles(qs) if digest is not None else [math.nan] * len(qs)
+
+    def value_counts(self, name, order=None):
+        # 和 complete_demo.value_counts 一样：没有这个维度时返回 None
+        if name not in self.seen or not self.count:
+            return None
+        counts = pd.Series(self.counters[name], dtype='int64')
+        counts = counts[counts > 0]
+        if order is not None:
+            return counts.reindex([label for label in order if label in counts.index])
+        # 数量相同时保持第一次出现的顺序，和 Series.value_counts 一样
+        return counts.sort_values(ascending=False, kind='stable')
+
+    def summary(self):
+        result = {'count': self.count}
+        if 'price_range' in self.seen and self.count:
+            result.update(self.price.summary('price'))
+            result['price_p50'], result['price_p90'] = self.quantiles()
+        if 'age_range' in self.seen and self.count:
+            result.update(self.year.summary('year'))
+        return result
+
+
+class Aggregates:
+    def __init__(self):
+        self.partials = {t: Partial() for t in LISTING_TYPES}
+        # 缺少价格或名称被跳过的条目、解码失败的记录
+        self.skipped = 0
+        self.errors = 0
+
+    def merge(self, other):
+        for t, p in other.partials.items():
+            self.partials[t].merge(p)
+        self.skipped += other.skipped
+        self.errors += other.errors
+        return self
+
+    def counts(self):
+        nh, esf = self.partials['newhouse'], self.partials['esf']
+        return {
+            'newhouse_city': nh.value_counts('city'),
+            'esf_city': esf.value_counts('city'),
+            'newhouse_price': nh.value_counts('price_range', PRICE_ORDER),
+            'esf_price': esf.value_counts('price_range', PRICE_ORDER),
+            'newhouse_district': nh.value_counts('district'),
+            'esf_age': esf.value_counts('age_range', AGE_ORDER),
+        }
+
+    def summary(self):
+        return {t: p.summary() for t, p in self.partials.items()}
+
+    @property
+    def total(self):
+        return sum(p.count for p in self.partials.values())
+
+
+def valid(item):
+    # 和 complete_demo 读 Redis 时的检查一致
+    has_price = 'price' in item or 'price_wan' in item or 'unit_price_yuan' in item
+    return has_price and 'name' in item
+
+
+def fold(chunk, codec=None, current_year=None):
+    # 把一块记录折叠成 Aggregates；传了 codec 时 chunk 是未解码的记录
+    result = Aggregates()
+    if codec is not None:
+        errors = []
+        chunk = decode_chunk(codec, chunk, errors)
+        result.errors = len(errors)
+    groups = {t: [] for t in LISTING_TYPES}
+    for item in chunk:
+        if valid(item):
+            groups[listing_type(item)].append(item)
+        else:
+            result.skipped += 1
+    for t, items in groups.items():
+        if items:
+            result.partials[t].update(pd.DataFrame(items), current_year)
+    return result
+
+
+_worker_codec = None
+
+
+def _init_worker(codec):
+    global _worker_codec
+    _worker_codec = codec
+
+
+def _fold_in_worker(chunk, current_year):
+    return fold(chunk, _worker_codec, current_year)
+
+
+def aggregate(chunks, codec=None, workers=1, current_year=None, max_pending=None):
+    # max_pending 限制同时在进程池里的块数（默认 workers 的两倍），读得比算得快时不会堆积在内存里
+    result = Aggregates()
+    if workers <= 1:
+        for chunk in chunks:
+            result.merge(fold(chunk, codec, current_year))
+        return result
+    max_pending = max_pending or workers * 2
+    with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(codec,)) as pool:
+        pending = set()
+        for chunk in chunks:
+            if len(pending) >= max_pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    result.merge(future.result())
+            pending.add(pool.submit(_fold_in_worker, chunk, current_year))
+        for future in pending:
+            result.merge(future.result())
+    return result
@@ -0,0 +1,76 @@
+# 从 Redis 分块读取房源数据
+#
+# RedisBatchPipeline（以及 scrapy_redis 的 RedisPipeline）把条目写在列表 fang:items 里，
+# 这里用 LRANGE 分块读取；早期按 key 单独保存的字符串记录用 SCAN + MGET 读取。
+# 不使用 KEYS，也不会一次把所有数据读进内存，不会卡住正在爬取的 Redis。
+from itertools import islice
+
+import pandas as pd
+
+DEFAULT_LIST_KEYS = ('fang:items',)
+# 爬虫自己的 key（布隆过滤器位图、队列计数等）也是字符串，扫描时跳过
+EXCLUDE_PREFIXES = ('fang:',)
+
+
+def listing_type(item):
+    # 新房都有行政区；二手房有单价（归一化之后新房也可能有单价，只看原始文本）
+    if 'district' in item or 'sale' in item:
+        return 'newhouse'
+    return 'esf' if 'unit_price' in item or 'unit_price_yuan' in item else 'newhouse'
+
+
+def iter_list_chunks(r, key, chunk_size=5000):
+    start = 0
+    while True:
+        chunk = r.lrange(key, start, start + chunk_size - 1)
+        if not chunk:
+            return
+        yield chunk
+        start += len(chunk)
+
+
+def iter_string_chunks(r, match='*', chunk_size=1000, exclude=EXCLUDE_PREFIXES):
+    exclude = tuple(p.encode('utf-8') if isinstance(p, str) else p for p in exclude)
+    keys = (key for key in r.scan_iter(match=match, count=chunk_size, _type='string')
+            if not (key if isinstance(key, bytes) else key.encode('utf-8')).startswith(exclude))
+    while True:
+        batch = list(islice(keys, chunk_size))
+        if not batch:
+            return
+        values = r.mget(batch)
+        yield [value for value in values if value is not None]
+
+
+def iter_raw_chunks(r, list_keys=DEFAULT_LIST_KEYS, scan_strings=True, chunk_size=5000):
+    # 每次产出一块未解码的记录，可以交给别的进程解码
+    for key in list_keys:
+        yield from iter_list_chunks(r, key, chunk_size)
+    if scan_strings:
+        yield from iter_string_chunks(r, chunk_size=min(chunk_size, 1000))
+
+
+def decode_chunk(codec, chunk, errors=None):
+    records = []
+    for data in chunk:
+        try:
+            records.append(codec.decode(data))
+        except Exception as e:
+            if errors is not None:
+                errors.append(e)
+    return records
+
+
+def iter_records(r, codec, list_keys=DEFAULT_LIST_KEYS, scan_strings=True, chunk_size=5000, errors=None):
+    # 每次产出一块解码后的字典；解码失败的记录计入 errors（如果传了的话）
+    for chunk in iter_raw_chunks(r, list_keys, scan_strings, chunk_size):
+        yield decode_chunk(codec, chunk, errors)
+
+
+def iter_frames(r, codec, columns=None, **kwargs):
+    # 每次产出 (新房 DataFrame, 二手房 DataFrame)，columns 可以只保留需要的列
+    for records in iter_records(r, codec, **kwargs):
+        frames = {'newhouse': [], 'esf': []}
+        for item in records:
+            frames[listing_type(item)].append(item)
+        yield tuple(pd.DataFrame(frames[t], columns=columns) if frames[t] else pd.DataFrame(columns=columns)
+                    for t in ('newhouse', 'esf'))
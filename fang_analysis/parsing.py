@@ -0,0 +1,205 @@
+# 价格、建造年份的解析和区间划分
+#
+# parse_price_to_wan 等单值函数原来在 complete_demo.py 里，通过 Series.apply 逐行调用；
+# parse_prices / parse_years / price_ranges / age_ranges 是按列计算的版本，
+# 结果和单值函数逐行调用一致（见 benchmarks/bench_parsing.py），区间返回 Categorical。
+import re
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+except ImportError:
+    pa = None
+
+from scrapy_fangtianxia.buckets import AGE_BINS, AGE_LABELS, AGE_ORDER, PRICE_BINS, PRICE_LABELS, PRICE_ORDER, UNKNOWN
+
+# 不带分组的正则，列操作按各自的语法加分组
+NUMBER = r'[\d\.]+'
+YEAR = r'\d{4}'
+NUMBER_PATTERN = re.compile(f'({NUMBER})')
+YEAR_PATTERN = re.compile(f'({YEAR})')
+# float() 能解析的数字，'1.2.3'、'.' 这种匹配了 NUMBER_PATTERN 但解析会失败
+FLOAT_PATTERN = r'^(\d+\.?\d*|\.\d+)$'
+
+
+def parse_price_to_wan(price_str):
+    if pd.isna(price_str) or price_str == '':
+        return np.nan
+
+    try:
+        if isinstance(price_str, (int, float)):
+            return float(price_str)
+    except:
+        pass
+
+    if isinstance(price_str, str):
+        num_match = NUMBER_PATTERN.search(price_str)
+        if not num_match:
+            return np.nan
+
+        value = float(num_match.group(1))
+
+        if '万' in price_str:
+            return value
+        elif '亿' in price_str:
+            return value * 10000
+        elif '元' in price_str:
+            return value / 10000
+        else:
+            return value
+
+    return np.nan
+
+def parse_year(year_str, current_year=None):
+    if pd.isna(year_str) or year_str == '':
+        return np.nan
+
+    try:
+        if isinstance(year_str, (int, float)):
+            return int(year_str)
+    except:
+        pass
+
+    if isinstance(year_str, str):
+        year_match = YEAR_PATTERN.search(year_str)
+        if year_match:
+            year = int(year_match.group(1))
+            current_year = current_year or datetime.now().year
+            if 1900 <= year <= current_year:
+                return year
+
+    return np.nan
+
+def get_price_range_label(price):
+    if pd.isna(price):
+        return '未知'
+
+    if price < 150:
+        return '150万以下'
+    elif price < 300:
+        return '150-300万'
+    elif price < 500:
+        return '300-500万'
+    elif price < 1000:
+        return '500-1000万'
+    else:
+        return '1000万以上'
+
+def get_age_range_label(year, current_year=None):
+    if pd.isna(year):
+        return '未知'
+
+    current_year = current_year or datetime.now().year
+    age = current_year - year
+
+    if age <= 5:
+        return '5年以内'
+    elif age <= 10:
+        return '5-10年'
+    elif age <= 20:
+        return '10-20年'
+    else:
+        return '20年以上'
+
+
+def _split_text(values):
+    # 返回 (Series, 是字符串的掩码)；整列都是字符串或都是数字时不用逐个判断类型
+    s = values if isinstance(values, pd.Series) else pd.Series(values, dtype=object)
+    kind = pd.api.types.infer_dtype(s, skipna=True)
+    if kind in ('string', 'empty'):
+        return s, s.notna()
+    if kind in ('integer', 'floating', 'mixed-integer-float', 'decimal', 'boolean'):
+        return s, pd.Series(False, index=s.index)
+    return s, s.map(type).eq(str)
+
+
+def _numeric(s, is_str):
+    # 非字符串的值按数字处理，其他类型（列表等）当作缺失
+    result = pd.Series(np.nan, index=s.index)
+    if not is_str.all():
+        result[~is_str] = pd.to_numeric(s[~is_str], errors='coerce').astype(float)
+    return result
+
+
+def _text_array(text):
+    # 有 pyarrow 时转成 arrow 字符串数组，正则和类型转换比 pandas 的 str 方法快好几倍
+    if pa is not None:
+        return pa.array(text.to_numpy(dtype=object), type=pa.string())
+    return text
+
+
+def _extract_float(text, regex):
+    # 取 regex 的第一个匹配转成 float，匹配不到或者不是合法数字时为 NaN
+    if pa is not None:
+        number = pc.struct_field(pc.extract_regex(text, f'(?P<n>{regex})'), [0])
+        number = pc.if_else(pc.match_substring_regex(number, FLOAT_PATTERN), number, None)
+        return pc.cast(number, pa.float64()).to_numpy(zero_copy_only=False)
+    number = text.str.extract(f'({regex})', expand=False)
+    return pd.to_numeric(number.where(number.str.match(FLOAT_PATTERN, na=False)), errors='coerce').to_numpy(float)
+
+
+def _contains(text, unit):
+    if pa is not None:
+        return pc.match_substring(text, unit).to_numpy(zero_copy_only=False)
+    return text.str.contains(unit, regex=False, na=False).to_numpy(bool)
+
+
+def parse_prices(values):
+    # 向量化的 parse_price_to_wan，返回 float64（万元）
+    s, is_str = _split_text(values)
+    result = _numeric(s, is_str)
+    if not is_str.any():
+        return result
+    text = _text_array(s[is_str])
+    value = _extract_float(text, NUMBER)
+    conditions = [_contains(text, unit) for unit in ('万', '亿', '元')]
+    result[is_str] = np.select(conditions, [value, value * 10000, value / 10000], default=value)
+    return result
+
+
+def parse_years(values, current_year=None):
+    # 向量化的 parse_year，返回可空整数 Int64
+    current_year = current_year or datetime.now().year
+    s, is_str = _split_text(values)
+    numeric = _numeric(s, is_str)
+    # 数字直接取整，不检查范围（和 parse_year 一致）
+    result = np.trunc(numeric.where(np.isfinite(numeric)))
+    if is_str.any():
+        year = _extract_float(_text_array(s[is_str]), YEAR)
+        result[is_str] = np.where((year >= 1900) & (year <= current_year), year, np.nan)
+    return result.astype('Int64')
+
+
+def _with_unknown(labels, order):
+    labels = labels.cat.add_categories(UNKNOWN).fillna(UNKNOWN)
+    return labels.cat.set_categories(order)
+
+
+def price_ranges(prices):
+    # 向量化的 get_price_range_label
+    prices = pd.Series(prices, dtype=float)
+    # pd.cut 的区间左闭右开，+inf 不落在 [1000, inf) 里
+    prices = prices.clip(upper=np.finfo(float).max)
+    labels = pd.cut(prices, [-np.inf, *PRICE_BINS, np.inf], right=False, labels=list(PRICE_LABELS))
+    return _with_unknown(labels, PRICE_ORDER)
+
+
+def age_ranges(years, current_year=None):
+    # 向量化的 get_age_range_label
+    current_year = current_year or datetime.now().year
+    ages = current_year - pd.Series(years).astype(float)
+    labels = pd.cut(ages, [-np.inf, *AGE_BINS, np.inf], include_lowest=True, labels=list(AGE_LABELS))
+    return _with_unknown(labels, AGE_ORDER)
+
+
+def numeric_column(df, field, raw_field, parser, dtype=float):
+    # 优先用爬取时归一化好的数值字段，旧数据（只有原始文本）再解析文本补上
+    result = df[field].astype(dtype) if field in df.columns else None
+    if raw_field in df.columns:
+        parsed = parser(df[raw_field]).astype(dtype)
+        result = parsed if result is None else result.fillna(parsed)
+    return result
@@ -0,0 +1,165 @@
+# 分析报告的饼图
+#
+#   rendered, skipped = render_charts(counts, summary, 'output_charts', workers=4)
+#
+# 每张图按它用到的统计数据算一个指纹，记在输出目录的 .fingerprints.json 里；PNG 还在、
+# 指纹没变的图直接跳过。指纹里包括 dpi 和这个文件的内容，改了画图代码会全部重画。
+# 需要重画的图在进程池里用 Agg 后端画，保存之后关闭 figure。
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import matplotlib
+
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+
+plt.rcParams['font.sans-serif'] = ['SimHei']
+plt.rcParams['axes.unicode_minus'] = False
+
+MANIFEST = '.fingerprints.json'
+
+with open(__file__, 'rb') as f:
+    SOURCE_HASH = hashlib.sha256(f.read()).hexdigest()
+
+
+def _pairs(counts):
+    # Series -> [[标签, 数量]]，保持顺序（饼图的扇区顺序）；None 表示缺少这个字段
+    if counts is None:
+        return None
+    return [[str(label), int(n)] for label, n in counts.items()]
+
+
+def draw_pie(ax, counts, title, empty_title, missing_text, empty_text, fontsize=16):
+    # counts 为 None 表示缺少这个字段，为空表示没有数据
+    if counts:
+        ax.pie([n for _, n in counts], labels=[label for label, _ in counts], autopct='%1.1f%%',
+               startangle=90, textprops={'fontsize': 12}, shadow=True)
+        ax.set_title(title, fontsize=fontsize, pad=20)
+        return True
+    ax.text(0.5, 0.5, missing_text if counts is None else empty_text,
+            horizontalalignment='center', verticalalignment='center', fontsize=16)
+    ax.set_title(empty_title, fontsize=fontsize, pad=20)
+    return False
+
+
+def draw_city(data):
+    fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(16, 7))
+    fig.suptitle('城市房源对比', fontsize=20, y=1.02)
+    # 如果没有city字段，显示房源总数
+    nh_total, esf_total = f"新房总数: {data['newhouse_count']}", f"二手房总数: {data['esf_count']}"
+    if not draw_pie(ax1, data['newhouse'], '新房房源城市占比', '新房数据', nh_total, nh_total):
+        ax1.axis('off')
+    if not draw_pie(ax2, data['esf'], '二手房房源城市占比', '二手房数据', esf_total, esf_total):
+        ax2.axis('off')
+    return fig
+
+
+def draw_price(data):
+    fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(16, 7))
+    fig.suptitle('房源价格区间对比 (单位: 万元)', fontsize=20, y=1.02)
+    if not draw_pie(ax1, data['newhouse'], '新房价格区间占比', '新房价格区间', '缺少价格区间数据', '没有价格区间数据'):
+        ax1.axis('off')
+    if not draw_pie(ax2, data['esf'], '二手房价格区间占比', '二手房价格区间', '缺少价格区间数据', '没有价格区间数据'):
+        ax2.axis('off')
+    return fig
+
+
+def draw_district(data):
+    fig, ax = plt.subplots(figsize=(10, 8))
+    draw_pie(ax, data['newhouse'], '新房房源行政区分布', '新房行政区分布', '缺少行政区数据', '没有行政区数据', fontsize=18)
+    ax.axis('equal')  # 保证饼图是正圆形
+    return fig
+
+
+def draw_age(data):
+    fig, ax = plt.subplots(figsize=(10, 8))
+    draw_pie(ax, data['esf'], '二手房房龄结构分布', '二手房房龄结构', '缺少房龄数据', '没有房龄数据', fontsize=18)
+    ax.axis('equal')
+    return fig
+
+
+DRAWERS = {'city': draw_city, 'price': draw_price, 'district': draw_district, 'age': draw_age}
+
+
+def chart_inputs(counts, summary):
+    # {文件名: (图表, 输入)}，输入只包含这张图用到的数据
+    return {
+        '城市房源占比.png': ('city', {
+            'newhouse': _pairs(counts['newhouse_city']), 'esf': _pairs(counts['esf_city']),
+            'newhouse_count': int(summary['newhouse']['count']), 'esf_count': int(summary['esf']['count']),
+        }),
+        '价格区间占比.png': ('price', {
+            'newhouse': _pairs(counts['newhouse_price']), 'esf': _pairs(counts['esf_price']),
+        }),
+        '新房行政区分布.png': ('district', {'newhouse': _pairs(counts['newhouse_district'])}),
+        '二手房房龄结构.png': ('age', {'esf': _pairs(counts['esf_age'])}),
+    }
+
+
+def fingerprint(chart, data, dpi):
+    payload = json.dumps([SOURCE_HASH, dpi, chart, data], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def render(chart, data, path, dpi=300):
+    # 先写临时文件再改名，画到一半中断不会留下残缺的 PNG
+    fig = DRAWERS[chart](data)
+    try:
+        fig.savefig(path + '.tmp', dpi=dpi, bbox_inches='tight', format='png')
+    finally:
+        plt.close(fig)
+    os.replace(path + '.tmp', path)
+    return path
+
+
+def load_manifest(output_dir):
+    try:
+        with open(os.path.join(output_dir, MANIFEST), encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_manifest(output_dir, manifest):
+    path = os.path.join(output_dir, MANIFEST)
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=1, sort_keys=True)
+    os.replace(path + '.tmp', path)
+
+
+def render_charts(counts, summary, output_dir, dpi=300, workers=None, force=False):
+    # 返回 (重画的文件名, 跳过的文件名)
+    os.makedirs(output_dir, exist_ok=True)
+    manifest = load_manifest(output_dir)
+    todo, skipped = [], []
+    for name, (chart, data) in chart_inputs(counts, summary).items():
+        digest = fingerprint(chart, data, dpi)
+        path = os.path.join(output_dir, name)
+        if not force and manifest.get(name) == digest and os.path.exists(path):
+            skipped.append(name)
+        else:
+            todo.append((name, chart, data, path, digest))
+
+    workers = min(workers or os.cpu_count() or 1, len(todo))
+    rendered = []
+    try:
+        if workers <= 1:
+            for name, chart, data, path, digest in todo:
+                render(chart, data, path, dpi)
+                manifest[name] = digest
+                rendered.append(name)
+        else:
+            with ProcessPoolExecutor(workers) as pool:
+                futures = [(name, digest, pool.submit(render, chart, data, path, dpi))
+                           for name, chart, data, path, digest in todo]
+                for name, digest, future in futures:
+                    future.result()
+                    manifest[name] = digest
+                    rendered.append(name)
+    finally:
+        # 画成功的图先记下来，其他图出错时下次只重画没成功的
+        if rendered:
+            save_manifest(output_dir, manifest)
+    return rendered, skipped
@@ -0,0 +1,141 @@
+# 爬取时累加的统计，分析脚本按区间数量读几个哈希就能画图，不用读全部数据
+#
+#   <key>:bloom:<类型>                布隆过滤器（见 dupefilter.py），已经计过数的 origin_url
+#   <key>:hll:<类型>:<城市>            HyperLogLog，这个城市见过的 origin_url，只用来估计不重复条目数
+#   <key>:<类型>:city                 城市 -> 条目数
+#   <key>:<类型>:<维度>                区间/区县/年份 -> 条目数（全部城市）
+#   <key>:<类型>:<维度>:<城市>          同上，单个城市
+#   <key>:<类型>:stats                price/year 的 _sum/_n/_min/_max
+#
+# 类型是 newhouse / esf，维度见 DIMENSIONS。只有布隆过滤器没见过的 origin_url 才计数，和计数在同一个
+# 脚本里原子地完成：重复爬取不会重复累加，写入失败后重试整批也不会；代价是布隆过滤器的误判率
+# （BLOOMFILTER_ERROR_RATE），这个比例的新条目会被当成见过的漏计。内存随条目数增长，
+# 每 100 万个 origin_url 约 2MB（误判率 0.001 时）。
+# （不能用 PFADD 的返回值判断：新元素没有改变任何寄存器时 PFADD 也返回 0，会漏计很多）
+# 房龄随时间变化，所以存的是建造年份，读的时候再按 buckets.AGE_BINS 划分。
+from scrapy_fangtianxia.buckets import AGE_ORDER, PRICE_ORDER, UNKNOWN, age_range_label, price_range_label
+from scrapy_fangtianxia.dupefilter import BLOOM_ADD_FUNCTION, bloom_hashes
+
+# KEYS: 布隆过滤器, HyperLogLog, stats 哈希, 计数哈希...
+# ARGV: 去重用的 id, h1, h2, 容量, 误判率, 数值个数 n, n 组 (名称, 数值), 每个计数哈希对应的字段
+RECORD_SCRIPT = BLOOM_ADD_FUNCTION + """
+if bloom_add(KEYS[1], ARGV[2], ARGV[3], ARGV[4], ARGV[5], '0') == 1 then
+    return 0
+end
+redis.call('pfadd', KEYS[2], ARGV[1])
+local n = tonumber(ARGV[6])
+for i = 0, n - 1 do
+    local name, raw = ARGV[7 + 2 * i], ARGV[8 + 2 * i]
+    local value = tonumber(raw)
+    redis.call('hincrbyfloat', KEYS[3], name .. '_sum', raw)
+    redis.call('hincrby', KEYS[3], name .. '_n', 1)
+    local low = tonumber(redis.call('hget', KEYS[3], name .. '_min'))
+    if not low or value < low then
+        redis.call('hset', KEYS[3], name .. '_min', raw)
+    end
+    local high = tonumber(redis.call('hget', KEYS[3], name .. '_max'))
+    if not high or value > high then
+        redis.call('hset', KEYS[3], name .. '_max', raw)
+    end
+end
+local offset = 6 + 2 * n
+for i = 4, #KEYS do
+    redis.call('hincrby', KEYS[i], ARGV[offset + i - 3], 1)
+end
+return 1
+"""
+
+# 每种条目按哪些维度计数，值为空时记成“未知”
+DIMENSIONS = {
+    'newhouse': ('price', 'district'),
+    'esf': ('price', 'year'),
+}
+STATS_FIELDS = {'price': 'price_wan', 'year': 'year_built'}
+
+
+def _dimension(name, item):
+    if name == 'price':
+        return price_range_label(item.get('price_wan'))
+    if name == 'year':
+        year = item.get('year_built')
+        return UNKNOWN if year is None or year != year else str(int(year))
+    value = item.get(name)
+    return UNKNOWN if value is None or value == '' else str(value)
+
+
+class AggregateCounters:
+    def __init__(self, server, key, capacity=1000000, error_rate=0.001):
+        self.server = server
+        self.key = key
+        # 去重用的布隆过滤器，和 BloomFilter 一样按类型可扩展
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self._record = server.register_script(RECORD_SCRIPT)
+
+    def _args(self, listing_type, item):
+        city = item.get('city') or UNKNOWN
+        prefix = f'{self.key}:{listing_type}'
+        keys = [f'{self.key}:bloom:{listing_type}', f'{self.key}:hll:{listing_type}:{city}', f'{prefix}:stats',
+                f'{prefix}:city']
+        fields = [city]
+        for name in DIMENSIONS[listing_type]:
+            value = _dimension(name, item)
+            keys += [f'{prefix}:{name}', f'{prefix}:{name}:{city}']
+            fields += [value, value]
+        stats = [(name, item.get(field)) for name, field in STATS_FIELDS.items()]
+        stats = [(name, value) for name, value in stats if value is not None and value == value]
+        uid = item.get('origin_url') or repr(sorted(item.items()))
+        args = [uid, *bloom_hashes(uid), self.capacity, self.error_rate, len(stats)]
+        for name, value in stats:
+            args += [name, repr(float(value))]
+        return keys, args + fields
+
+    def record(self, items):
+        # items 是 (类型, 字典) 列表，返回新计入的条目数
+        pipe = self.server.pipeline(transaction=False)
+        for listing_type, item in items:
+            keys, args = self._args(listing_type, item)
+            self._record(keys=keys, args=args, client=pipe)
+        return sum(pipe.execute())
+
+    def _hash(self, listing_type, dimension, city=None):
+        key = f'{self.key}:{listing_type}:{dimension}'
+        if city is not None and dimension != 'city':
+            key = f'{key}:{city}'
+        return {field.decode(): int(value) for field, value in self.server.hgetall(key).items()}
+
+    def count_by(self, dimension, listing_type, city=None):
+        # dimension 为 city 或 DIMENSIONS 里的维度，返回 [(值, 条目数)]，按数量从多到少
+        return sorted(self._hash(listing_type, dimension, city).items(), key=lambda pair: -pair[1])
+
+    def price_ranges(self, listing_type, city=None):
+        # 和 ListingStore 一样按 PRICE_ORDER 排序
+        counts = self._hash(listing_type, 'price', city)
+        return [(label, counts[label]) for label in PRICE_ORDER if label in counts]
+
+    def age_ranges(self, listing_type, current_year=None, city=None):
+        counts = {}
+        for year, n in self._hash(listing_type, 'year', city).items():
+            label = UNKNOWN if year == UNKNOWN else age_range_label(int(year), current_year)
+            counts[label] = counts.get(label, 0) + n
+        return [(label, counts[label]) for label in AGE_ORDER if label in counts]
+
+    def distinct(self, listing_type, city):
+        # HyperLogLog 估计的不重复条目数
+        return self.server.pfcount(f'{self.key}:hll:{listing_type}:{city}')
+
+    def summary(self, listing_type):
+        # 和 ListingStore.summary 的格式一致
+        stats = {field.decode(): float(value)
+                 for field, value in self.server.hgetall(f'{self.key}:{listing_type}:stats').items()}
+        result = {'count': sum(self._hash(listing_type, 'city').values())}
+        for name in STATS_FIELDS:
+            n = stats.get(f'{name}_n')
+            if n:
+                result[f'{name}_mean'] = stats[f'{name}_sum'] / n
+                result[f'{name}_min'] = stats[f'{name}_min']
+                result[f'{name}_max'] = stats[f'{name}_max']
+        return result
+
+    def exists(self):
+        return bool(self.server.exists(f'{self.key}:newhouse:city', f'{self.key}:esf:city'))
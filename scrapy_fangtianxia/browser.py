@@ -0,0 +1,111 @@
+# 滑块验证用的无头浏览器池
+#
+# 浏览器在第一次需要时才启动，每次验证借出一个，用完归还；
+# 使用次数达到上限或者中途崩溃的浏览器会被关闭，下次需要时重新启动；
+# 空闲太久的浏览器由 reap_idle() 回收。
+# 所有方法都可能在工作线程里调用，内部用 Condition 做同步。
+import threading
+import time
+from contextlib import contextmanager
+
+from selenium.common.exceptions import NoSuchElementException, TimeoutException
+
+# 这些异常说明页面不对，而不是浏览器坏了，浏览器可以继续用
+RECOVERABLE_ERRORS = (NoSuchElementException, TimeoutException)
+
+
+class PooledBrowser:
+    def __init__(self, driver):
+        self.driver = driver
+        self.uses = 0
+        self.last_used = time.monotonic()
+
+
+class BrowserPool:
+    def __init__(self, factory, size=2, max_uses=50, idle_timeout=300):
+        self.factory = factory
+        self.size = size
+        self.max_uses = max_uses
+        self.idle_timeout = idle_timeout
+        self._idle = []  # 空闲的浏览器
+        self._launched = 0  # 已启动的浏览器数量（包括借出去的）
+        self._cond = threading.Condition()
+        self._closed = False
+
+    @contextmanager
+    def lease(self):
+        browser = self._acquire()
+        broken = False
+        try:
+            yield browser.driver
+        except RECOVERABLE_ERRORS:
+            raise
+        except Exception:
+            broken = True
+            raise
+        finally:
+            self._release(browser, broken)
+
+    def _acquire(self):
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise RuntimeError("浏览器池已关闭")
+                if self._idle:
+                    # 后进先出，优先复用刚用过的浏览器
+                    return self._idle.pop()
+                if self._launched < self.size:
+                    self._launched += 1
+                    break
+                self._cond.wait()
+        # 启动浏览器比较慢，不要持有锁
+        try:
+            return PooledBrowser(self.factory())
+        except Exception:
+            with self._cond:
+                self._launched -= 1
+                self._cond.notify()
+            raise
+
+    def _release(self, browser, broken=False):
+        browser.uses += 1
+        browser.last_used = time.monotonic()
+        with self._cond:
+            retire = broken or self._closed or browser.uses >= self.max_uses
+            if retire:
+                self._launched -= 1
+            else:
+                self._idle.append(browser)
+            self._cond.notify()
+        if retire:
+            self._quit(browser)
+
+    def reap_idle(self):
+        now = time.monotonic()
+        with self._cond:
+            expired = [b for b in self._idle if now - b.last_used >= self.idle_timeout]
+            if not expired:
+                return 0
+            self._idle = [b for b in self._idle if b not in expired]
+            self._launched -= len(expired)
+            self._cond.notify_all()
+        for browser in expired:
+            self._quit(browser)
+        return len(expired)
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._launched -= len(idle)
+            self._cond.notify_all()
+        # 借出去的浏览器在归还时关闭
+        for browser in idle:
+            self._quit(browser)
+
+    @staticmethod
+    def _quit(browser):
+        try:
+            browser.driver.quit()
+        except Exception:
+            pass
@@ -0,0 +1,36 @@
+# 价格区间、房龄区间的划分，爬取时的统计、本地存储的查询和分析脚本共用
+from datetime import datetime
+
+UNKNOWN = '未知'
+# 总价（万元），左闭右开
+PRICE_BINS = (150, 300, 500, 1000)
+PRICE_LABELS = ('150万以下', '150-300万', '300-500万', '500-1000万', '1000万以上')
+# 房龄（年），右闭
+AGE_BINS = (5, 10, 20)
+AGE_LABELS = ('5年以内', '5-10年', '10-20年', '20年以上')
+
+PRICE_ORDER = list(PRICE_LABELS) + [UNKNOWN]
+AGE_ORDER = list(AGE_LABELS) + [UNKNOWN]
+
+
+def _missing(value):
+    return value is None or value != value
+
+
+def price_range_label(price):
+    if _missing(price):
+        return UNKNOWN
+    for bound, label in zip(PRICE_BINS, PRICE_LABELS):
+        if price < bound:
+            return label
+    return PRICE_LABELS[-1]
+
+
+def age_range_label(year, current_year=None):
+    if _missing(year):
+        return UNKNOWN
+    age = (current_year or datetime.now().year) - year
+    for bound, label in zip(AGE_BINS, AGE_LABELS):
+        if age <= bound:
+            return label
+    return AGE_LABELS[-1]
@@ -0,0 +1,139 @@
+# 条目在 Redis 里的编码格式，写入的 pipeline 和分析脚本共用
+#
+#   json     和 scrapy_redis 的 RedisPipeline 一样的 JSON 文本
+#   msgpack  MAGIC + 4 字节 schema id + msgpack 数组（按字段顺序的值）
+#            字段名不再随每条记录重复保存，schema id 对应的字段列表保存在
+#            Redis 的 <spider>:items:schemas 哈希里
+#   zstd     在 msgpack 的基础上再用 zstd 压缩，可以加载共享字典（对短记录效果明显）
+#
+# msgpack 和 zstandard 是可选依赖，只在用到对应格式时才需要（pip install msgpack zstandard）。
+# 读取时根据开头的字节自动识别格式，新旧格式的数据可以混在一起。
+import json
+import struct
+import zlib
+
+from itemadapter import ItemAdapter
+from scrapy.utils.serialize import ScrapyJSONEncoder
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+MSGPACK_MAGIC = b'\xfa\x01'
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+
+# 和 scrapy_redis.pipelines.default_serialize 相同
+json_serialize = ScrapyJSONEncoder().encode
+
+
+def schema_id(fields):
+    return zlib.crc32('\x00'.join(fields).encode('utf-8'))
+
+
+def train_dictionary(samples, size=16384):
+    # samples 是编码后（未压缩）的记录
+    if zstandard is None:
+        raise RuntimeError("训练 zstd 字典需要安装 zstandard（pip install zstandard）")
+    return zstandard.train_dictionary(size, list(samples)).as_bytes()
+
+
+class ItemCodec:
+    def __init__(self, fmt='json', compress=False, zstd_dict=None, level=3, schemas=None):
+        if fmt not in ('json', 'msgpack'):
+            raise ValueError(f"不支持的编码格式: {fmt}")
+        if fmt == 'msgpack' and msgpack is None:
+            raise RuntimeError("ITEM_CODEC = 'msgpack' 需要安装 msgpack（pip install msgpack），"
+                               "或者改回 ITEM_CODEC = 'json'")
+        if (compress or zstd_dict) and zstandard is None:
+            raise RuntimeError("ITEM_CODEC_ZSTD、ITEM_CODEC_ZSTD_DICT 需要安装 zstandard"
+                               "（pip install zstandard），或者关掉这两个设置")
+        self.fmt = fmt
+        self.compress = compress
+        self.zstd_dict = zstd_dict
+        self.level = level
+        # schema id -> 字段列表
+        self.schemas = dict(schemas or {})
+        # 本进程新出现、还没保存到 Redis 的 schema
+        self.new_schemas = {}
+        self.compressor = None
+        self.decompressor = None
+        if zstandard is not None:
+            dict_data = zstandard.ZstdCompressionDict(zstd_dict) if zstd_dict else None
+            if compress:
+                self.compressor = zstandard.ZstdCompressor(level=level, dict_data=dict_data)
+            self.decompressor = zstandard.ZstdDecompressor(dict_data=dict_data)
+
+    def __reduce__(self):
+        # zstd 的压缩器不能 pickle，发给子进程时按参数重新创建
+        return type(self), (self.fmt, self.compress, self.zstd_dict, self.level, self.schemas)
+
+    @classmethod
+    def from_settings(cls, settings, schemas=None):
+        zstd_dict = None
+        path = settings.get('ITEM_CODEC_ZSTD_DICT')
+        if path:
+            with open(path, 'rb') as f:
+                zstd_dict = f.read()
+        return cls(
+            fmt=settings.get('ITEM_CODEC', 'json'),
+            compress=settings.getbool('ITEM_CODEC_ZSTD'),
+            zstd_dict=zstd_dict,
+            level=settings.getint('ITEM_CODEC_ZSTD_LEVEL', 3),
+            schemas=schemas,
+        )
+
+    def load_schemas(self, server, key):
+        for sid, fields in server.hgetall(key).items():
+            self.schemas[int(sid)] = json.loads(fields)
+
+    def pop_new_schemas(self):
+        # 返回 {schema id: 字段列表的 JSON}，用来 HSET 到 Redis
+        new, self.new_schemas = self.new_schemas, {}
+        return {sid: json.dumps(fields, ensure_ascii=False) for sid, fields in new.items()}
+
+    def restore_schemas(self, schemas):
+        # pop_new_schemas() 取出的 schema 没能写进 Redis，放回去下次再写
+        for sid, fields in schemas.items():
+            self.new_schemas.setdefault(sid, json.loads(fields))
+
+    def encode(self, item):
+        if self.fmt == 'json':
+            data = json_serialize(item).encode('utf-8')
+        else:
+            adapter = ItemAdapter(item)
+            fields = sorted(adapter.field_names())
+            sid = schema_id(fields)
+            values = [adapter.get(field) for field in fields]
+            data = MSGPACK_MAGIC + struct.pack('>I', sid) + msgpack.packb(values, use_bin_type=True)
+            # 编码成功之后才登记 schema，序列化失败的条目不会留下没人用的 schema
+            if sid not in self.schemas:
+                self.schemas[sid] = fields
+                self.new_schemas[sid] = fields
+        if self.compressor is not None:
+            data = self.compressor.compress(data)
+        return data
+
+    def decode(self, data):
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        if data.startswith(ZSTD_MAGIC):
+            if self.decompressor is None:
+                raise RuntimeError("数据是 zstd 压缩的，需要安装 zstandard（pip install zstandard）")
+            data = self.decompressor.decompress(data)
+        if data.startswith(MSGPACK_MAGIC):
+            if msgpack is None:
+                raise RuntimeError("数据是 msgpack 编码的，需要安装 msgpack")
+            (sid,) = struct.unpack_from('>I', data, len(MSGPACK_MAGIC))
+            fields = self.schemas.get(sid)
+            if fields is None:
+                raise KeyError(f"未知的 schema id: {sid}")
+            values = msgpack.unpackb(data[len(MSGPACK_MAGIC) + 4:], raw=False)
+            # 和 JSON 一样，只返回有值的字段
+            return {field: value for field, value in zip(fields, values) if value is not None}
+        return json.loads(data)
@@ -0,0 +1,57 @@
+# scrapy compact：把 ParquetPipeline 在各节点、各次运行写出的 part 文件按分区合并
+#
+#   scrapy compact                    合并 PARQUET_DIR 下的所有分区
+#   scrapy compact data/parquet/esf   只合并某个目录
+#
+# 只处理已经写完的 .parquet 文件，正在写的 .inprogress 文件不受影响，可以在爬取时运行。
+import os
+
+from scrapy.commands import ScrapyCommand
+from scrapy.exceptions import UsageError
+
+from scrapy_fangtianxia.parquet import compact_partition, iter_partitions
+from scrapy_fangtianxia.pipelines import new_run_id
+
+
+class Command(ScrapyCommand):
+    requires_project = True
+    requires_crawler_process = False
+    default_settings = {'LOG_ENABLED': False}
+
+    def syntax(self):
+        return '[options] [dir ...]'
+
+    def short_desc(self):
+        return "按分区合并 ParquetPipeline 写出的 Parquet 文件"
+
+    def add_options(self, parser):
+        super().add_options(parser)
+        parser.add_argument('--min-files', type=int, default=2,
+                            help="分区里至少有这么多个文件才合并（默认 2）")
+        parser.add_argument('--row-group-size', type=int, default=100000,
+                            help="合并后每个 row group 的行数（默认 100000）")
+        parser.add_argument('--dry-run', action='store_true', help="只列出需要合并的分区")
+
+    def run(self, args, opts):
+        dirs = args or [self.settings.get('PARQUET_DIR')]
+        if not all(dirs):
+            raise UsageError("没有指定目录，也没有设置 PARQUET_DIR")
+        run_id = new_run_id()
+        total_files = total_rows = 0
+        for base_dir in dirs:
+            if not os.path.isdir(base_dir):
+                raise UsageError(f"目录不存在: {base_dir}")
+            for directory in iter_partitions(base_dir):
+                count = sum(1 for name in os.listdir(directory)
+                            if name.startswith('part-') and name.endswith('.parquet'))
+                if count < max(opts.min_files, 2):
+                    continue
+                if opts.dry_run:
+                    print(f'{directory}: {count} 个文件')
+                    continue
+                files, rows = compact_partition(directory, run_id, opts.row_group_size)
+                total_files += files
+                total_rows += rows
+                print(f'{directory}: 合并 {files} 个文件，{rows} 行')
+        if not opts.dry_run:
+            print(f'共合并 {total_files} 个文件，{total_rows} 行')
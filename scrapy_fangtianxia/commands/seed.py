@@ -0,0 +1,107 @@
+# scrapy seed：把选定省份/城市的新房、二手房列表页推进 start_urls，爬虫直接从列表页开始
+#
+#   scrapy seed --refresh                  重新下载城市目录（内容没变时不更新）并推送全部城市
+#   scrapy seed -p 广东 -c 北京 -t esf      只推广东全省和北京的二手房
+#   scrapy seed --html SoufunFamily.htm    从保存下来的目录页解析
+#   scrapy seed --list                     只列出缓存的城市目录
+#
+# 城市目录缓存在 Redis 里（见 directory.py），没有缓存时会先下载一次。
+# 配合 START_FROM_DIRECTORY = False，爬虫启动时不再处理目录页，只读 start_urls。
+import json
+import urllib.request
+
+from scrapy.commands import ScrapyCommand
+from scrapy.exceptions import UsageError
+from scrapy.http import HtmlResponse
+from scrapy_redis import connection
+
+from scrapy_fangtianxia.directory import (
+    DIRECTORY_URL, LISTING_TYPES, CityDirectory, content_hash, parse_cookies, parse_directory,
+    push_start_urls, select, start_payloads,
+)
+from scrapy_fangtianxia.spiders.fang import FangSpider
+
+
+def _split(values):
+    # -p 广东,浙江 -p 江苏 -> ['广东', '浙江', '江苏']
+    return [v.strip() for value in values or () for v in value.split(',') if v.strip()]
+
+
+class Command(ScrapyCommand):
+    requires_project = True
+    requires_crawler_process = False
+    default_settings = {'LOG_ENABLED': False}
+
+    def syntax(self):
+        return '[options]'
+
+    def short_desc(self):
+        return "把选定城市的列表页批量推进 Redis 的 start_urls"
+
+    def add_options(self, parser):
+        super().add_options(parser)
+        parser.add_argument('-p', '--province', action='append', help="省份，可以重复或用逗号分隔")
+        parser.add_argument('-c', '--city', action='append', help="城市，可以重复或用逗号分隔")
+        parser.add_argument('-t', '--type', action='append', choices=LISTING_TYPES,
+                            help="房源类型，默认新房和二手房都推")
+        parser.add_argument('--refresh', action='store_true', help="重新下载城市目录")
+        parser.add_argument('--html', metavar='FILE', help="从保存下来的目录页解析城市目录")
+        parser.add_argument('--list', action='store_true', help="只列出城市目录，不推送")
+        parser.add_argument('--export', metavar='FILE', help="把城市目录写成 JSON 文件")
+        parser.add_argument('--dry-run', action='store_true', help="只显示会推送多少个请求")
+
+    def run(self, args, opts):
+        server = connection.from_settings(self.settings)
+        key = self.settings.get('CITY_DIRECTORY_KEY', '%(spider)s:directory') % {'spider': FangSpider.name}
+        directory = CityDirectory(server, key)
+
+        digest, _, entries = directory.load()
+        if opts.html or opts.refresh or not entries:
+            body, response = self.fetch(opts.html)
+            if content_hash(body) == digest:
+                directory.save(digest, entries)
+                print('城市目录没有变化')
+            else:
+                entries = list(parse_directory(response))
+                if not entries:
+                    raise UsageError("目录页里没有解析出城市，可能被反爬拦截了")
+                directory.save(content_hash(body), entries)
+                print(f'城市目录已更新，{len(entries)} 个城市')
+
+        if opts.export:
+            with open(opts.export, 'w', encoding='utf-8') as f:
+                json.dump(entries, f, ensure_ascii=False, indent=1)
+        provinces, cities = _split(opts.province), _split(opts.city)
+        chosen = select(entries, provinces, cities)
+        unknown = set(provinces) - {e['province'] for e in entries} | set(cities) - {e['city'] for e in entries}
+        if unknown:
+            print(f'城市目录里没有: {", ".join(sorted(unknown))}')
+        if opts.list:
+            for entry in chosen:
+                print(f"{entry['province']}\t{entry['city']}\t{entry['newhouse']}\t{entry['esf']}")
+            return
+
+        payloads = start_payloads(chosen, opts.type or LISTING_TYPES)
+        if opts.dry_run:
+            print(f'将推送 {len(payloads)} 个请求（{len(chosen)} 个城市）')
+            return
+        count = push_start_urls(server, FangSpider.redis_key, payloads,
+                                as_set=self.settings.getbool('REDIS_START_URLS_AS_SET'))
+        print(f'已推送 {count} 个请求（{len(chosen)} 个城市）到 {FangSpider.redis_key}')
+
+    def fetch(self, path=None):
+        # 返回 (页面内容, HtmlResponse)，编码按页面声明的来
+        if path:
+            with open(path, 'rb') as f:
+                body = f.read()
+            return body, HtmlResponse(DIRECTORY_URL, body=body)
+        headers = dict(self.settings.getdict('DEFAULT_REQUEST_HEADERS'))
+        headers.setdefault('user-agent', self.settings.get('USER_AGENT'))
+        cookies = parse_cookies(self.settings.get('FANG_COOKIES'))
+        if cookies:
+            headers['cookie'] = '; '.join(f'{k}={v}' for k, v in cookies.items())
+        request = urllib.request.Request(DIRECTORY_URL, headers=headers)
+        with urllib.request.urlopen(request, timeout=self.settings.getint('DOWNLOAD_TIMEOUT', 30)) as f:
+            body = f.read()
+            content_type = f.headers.get('Content-Type', '')
+        return body, HtmlResponse(DIRECTORY_URL, body=body, headers={'Content-Type': content_type})
@@ -0,0 +1,109 @@
+# 城市目录：SoufunFamily.htm 里 省份 -> 城市 -> 新房/二手房列表地址 的对应表
+#
+#   <key>  哈希：hash（页面内容的 sha1）、updated（更新时间）、cities（JSON 列表）
+#
+# cities 的每一项是 {"province", "city", "newhouse", "esf"}。页面内容没变时只更新时间，
+# 爬虫启动时直接用缓存的目录生成列表页请求，超过 CITY_DIRECTORY_MAX_AGE 才重新下载目录页。
+# `scrapy seed` 用同一份目录把选定省份/城市的列表页批量推进 start_urls。
+import hashlib
+import json
+import re
+import time
+
+DIRECTORY_URL = 'https://www.fang.com/SoufunFamily.htm'
+LISTING_TYPES = ('newhouse', 'esf')
+
+
+def parse_cookies(cookie_str):
+    # 'a=1; b=2' -> {'a': '1', 'b': '2'}，没有 "=" 的部分忽略
+    cookies = {}
+    for item in (cookie_str or '').split(';'):
+        item = item.strip()
+        if '=' in item:
+            k, v = item.split('=', 1)  # 只按第一个 "=" 分割（防止值含 "="）
+            cookies[k] = v
+    return cookies
+
+
+def listing_urls(city_url):
+    # 城市首页 -> (新房列表, 二手房列表)，比如 https://bj.fang.com/ -> https://bj.newhouse.fang.com/house/s/
+    scheme, domain = city_url.split('.', 1)
+    if '/' in domain:
+        return scheme + '.newhouse.' + domain + 'house/s/', scheme + '.esf.' + domain
+    return scheme + '.newhouse.' + domain + '/' + 'house/s/', scheme + '.esf.' + domain + '/'
+
+
+def parse_directory(response):
+    # 逐个产出 {"province", "city", "newhouse", "esf"}
+    province = None
+    for tr in response.xpath('//div[@class="outCont"]//tr'):
+        tds = tr.xpath('.//td[not(@class)]')
+        province_text = tds[0].xpath('.//strong//text()').get(default='')
+        province_text = re.sub(r'\s', '', province_text)
+        if province_text:
+            province = province_text
+            if province == '其它':
+                continue
+        for city_link in tds[1].xpath('.//a'):
+            city = city_link.xpath('.//text()').get()
+            city_url = city_link.xpath('.//@href').get()
+            if not city or not city_url:
+                continue
+            newhouse, esf = listing_urls(city_url)
+            yield {'province': province, 'city': city, 'newhouse': newhouse, 'esf': esf}
+
+
+def content_hash(body):
+    return hashlib.sha1(body).hexdigest()
+
+
+def select(entries, provinces=None, cities=None):
+    # 只保留选定的省份或城市，都没选时返回全部
+    if not provinces and not cities:
+        return list(entries)
+    provinces, cities = set(provinces or ()), set(cities or ())
+    return [e for e in entries if e['province'] in provinces or e['city'] in cities]
+
+
+def start_payloads(entries, listing_types=LISTING_TYPES):
+    # 和 RecrawlPlanner 推的格式一样，FangSpider.make_request_from_data 直接生成列表页请求
+    return [json.dumps({'url': entry[t], 'listing_type': t, 'province': entry['province'],
+                        'city': entry['city']}, ensure_ascii=False)
+            for entry in entries for t in listing_types]
+
+
+def push_start_urls(server, key, payloads, as_set=False, chunk_size=1000):
+    # 每 chunk_size 个一条 RPUSH（REDIS_START_URLS_AS_SET 时 SADD），放在一个 pipeline 里一次发出；
+    # 爬虫用 LPOP 取，按推进去的顺序处理
+    pipe = server.pipeline(transaction=False)
+    for start in range(0, len(payloads), chunk_size):
+        chunk = payloads[start:start + chunk_size]
+        if as_set:
+            pipe.sadd(key, *chunk)
+        else:
+            pipe.rpush(key, *chunk)
+    pipe.execute()
+    return len(payloads)
+
+
+class CityDirectory:
+    def __init__(self, server, key='fang:directory'):
+        self.server = server
+        self.key = key
+
+    def load(self):
+        # 返回 (内容哈希, 更新时间, 城市列表)，没有缓存时是 (None, None, [])
+        data = self.server.hmget(self.key, ['hash', 'updated', 'cities'])
+        if data[2] is None:
+            return None, None, []
+        return data[0].decode(), float(data[1]), json.loads(data[2])
+
+    def save(self, digest, entries):
+        # 内容没变时只更新时间；返回是否更新了城市列表
+        old = self.server.hget(self.key, 'hash')
+        mapping = {'updated': time.time()}
+        changed = old is None or old.decode() != digest
+        if changed:
+            mapping.update(hash=digest, cities=json.dumps(list(entries), ensure_ascii=False))
+        self.server.hset(self.key, mapping=mapping)
+        return changed
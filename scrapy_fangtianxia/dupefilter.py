@@ -0,0 +1,139 @@
+# 基于 Redis 位图的布隆过滤器去重
+#
+# scrapy_redis 的 RFPDupeFilter 把每个请求的 40 位 SHA1 存进一个集合，全国城市
+# 持久化爬下来会无限增长。这里改成可扩展的布隆过滤器（Scalable Bloom Filter）：
+#   <key>        哈希，slices 为分片数，count 为当前分片已加入的数量
+#   <key>:<i>    第 i 个分片的位图
+# 当前分片装满（达到容量）后新开一个容量翻倍、误判率减半的分片，
+# 总误判率不超过 error_rate。单个分片的位图不能超过 2^32 位（512MB）。
+import hashlib
+
+from scrapy_redis.dupefilter import RFPDupeFilter
+
+# 检查所有分片，都没见过时加入最后一个分片；返回 1 表示见过。
+# 写成 Lua 函数，别的脚本（aggregates.py 的 RECORD_SCRIPT）可以拼在一起原子地去重
+BLOOM_ADD_FUNCTION = """
+local function bloom_add(bloom_key, h1, h2, capacity, error_rate, check_only)
+    h1, h2 = tonumber(h1), tonumber(h2)
+    -- 参数以第一次创建时为准，之后改配置不会打乱已有的位图
+    redis.call('hsetnx', bloom_key, 'capacity', capacity)
+    redis.call('hsetnx', bloom_key, 'error_rate', error_rate)
+    capacity = tonumber(redis.call('hget', bloom_key, 'capacity'))
+    error_rate = tonumber(redis.call('hget', bloom_key, 'error_rate'))
+    local slices = tonumber(redis.call('hget', bloom_key, 'slices') or '1')
+
+    local function layout(i)
+        local cap = capacity * 2 ^ i
+        local err = error_rate * 0.5 ^ (i + 1)
+        local m = math.ceil(-cap * math.log(err) / (math.log(2) ^ 2))
+        local k = math.ceil(math.log(2) * m / cap)
+        return cap, m, k
+    end
+
+    for i = 0, slices - 1 do
+        local _, m, k = layout(i)
+        local key = bloom_key .. ':' .. i
+        local found = true
+        for j = 0, k - 1 do
+            if redis.call('getbit', key, (h1 + j * h2) % m) == 0 then
+                found = false
+                break
+            end
+        end
+        if found then
+            return 1
+        end
+    end
+    if check_only == '1' then
+        return 0
+    end
+
+    local i = slices - 1
+    local cap, m, k = layout(i)
+    local key = bloom_key .. ':' .. i
+    for j = 0, k - 1 do
+        redis.call('setbit', key, (h1 + j * h2) % m, 1)
+    end
+    if redis.call('hincrby', bloom_key, 'count', 1) >= cap then
+        redis.call('hset', bloom_key, 'slices', slices + 1, 'count', 0)
+    end
+    return 0
+end
+"""
+
+# ARGV: h1, h2, capacity, error_rate, check_only
+ADD_SCRIPT = BLOOM_ADD_FUNCTION + """
+return bloom_add(KEYS[1], ARGV[1], ARGV[2], ARGV[3], ARGV[4], ARGV[5])
+"""
+
+
+def bloom_hashes(value):
+    # 双重哈希：第 j 个位置为 h1 + j * h2
+    digest = hashlib.md5(value.encode('utf-8')).digest()
+    h1 = int.from_bytes(digest[:4], 'big')
+    h2 = int.from_bytes(digest[4:8], 'big') | 1
+    return h1, h2
+
+
+class BloomFilter:
+    def __init__(self, server, key, capacity=1000000, error_rate=0.001):
+        self.server = server
+        self.key = key
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self._script = server.register_script(ADD_SCRIPT)
+
+    def _run(self, value, check_only):
+        h1, h2 = bloom_hashes(value)
+        return self._script(keys=[self.key],
+                            args=[h1, h2, self.capacity, self.error_rate, int(check_only)]) == 1
+
+    def add(self, value):
+        # 返回 True 表示之前（可能）见过
+        return self._run(value, False)
+
+    def add_many(self, values):
+        # 一次往返加入一批，按顺序返回每个值之前是否（可能）见过；同一批里重复的值后面的算见过
+        pipe = self.server.pipeline(transaction=False)
+        for value in values:
+            h1, h2 = bloom_hashes(value)
+            self._script(keys=[self.key], args=[h1, h2, self.capacity, self.error_rate, 0], client=pipe)
+        return [result == 1 for result in pipe.execute()]
+
+    def __contains__(self, value):
+        return self._run(value, True)
+
+    def memory_usage(self):
+        slices = int(self.server.hget(self.key, 'slices') or 1)
+        return sum(self.server.strlen(f'{self.key}:{i}') for i in range(slices))
+
+    def clear(self):
+        slices = int(self.server.hget(self.key, 'slices') or 1)
+        self.server.delete(self.key, *[f'{self.key}:{i}' for i in range(slices)])
+
+
+class BloomDupeFilter(RFPDupeFilter):
+    def __init__(self, server, key, debug=False, capacity=1000000, error_rate=0.001):
+        super().__init__(server, key, debug)
+        # 不和原来 RFPDupeFilter 的集合共用一个 key
+        self.bloom = BloomFilter(server, f'{key}:bloom', capacity, error_rate)
+
+    @classmethod
+    def from_settings(cls, settings):
+        return cls._configure(super().from_settings(settings), settings)
+
+    @classmethod
+    def from_spider(cls, spider):
+        return cls._configure(super().from_spider(spider), spider.settings)
+
+    @staticmethod
+    def _configure(df, settings):
+        df.bloom.capacity = settings.getint('BLOOMFILTER_CAPACITY', df.bloom.capacity)
+        df.bloom.error_rate = settings.getfloat('BLOOMFILTER_ERROR_RATE', df.bloom.error_rate)
+        return df
+
+    def request_seen(self, request):
+        return self.bloom.add(self.request_fingerprint(request))
+
+    def clear(self):
+        self.bloom.clear()
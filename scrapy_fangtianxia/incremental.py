@@ -0,0 +1,43 @@
+# 增量爬取：记录每个城市、每种房源已经见过的 origin_url
+#
+# <key>:<type>:<city>  哈希，origin_url -> 条目内容的摘要
+# 内容没变的房源直接跳过，不进入 pipeline；
+# 一页里的房源全都见过时，这个城市就不用再往后翻页了。
+import hashlib
+import json
+
+from itemadapter import ItemAdapter
+
+
+def item_digest(item):
+    data = json.dumps(ItemAdapter(item).asdict(), sort_keys=True, ensure_ascii=False)
+    return hashlib.sha1(data.encode('utf-8')).hexdigest()[:16]
+
+
+class SeenListings:
+    def __init__(self, server, key='fang:seen'):
+        self.server = server
+        self.key = key
+
+    @classmethod
+    def from_spider(cls, spider):
+        key = spider.settings.get('INCREMENTAL_SEEN_KEY', '%(spider)s:seen')
+        return cls(spider.server, key=key % {'spider': spider.name})
+
+    def filter(self, listing_type, city, items):
+        # 返回 (有变化的条目, 这一页是否全都见过)，没有 origin_url 的条目原样返回
+        passthrough = [item for item in items if not item.get('origin_url')]
+        items = [item for item in items if item.get('origin_url')]
+        if not items:
+            return passthrough, False
+        key = f'{self.key}:{listing_type}:{city}'
+        known = self.server.hmget(key, [item['origin_url'] for item in items])
+
+        changed = {}
+        for item, old in zip(items, known):
+            digest = item_digest(item)
+            if old is None or (old.decode() if isinstance(old, bytes) else old) != digest:
+                changed[item['origin_url']] = (item, digest)
+        if changed:
+            self.server.hset(key, mapping={url: digest for url, (_, digest) in changed.items()})
+        return passthrough + [item for item, _ in changed.values()], all(old is not None for old in known)
@@ -27,6 +27,15 @@ class NewHouseItem(scrapy.Item):
     sale = scrapy.Field()
     # 新房的URL
     origin_url = scrapy.Field()
+    # 以下由 NormalizePipeline 从上面的文本解析出来
+    # 总价（万元）
+    price_wan = scrapy.Field()
+    # 均价（元/㎡）
+    unit_price_yuan = scrapy.Field()
+    # 面积（㎡，范围取下限）
+    area_m2 = scrapy.Field()
+    # 最小户型的居室数
+    room_count = scrapy.Field()
 
 class ESFHouseItem(scrapy.Item):
     # 省份
@@ -52,4 +61,21 @@ class ESFHouseItem(scrapy.Item):
     # 单价
     unit_price = scrapy.Field()
     # 二手房原始url
-    origin_url = scrapy.Field()
\ No newline at end of file
+    origin_url = scrapy.Field()
+    # 以下由 NormalizePipeline 从上面的文本解析出来
+    # 总价（万元）
+    price_wan = scrapy.Field()
+    # 单价（元/㎡）
+    unit_price_yuan = scrapy.Field()
+    # 面积（㎡）
+    area_m2 = scrapy.Field()
+    # 建成年份
+    year_built = scrapy.Field()
+    # 楼层位置（0 低 / 1 中 / 2 高）
+    floor_level = scrapy.Field()
+    # 总层数
+    total_floors = scrapy.Field()
+    # 几室
+    room_count = scrapy.Field()
+    # 几厅
+    hall_count = scrapy.Field()
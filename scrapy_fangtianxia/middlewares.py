@@ -5,19 +5,56 @@
 from scrapy import Request
 from scrapy import signals
 import scrapy
-from scrapy.http import HtmlResponse
+from scrapy.http import HtmlResponse, TextResponse
+from scrapy.utils.defer import maybe_deferred_to_future
+from scrapy.exceptions import IgnoreRequest
+from twisted.internet.task import LoopingCall, deferLater
+from twisted.internet.threads import deferToThread, deferToThreadPool
+from twisted.python.threadpool import ThreadPool
 from selenium import webdriver
 from selenium.webdriver.chrome.service import Service
 from selenium.webdriver.common.by import By
+from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.common.action_chains import ActionChains
 from selenium.webdriver.chrome.options import Options
 import time
 import random
+from urllib.parse import urlparse
+
+from scrapy_fangtianxia.browser import BrowserPool
+from scrapy_fangtianxia.sessions import RedisSessionStore, session_scope
 
 # useful for handling different item types with a single interface
 from itemadapter import is_item, ItemAdapter
 
+# 滑块验证页所在的域名
+CAPTCHA_HOST = "check.3g.fang.com"
+# 验证时不需要下载的资源
+BLOCKED_RESOURCES = [
+    '*.png', '*.jpg', '*.jpeg', '*.gif', '*.webp', '*.svg', '*.ico',
+    '*.woff', '*.woff2', '*.ttf', '*.otf', '*.eot',
+    '*.css',
+]
+
+# 验证码信号，参数都带 host（跳转到验证页之前的域名），TelemetryExtension 用来统计
+captcha_detected = object()
+# 另外带 timings：各阶段耗时（秒）
+captcha_solved = object()
+captcha_failed = object()
+
+
+def is_captcha_response(response):
+    if CAPTCHA_HOST in response.url:
+        return True
+    # 图片等二进制响应没有 text，不用检查
+    return isinstance(response, TextResponse) and "拖动滑块验证" in response.text
+
+
+def _origin_url(request):
+    # 被跳转到验证页的请求，取跳转前最初的地址
+    return request.meta.get('redirect_urls', [request.url])[0]
+
 
 class ScrapyFangtianxiaSpiderMiddleware:
     # Not all methods need to be defined. If a method is not defined,
@@ -113,36 +150,236 @@ class ScrapyFangtianxiaDownloaderMiddleware:
         spider.logger.info("Spider opened: %s" % spider.name)
 
 class SliderCaptchaMiddleware:
-    def __init__(self):
+    def __init__(self, stats=None, signals=None, driver_path=None, pool_size=2, max_uses=50, idle_timeout=300,
+                 sessions=None, session_scope='domain', session_poll_interval=1, max_session_retries=3,
+                 solve_timeout=10, blocked_resources=None):
+        self.stats = stats
+        self.signals = signals
+        self.blocked_resources = BLOCKED_RESOURCES if blocked_resources is None else blocked_resources
+        # 等待滑块出现、等待验证通过的超时时间
+        self.solve_timeout = solve_timeout
+        # 验证后的会话保存在 Redis，集群内同一个域名只需要验证一次
+        self.sessions = sessions
+        self.session_scope = session_scope
+        self.session_poll_interval = session_poll_interval
+        self.max_session_retries = max_session_retries
+        self.driver_path = driver_path
+        # 浏览器按需启动，没遇到验证码的节点不会启动 Chrome
+        self.browsers = BrowserPool(self._create_driver, size=pool_size,
+                                    max_uses=max_uses, idle_timeout=idle_timeout)
+        # Selenium 是阻塞调用，放到独立的工作线程里执行，避免卡住 reactor
+        # 每个浏览器对应一个线程，多个城市同时遇到验证码时可以并行处理
+        self.pool = ThreadPool(minthreads=0, maxthreads=pool_size, name='slider-captcha')
+        self.pool.start()
+        self.reaper = LoopingCall(self._reap_idle)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        s = cls(
+            crawler.stats,
+            signals=crawler.signals,
+            driver_path=settings.get('CHROMEDRIVER_PATH'),
+            pool_size=settings.getint('CAPTCHA_BROWSER_POOL_SIZE', 2),
+            max_uses=settings.getint('CAPTCHA_BROWSER_MAX_USES', 50),
+            idle_timeout=settings.getfloat('CAPTCHA_BROWSER_IDLE_TIMEOUT', 300),
+            sessions=RedisSessionStore.from_crawler(crawler)
+            if settings.getbool('CAPTCHA_SESSION_ENABLED', True) else None,
+            session_scope=settings.get('CAPTCHA_SESSION_SCOPE', 'domain'),
+            session_poll_interval=settings.getfloat('CAPTCHA_SESSION_POLL_INTERVAL', 1),
+            max_session_retries=settings.getint('CAPTCHA_SESSION_MAX_RETRIES', 3),
+            solve_timeout=settings.getfloat('CAPTCHA_SOLVE_TIMEOUT', 10),
+            blocked_resources=settings.getlist('CAPTCHA_BLOCKED_RESOURCES', BLOCKED_RESOURCES),
+        )
+        crawler.signals.connect(s.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(s.close, signal=signals.spider_closed)
+        return s
+
+    def spider_opened(self, spider):
+        # 定期检查空闲的浏览器
+        self.reaper.start(max(self.browsers.idle_timeout / 2, 1), now=False)
+
+    def _reap_idle(self):
+        from twisted.internet import reactor
+        return deferToThreadPool(reactor, self.pool, self.browsers.reap_idle)
+
+    def _create_driver(self):
         # 初始化浏览器（无头模式，避免弹窗）
-        service = Service(r'D:\chromedriver-win64\chromedriver-win64\chromedriver.exe')
+        service = Service(self.driver_path) if self.driver_path else Service()
         chrome_options = Options()
         chrome_options.add_argument('--headless')  # 无头模式
         chrome_options.add_argument('--disable-gpu')
         chrome_options.add_argument('--no-sandbox')
-        self.driver = webdriver.Chrome(options=chrome_options,service=service)
+        # DOM 就绪就返回，不等图片等资源加载完
+        chrome_options.page_load_strategy = 'eager'
+        chrome_options.add_experimental_option('prefs', {
+            'profile.managed_default_content_settings.images': 2,  # 不加载图片
+        })
+        driver = webdriver.Chrome(options=chrome_options, service=service)
+        # 验证页不需要图片、字体和样式表，直接屏蔽
+        driver.execute_cdp_cmd('Network.enable', {})
+        driver.execute_cdp_cmd('Network.setBlockedURLs', {'urls': self.blocked_resources})
+        return driver
+
+    async def process_request(self, request, spider):
+        if self.sessions is None:
+            return None
+        scope = self._scope(request)
+        if self.sessions.stale(scope):
+            session = await self._redis(self.sessions.get, scope)
+        else:
+            session = self.sessions.cached(scope)
+        if session:
+            # 带上集群共享的验证后 Cookie
+            request.cookies.update(session['cookies'])
+            request.meta['captcha_session'] = session['version']
+        return None
 
-    def process_response(self, request, response, spider):
-        if "check.3g.fang.com" in response.url or "拖动滑块验证" in response.text:
+    async def process_response(self, request, response, spider):
+        if not is_captcha_response(response):
+            return response
+
+        if self.stats:
+            self.stats.inc_value('captcha/detected', spider=spider)
+        self._send(captcha_detected, request)
+        if self.sessions is None:
+            return await self._solve_response(request, response, spider)
+
+        scope = self._scope(request)
+        seen_version = request.meta.get('captcha_session')
+        session = await self._redis(self.sessions.get, scope)
+        if session and session['version'] != seen_version:
+            # 发出请求之后别的 worker 已经验证过了，直接带新 Cookie 重试
+            return self._retry(request, session, spider)
+
+        # 同一个 scope 只有拿到锁的 worker 验证；拿不到锁就等别人的结果，
+        # 持有者放弃或锁过期之后再抢，抢了 max_session_retries 轮还没抢到就把请求重新排队
+        token = await self._redis(self.sessions.acquire, scope)
+        for _ in range(self.max_session_retries):
+            if token is not None:
+                break
+            session = await self._wait_for_session(scope, seen_version)
+            if session:
+                return self._retry(request, session, spider)
+            token = await self._redis(self.sessions.acquire, scope)
+        if token is None:
+            return self._reschedule(request, spider)
+        try:
+            new_response = await self._solve_response(request, response, spider)
+            await self._redis(self.sessions.save, scope, dict(request.cookies))
+            return new_response
+        finally:
+            await self._redis(self.sessions.release, scope, token)
+
+    async def _solve_response(self, request, response, spider):
+        from twisted.internet import reactor
+        try:
+            # 在工作线程中完成滑块验证，验证期间 reactor 继续处理其他请求
+            url, body, cookie_dict, timings = await maybe_deferred_to_future(deferToThreadPool(
+                reactor, self.pool, self._solve, dict(request.cookies), response.url))
+        except Exception as e:
+            spider.logger.error(f"滑块验证失败: {e}")
+            if self.stats:
+                self.stats.inc_value('captcha/failed', spider=spider)
+            self._send(captcha_failed, request)
+            # 验证失败，抛出异常
+            raise
+        timings['total'] = sum(timings.values())
+        self._send(captcha_solved, request, timings=timings)
+        if self.stats:
+            self.stats.inc_value('captcha/solved', spider=spider)
+            # 各阶段耗时（毫秒），总和除以 captcha/solved 就是平均耗时
+            for phase, seconds in timings.items():
+                ms = int(seconds * 1000)
+                self.stats.inc_value(f'captcha/time/{phase}_ms', ms, spider=spider)
+                self.stats.max_value(f'captcha/time/{phase}_ms_max', ms, spider=spider)
+
+        # 更新请求的Cookie，确保后续请求携带验证状态
+        request.cookies.update(cookie_dict)
+
+        #将验证后的页面转为 Scrapy 响应
+        return HtmlResponse(
+            url=url,
+            body=body,
+            encoding="utf-8",
+            request=request
+        )
+
+    async def _wait_for_session(self, scope, seen_version):
+        from twisted.internet import reactor
+        deadline = time.monotonic() + self.sessions.lock_timeout
+        while time.monotonic() < deadline:
+            await maybe_deferred_to_future(deferLater(reactor, self.session_poll_interval, lambda: None))
+            session = await self._redis(self.sessions.get, scope)
+            if session and session['version'] != seen_version:
+                return session
+            if not await self._redis(self.sessions.locked, scope):
+                # 持有锁的 worker 验证失败了，由当前 worker 重新验证
+                return None
+        return None
+
+    @staticmethod
+    async def _redis(func, *args):
+        # 会话存储的 Redis 调用是阻塞的，放到 reactor 的线程池里，不占用验证浏览器的线程
+        return await maybe_deferred_to_future(deferToThread(func, *args))
+
+    def _reschedule(self, request, spider):
+        # 一直没抢到验证锁：原请求重新排队，之后带着那时的会话再试
+        retries = request.meta.get('captcha_retries', 0)
+        if retries >= self.max_session_retries:
+            raise IgnoreRequest(f"等待验证锁次数过多: {request.url}")
+        if self.stats:
+            self.stats.inc_value('captcha/lock_rescheduled', spider=spider)
+        meta = dict(request.meta, captcha_retries=retries + 1)
+        meta.pop('captcha_session', None)
+        return request.replace(url=_origin_url(request), meta=meta, dont_filter=True)
+
+    def _retry(self, request, session, spider):
+        retries = request.meta.get('captcha_retries', 0)
+        if retries >= self.max_session_retries:
+            raise IgnoreRequest(f"共享会话重试次数过多: {request.url}")
+        if self.stats:
+            self.stats.inc_value('captcha/session_reused', spider=spider)
+        cookies = dict(request.cookies)
+        cookies.update(session['cookies'])
+        meta = dict(request.meta, captcha_session=session['version'], captcha_retries=retries + 1)
+        # 验证页是跳转过来的，重试最初的地址
+        return request.replace(url=_origin_url(request), cookies=cookies, meta=meta, dont_filter=True)
+
+    def _send(self, signal, request, **kwargs):
+        if self.signals is not None:
+            self.signals.send_catch_log(signal, host=urlparse(_origin_url(request)).hostname or '', **kwargs)
+
+    def _scope(self, request):
+        return session_scope(urlparse(_origin_url(request)).hostname, self.session_scope)
+
+    def _solve(self, cookies, url):
+        # 运行在工作线程中，不要在这里访问 reactor 或 Scrapy 的对象
+        timings = {}
+        with self.browsers.lease() as driver:
             try:
+                start = time.perf_counter()
                 # 注入爬虫的 Cookie（保持会话一致）
-                self.driver.delete_all_cookies()  # 清空原有 Cookie
-                for k, v in request.cookies.items():
-                    self.driver.add_cookie({
+                driver.execute_cdp_cmd('Network.clearBrowserCookies', {})  # 清空原有 Cookie
+                for k, v in cookies.items():
+                    # 通过 CDP 设置，不需要先打开 fang.com 的页面
+                    driver.execute_cdp_cmd('Network.setCookie', {
                         "name": k,
                         "value": v,
                         "domain": ".fang.com"  # 注意域名，需覆盖子域名
                     })
 
-                # 重新加载验证页面（携带爬虫的 Cookie）
-                self.driver.get(response.url)
-                time.sleep(3)  
-
-                
-                slider = self.driver.find_element(By.CSS_SELECTOR, ".handler.handler_bg")  # 滑块
-                container = self.driver.find_element(By.CSS_SELECTOR,".drag_text")  # 滑块容器
-
-                action = ActionChains(self.driver)
+                # 重新加载验证页面（携带爬虫的 Cookie），等到滑块出现即可
+                driver.get(url)
+                wait = WebDriverWait(driver, self.solve_timeout)
+                slider = wait.until(EC.presence_of_element_located((By.CSS_SELECTOR, ".handler.handler_bg")))  # 滑块
+                container = driver.find_element(By.CSS_SELECTOR,".drag_text")  # 滑块容器
+                timings['load'] = time.perf_counter() - start
+
+                start = time.perf_counter()
+                # 模拟人的反应时间
+                time.sleep(random.uniform(0.2, 0.5))
+                action = ActionChains(driver)
                 action.click_and_hold(slider).perform()  # 按住滑块
 
                 container_width = int(container.value_of_css_property("width").replace("px", ""))  # 300
@@ -152,39 +389,21 @@ class SliderCaptchaMiddleware:
                 action.move_by_offset(distance, 0).perform()
                 time.sleep(random.uniform(0.05, 0.1))
 
-
                 action.release().perform()  # 释放滑块
-                time.sleep(3)  # 等待验证结果（页面跳转或提示）
+                timings['drag'] = time.perf_counter() - start
 
-                WebDriverWait(self.driver, 10).until(
-                    lambda d: "check.3g.fang.com" not in d.current_url
-                )
-
-                new_cookies = self.driver.get_cookies()
+                start = time.perf_counter()
+                # 等待验证结果：离开验证页并且拿到了 Cookie
+                wait.until(lambda d: CAPTCHA_HOST not in d.current_url and d.get_cookies())
+                new_cookies = driver.get_cookies()
                 cookie_dict = {cookie["name"]: cookie["value"] for cookie in new_cookies}
-
-                # 更新请求的Cookie，确保后续请求携带验证状态
-                request.cookies.update(cookie_dict)
-                
-                #将验证后的页面转为 Scrapy 响应
-                new_body = self.driver.page_source.encode("utf-8")
-                new_response = HtmlResponse(
-                    url=self.driver.current_url,
-                    body=new_body,
-                    encoding="utf-8",
-                    request=request
-                )
-                return new_response
-
-            except Exception as e:
-                spider.logger.error(f"滑块验证失败: {e}")
-                # 验证失败，抛出异常
-                raise e
+                timings['verify'] = time.perf_counter() - start
+                return driver.current_url, driver.page_source.encode("utf-8"), cookie_dict, timings
             finally:
-                self.driver.delete_all_cookies()  # 清理 Cookie，避免干扰后续请求
-
-        return response
-
+                driver.execute_cdp_cmd('Network.clearBrowserCookies', {})  # 清理 Cookie，避免干扰后续请求
 
     def close(self, spider):
-        self.driver.quit()
+        if self.reaper.running:
+            self.reaper.stop()
+        self.browsers.close()
+        self.pool.stop()
@@ -0,0 +1,122 @@
+# 把页面上的原始文本解析成数值字段，在爬取时做一次，分析时不用再跑正则
+#
+#   price         "350万" "1.2亿" "35,000元/㎡" -> price_wan（总价，万元）/ unit_price_yuan
+#   unit_price    "39325元/㎡"                 -> unit_price_yuan（元/㎡）
+#   area          "89.5㎡" "89~143平米"         -> area_m2（范围取下限）
+#   year          "2010年建"                   -> year_built
+#   floor         "中层（共33层）" "5层（共6层）"  -> floor_level（0 低 / 1 中 / 2 高）、total_floors
+#   rooms         "3室2厅" ['3居', '/', '4居']  -> room_count（多个户型取最小）、hall_count
+#
+# 新房页面上给的价格多数是每平米均价，所以带 "/㎡" 的价格算作单价。
+# 解析不出来的字段不设置，原始文本只在 NORMALIZE_KEEP_RAW 打开时保留。
+import re
+from datetime import datetime
+
+NUMBER = re.compile(r'\d+(?:\.\d+)?')
+# 千分位分隔符，"1,200万" "3，500元/㎡"
+THOUSANDS = re.compile(r'(?<=\d)[,，](?=\d{3}(?!\d))')
+ROOMS = re.compile(r'(\d+)\s*[室居]')
+HALLS = re.compile(r'(\d+)\s*厅')
+YEAR = re.compile(r'(\d{4})\s*年')
+TOTAL_FLOORS = re.compile(r'共\s*(\d+)\s*层')
+FLOOR = re.compile(r'(\d+)\s*层')
+FLOOR_LEVEL = re.compile(r'([低底中高顶])\s*(?:楼)?层')
+
+FLOOR_LEVELS = ('低', '中', '高')
+LEVEL_CHARS = {'低': 0, '底': 0, '中': 1, '高': 2, '顶': 2}
+UNIT_PRICE_MARKS = ('/㎡', '/平', '每平')
+# 解析后会去掉的原始字段
+RAW_FIELDS = ('price', 'unit_price', 'area', 'year', 'floor', 'rooms')
+
+
+def _text(value):
+    if isinstance(value, (list, tuple)):
+        value = ''.join(v for v in value if v)
+    return value.strip() if isinstance(value, str) else ''
+
+
+def _number(text):
+    match = NUMBER.search(THOUSANDS.sub('', text))
+    return float(match.group()) if match else None
+
+
+def parse_price(value):
+    # 返回 (总价 万元, 单价 元/㎡)，只会有一个不是 None
+    text = _text(value)
+    number = _number(text)
+    if number is None:
+        return None, None
+    if any(mark in text for mark in UNIT_PRICE_MARKS):
+        return None, number * 10000 if '万' in text else number
+    if '亿' in text:
+        return number * 10000, None
+    if '元' in text and '万' not in text:
+        return number / 10000, None
+    return number, None
+
+
+def parse_unit_price(value):
+    text = _text(value)
+    number = _number(text)
+    if number is not None and '万' in text:
+        number *= 10000
+    return number
+
+
+def parse_area(value):
+    return _number(_text(value))
+
+
+def parse_year(value, current_year=None):
+    match = YEAR.search(_text(value))
+    if not match:
+        return None
+    year = int(match.group(1))
+    return year if 1900 <= year <= (current_year or datetime.now().year) else None
+
+
+def parse_floor(value):
+    # 返回 (楼层位置, 总层数)，给了具体楼层时按总层数的三等分换算成低中高
+    text = _text(value)
+    total = TOTAL_FLOORS.search(text)
+    total = int(total.group(1)) if total else None
+    level = FLOOR_LEVEL.search(text)
+    if level:
+        return LEVEL_CHARS[level.group(1)], total
+    floor = FLOOR.search(TOTAL_FLOORS.sub('', text))
+    if floor and total:
+        return min(2, (int(floor.group(1)) - 1) * 3 // total), total
+    return None, total
+
+
+def parse_rooms(value):
+    text = _text(value)
+    rooms = [int(n) for n in ROOMS.findall(text)]
+    halls = HALLS.search(text)
+    return min(rooms) if rooms else None, int(halls.group(1)) if halls else None
+
+
+def normalize(adapter, keep_raw=False, current_year=None):
+    # 就地修改 ItemAdapter，只设置条目里定义了的字段
+    fields = {}
+    if adapter.get('price'):
+        fields['price_wan'], fields['unit_price_yuan'] = parse_price(adapter['price'])
+    if adapter.get('unit_price'):
+        fields['unit_price_yuan'] = parse_unit_price(adapter['unit_price'])
+    if adapter.get('area'):
+        fields['area_m2'] = parse_area(adapter['area'])
+    if adapter.get('year'):
+        fields['year_built'] = parse_year(adapter['year'], current_year)
+    if adapter.get('floor'):
+        fields['floor_level'], fields['total_floors'] = parse_floor(adapter['floor'])
+    if adapter.get('rooms'):
+        fields['room_count'], fields['hall_count'] = parse_rooms(adapter['rooms'])
+
+    names = adapter.field_names()
+    for name, value in fields.items():
+        if value is not None and name in names:
+            adapter[name] = value
+    if not keep_raw:
+        for name in RAW_FIELDS:
+            adapter.pop(name, None)
+    return adapter
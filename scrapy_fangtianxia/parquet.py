@@ -0,0 +1,164 @@
+# 按省份/城市分区的 Parquet 数据集
+#
+#   <PARQUET_DIR>/<newhouse|esf>/province=<省份>/city=<城市>/part-<节点>-<运行>-<序号>.parquet
+#
+# 每个分区一个写入中的文件，每次 flush 追加一个 row group；文件写完（关闭）之前后缀是
+# .inprogress，读的一方和合并命令只看 .parquet。文件名带节点名和本次运行的 id，
+# 多个节点写同一个目录不会互相覆盖，`scrapy compact` 再把同一分区的小文件合并成一个。
+# province/city 只体现在目录名里（hive 分区），用 dataset() 读时会还原成列：
+#
+#   dataset('data/parquet/esf').to_table(
+#       columns=['price_wan', 'area_m2'], filter=ds.field('city') == '广州')
+import os
+from collections import OrderedDict
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = ds = pq = None
+
+PARTITION_FIELDS = ('province', 'city')
+# 和 pyarrow 读 hive 分区时的约定一致
+NULL_PARTITION = '__HIVE_DEFAULT_PARTITION__'
+IN_PROGRESS = '.inprogress'
+
+# NormalizePipeline 生成的数值字段，其他字段都按字符串保存
+FIELD_TYPES = {
+    'price_wan': 'float64',
+    'unit_price_yuan': 'float64',
+    'area_m2': 'float64',
+    'year_built': 'int16',
+    'floor_level': 'int8',
+    'total_floors': 'int16',
+    'room_count': 'int8',
+    'hall_count': 'int8',
+}
+
+
+def require_pyarrow():
+    if pa is None:
+        raise RuntimeError("Parquet 输出需要安装 pyarrow")
+
+
+def item_schema(item_cls):
+    require_pyarrow()
+    return pa.schema([(name, pa.type_for_alias(FIELD_TYPES.get(name, 'string')))
+                      for name in item_cls.fields if name not in PARTITION_FIELDS])
+
+
+def _segment(value):
+    # 分区值里的 / 和 % 需要转义，pyarrow 读的时候会按 URI 编码还原
+    if value is None or value == '':
+        return NULL_PARTITION
+    return str(value).replace('%', '%25').replace('/', '%2F')
+
+
+def partition_path(values):
+    return os.path.join(*[f'{name}={_segment(value)}' for name, value in zip(PARTITION_FIELDS, values)])
+
+
+def _cell(value):
+    # 新房的 rooms 是列表（['3居', '/', '4居']）
+    if isinstance(value, (list, tuple)):
+        return ''.join(str(v) for v in value if v)
+    return value
+
+
+def to_record_batch(rows, schema):
+    columns = []
+    for field in schema:
+        values = [_cell(row.get(field.name)) for row in rows]
+        if pa.types.is_string(field.type):
+            values = [None if v is None else str(v) for v in values]
+        columns.append(pa.array(values, type=field.type))
+    return pa.RecordBatch.from_arrays(columns, schema=schema)
+
+
+class PartitionedParquetWriter:
+    # 同时打开的文件数有上限，超出时关掉最久没写的分区，之后再写这个分区会开一个新文件
+    def __init__(self, base_dir, schema, node_id, run_id, max_open_files=64, compression='zstd'):
+        require_pyarrow()
+        self.base_dir = base_dir
+        self.schema = schema
+        self.node_id = node_id
+        self.run_id = run_id
+        self.max_open_files = max_open_files
+        self.compression = compression
+        self.writers = OrderedDict()
+        self.sequence = 0
+        self.files_written = 0
+
+    def write(self, rows):
+        # rows 是字典列表（含 province/city），按分区各写一个 row group
+        partitions = {}
+        for row in rows:
+            partitions.setdefault(tuple(row.get(name) for name in PARTITION_FIELDS), []).append(row)
+        for values, part in partitions.items():
+            self._writer(values).write_batch(to_record_batch(part, self.schema))
+        return len(partitions)
+
+    def _writer(self, values):
+        path = partition_path(values)
+        entry = self.writers.get(path)
+        if entry is not None:
+            self.writers.move_to_end(path)
+            return entry[0]
+        while len(self.writers) >= self.max_open_files:
+            self._close(*self.writers.popitem(last=False))
+        directory = os.path.join(self.base_dir, path)
+        os.makedirs(directory, exist_ok=True)
+        self.sequence += 1
+        filename = os.path.join(directory, f'part-{self.node_id}-{self.run_id}-{self.sequence:05d}.parquet')
+        writer = pq.ParquetWriter(filename + IN_PROGRESS, self.schema, compression=self.compression)
+        self.writers[path] = (writer, filename)
+        return writer
+
+    def size(self):
+        # 当前打开的各分区文件的总大小
+        return sum(os.path.getsize(filename + IN_PROGRESS) for _, filename in self.writers.values())
+
+    def _close(self, path, entry):
+        writer, filename = entry
+        writer.close()
+        os.replace(filename + IN_PROGRESS, filename)
+        self.files_written += 1
+
+    def close(self):
+        while self.writers:
+            self._close(*self.writers.popitem(last=False))
+
+
+def compact_partition(directory, run_id, row_group_size=100000):
+    # 把一个分区目录里已经写完的 part 文件合并成一个，返回 (合并的文件数, 行数)
+    require_pyarrow()
+    files = sorted(os.path.join(directory, name) for name in os.listdir(directory)
+                   if name.startswith('part-') and name.endswith('.parquet'))
+    if len(files) < 2:
+        return 0, 0
+    # 中途改过 NORMALIZE_KEEP_RAW 等配置时，各文件的列可能不一样
+    table = pa.concat_tables([pq.read_table(f, partitioning=None) for f in files], promote_options='default')
+    target = os.path.join(directory, f'part-compacted-{run_id}.parquet')
+    pq.write_table(table, target + IN_PROGRESS, row_group_size=row_group_size, compression='zstd')
+    os.replace(target + IN_PROGRESS, target)
+    for f in files:
+        os.remove(f)
+    return len(files), table.num_rows
+
+
+def iter_partitions(base_dir):
+    for root, dirs, files in os.walk(base_dir):
+        dirs.sort()
+        if any(name.endswith('.parquet') for name in files):
+            yield root
+
+
+def dataset(base_dir):
+    # 分区列的类型写死成字符串，只有空值的分区推断不出类型
+    require_pyarrow()
+    partitioning = ds.partitioning(pa.schema([(name, pa.string()) for name in PARTITION_FIELDS]), flavor='hive')
+    # 只读写完的文件，跳过 .inprogress
+    files = [os.path.join(root, name) for root in iter_partitions(base_dir)
+             for name in sorted(os.listdir(root)) if name.endswith('.parquet')]
+    return ds.dataset(files, format='parquet', partitioning=partitioning, partition_base_dir=base_dir)
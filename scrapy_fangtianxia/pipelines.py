@@ -6,32 +6,269 @@
 
 # useful for handling different item types with a single interface
 import csv
+import logging
+import os
+import queue
+import socket
+import threading
+import time
+import uuid
 from itemadapter import ItemAdapter
+from redis.exceptions import ConnectionError as RedisConnectionError, TimeoutError as RedisTimeoutError
+from scrapy.exceptions import DropItem, NotConfigured
+from scrapy.utils.defer import maybe_deferred_to_future
+from scrapy.utils.misc import load_object
+from scrapy_redis import connection
+from twisted.internet import defer
+from twisted.internet.task import LoopingCall
+from twisted.internet.threads import deferToThread, deferToThreadPool
+from twisted.python.threadpool import ThreadPool
+from scrapy_fangtianxia.aggregates import AggregateCounters
+from scrapy_fangtianxia.codec import ItemCodec
+from scrapy_fangtianxia.dupefilter import BloomFilter
+from scrapy_fangtianxia.incremental import item_digest
 from scrapy_fangtianxia.items import NewHouseItem, ESFHouseItem
+from scrapy_fangtianxia.normalize import normalize
+from scrapy_fangtianxia.parquet import PartitionedParquetWriter, item_schema
+from scrapy_fangtianxia.sketches import METRICS, SketchStore, TDigest, scopes
+from scrapy_fangtianxia.store import ListingStore
 
+logger = logging.getLogger(__name__)
 
-class ScrapyFangtianxiaPipeline:
-    def __init__(self):
-        # 新房CSV
-        self.nh_file = open('newhouse.csv', 'w', encoding='utf-8-sig', newline='')
-        self.nh_writer = csv.DictWriter(self.nh_file, fieldnames=NewHouseItem.fields.keys())
-        self.nh_writer.writeheader()
+# 文件类输出的子目录名
+ITEM_TYPES = {'newhouse': NewHouseItem, 'esf': ESFHouseItem}
 
-        # 二手房CSV
-        self.esf_file = open('esf.csv', 'w', encoding='utf-8-sig', newline='')
-        self.esf_writer = csv.DictWriter(self.esf_file, fieldnames=ESFHouseItem.fields.keys())
-        self.esf_writer.writeheader()
 
-    def process_item(self, item, spider):
-        if isinstance(item, NewHouseItem):
-            self.nh_writer.writerow(ItemAdapter(item).asdict())
-        elif isinstance(item, ESFHouseItem):
-            self.esf_writer.writerow(ItemAdapter(item).asdict())
+def item_type_name(item):
+    return next((name for name, cls in ITEM_TYPES.items() if isinstance(item, cls)), None)
+
+
+def default_node_id():
+    return f'{socket.gethostname()}-{os.getpid()}'
+
+
+def new_run_id():
+    return f'{time.strftime("%Y%m%d%H%M%S")}-{uuid.uuid4().hex[:6]}'
+
+
+# 通知写线程退出
+_STOP = object()
+
+
+class BackgroundWriterPipeline:
+    # 写文件的 pipeline 的基类。process_item 只把条目放进有界队列，由一个专门的写线程
+    # 按房源类型攒批，攒够 <PREFIX>_BATCH_SIZE 条或者每隔 <PREFIX>_FLUSH_INTERVAL 秒写一次；
+    # 文件超过 <PREFIX>_ROLL_SIZE 字节或者打开超过 <PREFIX>_ROLL_INTERVAL 秒就换新文件（0 表示不换）。
+    # 队列满了说明磁盘跟不上，这时 process_item 要等条目放进队列才返回，下游的条目处理也跟着慢下来。
+    # 子类实现 open_writer(name, item_cls)，返回有 write(rows)、size()、close() 方法的对象。
+    settings_prefix = None
+    default_dir = None
+
+    def __init__(self, base_dir, node_id=None, batch_size=1000, flush_interval=5.0, queue_size=10000,
+                 roll_size=0, roll_interval=0, stats=None):
+        self.base_dir = base_dir
+        self.node_id = node_id or default_node_id()
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.roll_size = roll_size
+        self.roll_interval = roll_interval
+        self.stats = stats
+        self.stats_prefix = self.settings_prefix.lower()
+        self.queue = queue.Queue(maxsize=queue_size)
+        # 队列满时在这个线程里阻塞等待，不占用 reactor 的线程池（DNS 解析也用它）
+        self.enqueue_pool = ThreadPool(minthreads=0, maxthreads=1, name=f'{self.stats_prefix}-enqueue')
+        self.thread = None
+        # 房源类型 -> (writer, 打开的时间)，只在写线程里访问
+        self.writers = {}
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        base_dir = settings.get(f'{cls.settings_prefix}_DIR', cls.default_dir)
+        if not base_dir:
+            raise NotConfigured
+        return cls(base_dir, stats=crawler.stats, **cls.writer_options(settings))
+
+    @classmethod
+    def writer_options(cls, settings):
+        prefix = cls.settings_prefix
+        return dict(
+            node_id=settings.get('NODE_ID'),
+            batch_size=settings.getint(f'{prefix}_BATCH_SIZE', 1000),
+            flush_interval=settings.getfloat(f'{prefix}_FLUSH_INTERVAL', 5.0),
+            queue_size=settings.getint(f'{prefix}_QUEUE_SIZE', 10000),
+            roll_size=settings.getint(f'{prefix}_ROLL_SIZE', 0),
+            roll_interval=settings.getfloat(f'{prefix}_ROLL_INTERVAL', 0),
+        )
+
+    def open_writer(self, name, item_cls):
+        raise NotImplementedError
+
+    def open_spider(self, spider):
+        self.run_id = new_run_id()
+        self.enqueue_pool.start()
+        self.thread = threading.Thread(target=self._run, name=f'{self.stats_prefix}-writer', daemon=True)
+        self.thread.start()
+
+    async def process_item(self, item, spider):
+        if type(item) not in ITEM_TYPES.values():
+            return item
+        # 复制一份，后面的 pipeline 再改条目不会影响写线程
+        entry = (type(item), ItemAdapter(item).asdict())
+        try:
+            self.queue.put_nowait(entry)
+        except queue.Full:
+            from twisted.internet import reactor
+            self._inc('backpressure')
+            await maybe_deferred_to_future(deferToThreadPool(reactor, self.enqueue_pool, self.queue.put, entry))
         return item
 
     def close_spider(self, spider):
-        self.nh_file.close()
-        self.esf_file.close()
+        from twisted.internet import reactor
+        if not self.thread.is_alive():
+            # 写线程已经退出了，没有人会取队列里的 _STOP
+            logger.error("%s 写线程已经退出，队列里的 %d 个条目没有写入", type(self).__name__, self.queue.qsize())
+            self.enqueue_pool.stop()
+            return None
+        # 排在还在等待入队的条目后面，写线程写完剩下的条目、关闭文件后退出
+        d = deferToThreadPool(reactor, self.enqueue_pool, self.queue.put, _STOP)
+        d.addCallback(lambda _: deferToThread(self.thread.join))
+        d.addBoth(lambda _: self.enqueue_pool.stop())
+        return d
+
+    def _run(self):
+        batches = {}
+        pending = 0
+        deadline = time.monotonic() + self.flush_interval
+        while True:
+            try:
+                entry = self.queue.get(timeout=max(0, deadline - time.monotonic()))
+            except queue.Empty:
+                entry = None
+            if entry is _STOP:
+                self._flush_safely(batches)
+                self._close_all()
+                return
+            if entry is not None:
+                item_cls, row = entry
+                batches.setdefault(item_cls, []).append(row)
+                pending += 1
+            if pending >= self.batch_size or time.monotonic() >= deadline:
+                self._flush_safely(batches)
+                batches = {}
+                pending = 0
+                deadline = time.monotonic() + self.flush_interval
+
+    def _flush_safely(self, batches):
+        # 写线程不能因为一次写入出错就退出，否则队列满了之后 process_item 和 close_spider 会一直等
+        try:
+            self._flush(batches)
+        except Exception:
+            logger.exception("%s 写入失败，丢失 %d 个条目", type(self).__name__,
+                             sum(len(rows) for rows in batches.values()))
+            self._inc('errors')
+
+    def _flush(self, batches):
+        self._roll()
+        depth = self.queue.qsize()
+        for item_cls, rows in batches.items():
+            start = time.perf_counter()
+            try:
+                self._writer(item_cls).write(rows)
+            except Exception as e:
+                logger.error("%s 写入失败，丢失 %d 个条目: %s", type(self).__name__, len(rows), e)
+                self._inc('errors')
+                # 出错的文件可能已经损坏，之后写到新文件里；打开文件就失败时没有要关的
+                if item_cls in self.writers:
+                    self._close(item_cls)
+                continue
+            self._record(len(rows), time.perf_counter() - start, depth)
+
+    def _writer(self, item_cls):
+        entry = self.writers.get(item_cls)
+        if entry is None:
+            name = next(name for name, cls in ITEM_TYPES.items() if cls is item_cls)
+            entry = self.writers[item_cls] = (self.open_writer(name, item_cls), time.monotonic())
+        return entry[0]
+
+    def _roll(self):
+        now = time.monotonic()
+        for item_cls, (writer, opened) in list(self.writers.items()):
+            if (self.roll_interval and now - opened >= self.roll_interval) or \
+                    (self.roll_size and writer.size() >= self.roll_size):
+                self._close(item_cls)
+                self._inc('rolled')
+
+    def _close(self, item_cls):
+        entry = self.writers.pop(item_cls, None)
+        if entry is None:
+            return
+        writer, _ = entry
+        try:
+            writer.close()
+        except Exception as e:
+            logger.error("%s 关闭文件失败: %s", type(self).__name__, e)
+            self._inc('errors')
+
+    def _close_all(self):
+        for item_cls in list(self.writers):
+            self._close(item_cls)
+
+    # 统计在写线程里产生，放回 reactor 线程更新
+    def _inc(self, name, count=1):
+        if self.stats:
+            from twisted.internet import reactor
+            reactor.callFromThread(self.stats.inc_value, f'{self.stats_prefix}/{name}', count)
+
+    def _record(self, size, elapsed, depth):
+        if self.stats:
+            from twisted.internet import reactor
+            reactor.callFromThread(self._record_stats, size, int(elapsed * 1000), depth)
+
+    def _record_stats(self, size, ms, depth):
+        prefix = self.stats_prefix
+        self.stats.inc_value(f'{prefix}/items', size)
+        self.stats.inc_value(f'{prefix}/flushes')
+        self.stats.inc_value(f'{prefix}/write_latency_ms', ms)
+        self.stats.max_value(f'{prefix}/write_latency_ms_max', ms)
+        self.stats.set_value(f'{prefix}/queue_depth', depth)
+        self.stats.max_value(f'{prefix}/queue_depth_max', depth)
+
+
+class CsvFileWriter:
+    # 写完（关闭）之前文件名后缀是 .inprogress
+    def __init__(self, filename, fieldnames):
+        self.filename = filename
+        self.file = open(filename + '.inprogress', 'w', encoding='utf-8-sig', newline='')
+        self.writer = csv.DictWriter(self.file, fieldnames=fieldnames)
+        self.writer.writeheader()
+
+    def write(self, rows):
+        self.writer.writerows(rows)
+        self.file.flush()
+
+    def size(self):
+        return self.file.tell()
+
+    def close(self):
+        self.file.close()
+        os.replace(self.filename + '.inprogress', self.filename)
+
+
+class ScrapyFangtianxiaPipeline(BackgroundWriterPipeline):
+    # 新房、二手房各写一组 CSV：<CSV_DIR>/<newhouse|esf>-<节点>-<运行>-<序号>.csv
+    settings_prefix = 'CSV'
+    default_dir = '.'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.sequence = 0
+
+    def open_writer(self, name, item_cls):
+        os.makedirs(self.base_dir, exist_ok=True)
+        self.sequence += 1
+        filename = os.path.join(self.base_dir, f'{name}-{self.node_id}-{self.run_id}-{self.sequence:05d}.csv')
+        return CsvFileWriter(filename, fieldnames=item_cls.fields.keys())
 
     # def __init__(self):
     #     self.newhouse_fp = open('newhouse.json','w',encoding='utf-8')
@@ -45,3 +282,472 @@ class ScrapyFangtianxiaPipeline:
     # def close_spider(self,spider):
     #     self.newhouse_fp.close()
     #     self.esf_fp.close()
+
+
+class NormalizePipeline:
+    # 把价格、面积、年代等文本解析成数值字段（见 normalize.py），放在写入存储之前
+    def __init__(self, keep_raw=False, stats=None):
+        self.keep_raw = keep_raw
+        self.stats = stats
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(keep_raw=crawler.settings.getbool('NORMALIZE_KEEP_RAW'), stats=crawler.stats)
+
+    def process_item(self, item, spider):
+        adapter = normalize(ItemAdapter(item), keep_raw=self.keep_raw)
+        if self.stats and adapter.get('price_wan') is None and adapter.get('unit_price_yuan') is None:
+            self.stats.inc_value('normalize/no_price')
+        return item
+
+
+class BloomDupeItemPipeline:
+    # 去掉重复的房源，放在写 Redis 之前，重复的条目不用再序列化。
+    # 过滤器跨运行保留，所以指纹是 origin_url 加内容摘要：内容没变的房源不再写，
+    # 价格等变了的房源在任何模式下都会重新写入。
+    # 同一轮 reactor 循环里到达的条目（最多 batch_size 个）攒成一批，在线程里用一个 Redis pipeline 检查
+    def __init__(self, bloom, batch_size=500, stats=None):
+        self.bloom = bloom
+        self.batch_size = batch_size
+        self.stats = stats
+        # 等待检查的 [(指纹, Deferred)]
+        self.waiting = []
+        self.scheduled = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        key = settings.get('ITEM_BLOOMFILTER_KEY', '%(spider)s:items:bloom')
+        bloom = BloomFilter(
+            connection.from_settings(settings),
+            key % {'spider': crawler.spider.name},
+            capacity=settings.getint('BLOOMFILTER_CAPACITY', 1000000),
+            error_rate=settings.getfloat('BLOOMFILTER_ERROR_RATE', 0.001),
+        )
+        return cls(bloom, batch_size=settings.getint('REDIS_BATCH_SIZE', 500), stats=crawler.stats)
+
+    async def process_item(self, item, spider):
+        origin_url = ItemAdapter(item).get('origin_url')
+        if not origin_url:
+            return item
+        d = defer.Deferred()
+        self.waiting.append((f'{origin_url}#{item_digest(item)}', d))
+        if len(self.waiting) >= self.batch_size:
+            self._check()
+        elif self.scheduled is None:
+            from twisted.internet import reactor
+            self.scheduled = reactor.callLater(0, self._check)
+        if await maybe_deferred_to_future(d):
+            raise DropItem(f"重复的房源: {origin_url}")
+        return item
+
+    def _check(self):
+        if self.scheduled is not None and self.scheduled.active():
+            self.scheduled.cancel()
+        self.scheduled = None
+        batch, self.waiting = self.waiting, []
+        d = deferToThread(self.bloom.add_many, [fingerprint for fingerprint, _ in batch])
+        d.addCallbacks(self._checked, self._check_failed, callbackArgs=(batch,), errbackArgs=(batch,))
+
+    def _checked(self, seen, batch):
+        for (_, waiter), duplicate in zip(batch, seen):
+            waiter.callback(duplicate)
+
+    def _check_failed(self, failure, batch):
+        # 查不了就当没见过，宁可多写几条重复的也不丢房源
+        logger.error("布隆过滤器检查失败，%d 个条目不去重: %s", len(batch), failure.getErrorMessage())
+        if self.stats:
+            self.stats.inc_value('item_bloom/errors')
+        for _, waiter in batch:
+            waiter.callback(False)
+
+
+class BufferedRedisPipeline:
+    # 攒够 batch_size 个条目或者每隔 interval 秒，在线程里用一个 Redis pipeline 一次写入。
+    # 子类实现 _write(batch)，返回 (条目数, 耗时)。连接断开、超时的批次下次 flush 时整批重试，
+    # 最多写 max_retries 次；其他错误（脚本报错、数据有问题）重试也没用，直接丢弃
+    stats_prefix = None
+
+    def __init__(self, server, batch_size=500, interval=1.0, stats=None, max_retries=5):
+        self.server = server
+        self.batch_size = batch_size
+        self.interval = interval
+        self.stats = stats
+        self.max_retries = max_retries
+        self.buffer = []
+        # 等待重试的 (批次, 已经写过的次数)
+        self.retries = []
+        self.pending = set()
+        self.timer = LoopingCall(self.flush)
+
+    def open_spider(self, spider):
+        self.timer.start(self.interval, now=False)
+
+    def process_item(self, item, spider):
+        self.buffer.append(item)
+        if len(self.buffer) >= self.batch_size:
+            self.flush()
+        return item
+
+    def flush(self):
+        batches, self.retries = self.retries, []
+        if self.buffer:
+            batches.append((self.buffer, 0))
+            self.buffer = []
+        if not batches:
+            return None
+        return defer.DeferredList([self._flush_batch(batch, attempts) for batch, attempts in batches])
+
+    def _flush_batch(self, batch, attempts):
+        d = deferToThread(self._write, batch)
+        d.addCallbacks(self._flushed, self._failed, errbackArgs=(batch, attempts + 1))
+        self.pending.add(d)
+        d.addBoth(self._done, d)
+        return d
+
+    def _write(self, batch):
+        raise NotImplementedError
+
+    def _flushed(self, result):
+        size, elapsed = result
+        if self.stats:
+            ms = int(elapsed * 1000)
+            prefix = self.stats_prefix
+            self.stats.inc_value(f'{prefix}/flushes')
+            self.stats.inc_value(f'{prefix}/items', size)
+            self.stats.max_value(f'{prefix}/batch_size_max', size)
+            self.stats.inc_value(f'{prefix}/flush_latency_ms', ms)
+            self.stats.max_value(f'{prefix}/flush_latency_ms_max', ms)
+
+    def _failed(self, failure, batch, attempts):
+        if self.stats:
+            self.stats.inc_value(f'{self.stats_prefix}/errors')
+        if failure.check(RedisConnectionError, RedisTimeoutError) and attempts < self.max_retries:
+            logger.warning("%s 写入 Redis 失败（第 %d 次），%d 个条目稍后重试: %s",
+                           type(self).__name__, attempts, len(batch), failure.getErrorMessage())
+            self.retries.append((batch, attempts))
+            return
+        logger.error("%s 写入 Redis 失败（第 %d 次），丢弃 %d 个条目: %s",
+                     type(self).__name__, attempts, len(batch), failure.getErrorMessage())
+        if self.stats:
+            self.stats.inc_value(f'{self.stats_prefix}/dropped', len(batch))
+
+    def _done(self, result, d):
+        self.pending.discard(d)
+        return result
+
+    def close_spider(self, spider):
+        if self.timer.running:
+            self.timer.stop()
+        # 等正在写的批次结束，再把剩下的写完
+        return defer.DeferredList(list(self.pending)).addCallback(lambda _: self._final_flush())
+
+    def _final_flush(self):
+        batch = [item for retry, _ in self.retries for item in retry] + self.buffer
+        self.retries, self.buffer = [], []
+        if not batch:
+            return None
+        d = deferToThread(self._write, batch)
+        d.addCallbacks(self._flushed, lambda failure: logger.error(
+            "%s 关闭时写入 Redis 失败，丢失 %d 个条目: %s",
+            type(self).__name__, len(batch), failure.getErrorMessage()))
+        return d
+
+
+class RedisBatchPipeline(BufferedRedisPipeline):
+    # 替代 scrapy_redis 的 RedisPipeline：攒够 REDIS_BATCH_SIZE 个条目或者每隔
+    # REDIS_BATCH_INTERVAL 秒，用 RPUSH 一次写入；序列化和写入都在线程里做
+    stats_prefix = 'redis_batch'
+
+    def __init__(self, server, key='%(spider)s:items', codec=None, serialize=None,
+                 batch_size=500, interval=1.0, stats=None, max_retries=5):
+        super().__init__(server, batch_size, interval, stats, max_retries)
+        self.key = key
+        # 编码格式见 scrapy_fangtianxia.codec，设置了 REDIS_ITEMS_SERIALIZER 时优先用它
+        self.codec = codec or ItemCodec()
+        self.serialize = serialize or self.codec.encode
+        # 同一时间只有一个线程在编码和写入：新 schema 一定和第一次用到它的记录在同一个
+        # Redis pipeline 里、排在记录前面，不会被另一批先写进去的记录抢先
+        self.write_lock = threading.Lock()
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        serialize = settings.get('REDIS_ITEMS_SERIALIZER')
+        return cls(
+            connection.from_settings(settings),
+            key=settings.get('REDIS_ITEMS_KEY', '%(spider)s:items'),
+            codec=ItemCodec.from_settings(settings),
+            serialize=load_object(serialize) if serialize else None,
+            batch_size=settings.getint('REDIS_BATCH_SIZE', 500),
+            interval=settings.getfloat('REDIS_BATCH_INTERVAL', 1.0),
+            stats=crawler.stats,
+            max_retries=settings.getint('REDIS_BATCH_MAX_RETRIES', 5),
+        )
+
+    def open_spider(self, spider):
+        self.key = self.key % {'spider': spider.name}
+        self.schemas_key = f'{self.key}:schemas'
+        super().open_spider(spider)
+
+    def _write(self, batch):
+        with self.write_lock:
+            return self._write_locked(batch)
+
+    def _write_locked(self, batch):
+        start = time.perf_counter()
+        data, kept = [], []
+        for item in batch:
+            # 序列化失败的条目重试也不会成功，单独丢掉，不影响同一批的其他条目
+            try:
+                data.append(self.serialize(item))
+                kept.append(item)
+            except Exception:
+                logger.exception("序列化失败，丢弃条目: %r", item)
+                if self.stats:
+                    from twisted.internet import reactor
+                    reactor.callFromThread(self.stats.inc_value, f'{self.stats_prefix}/serialize_errors')
+        # 这一批之后要重试的话，不再带上序列化失败的条目
+        batch[:] = kept
+        if not data:
+            return 0, time.perf_counter() - start
+        pipe = self.server.pipeline(transaction=False)
+        schemas = self.codec.pop_new_schemas()
+        if schemas:
+            # 先写 schema，读的一方拿到记录时一定能找到对应的字段列表
+            pipe.hset(self.schemas_key, mapping=schemas)
+        pipe.rpush(self.key, *data)
+        try:
+            pipe.execute()
+        except Exception:
+            # 用到这些 schema 的记录会重试，schema 也要跟着下一批再写
+            self.codec.restore_schemas(schemas)
+            raise
+        return len(data), time.perf_counter() - start
+
+
+class AggregateCounterPipeline(BufferedRedisPipeline):
+    # 爬取时累加画图用的计数（见 aggregates.py），分析脚本不用再读全部数据
+    stats_prefix = 'aggregates'
+
+    def __init__(self, server, key='%(spider)s:agg', batch_size=500, interval=1.0, stats=None, max_retries=5):
+        super().__init__(server, batch_size, interval, stats, max_retries)
+        self.key = key
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool('AGGREGATES_ENABLED'):
+            raise NotConfigured
+        return cls(
+            connection.from_settings(settings),
+            key=settings.get('AGGREGATES_KEY', '%(spider)s:agg'),
+            batch_size=settings.getint('REDIS_BATCH_SIZE', 500),
+            interval=settings.getfloat('REDIS_BATCH_INTERVAL', 1.0),
+            stats=crawler.stats,
+            max_retries=settings.getint('REDIS_BATCH_MAX_RETRIES', 5),
+        )
+
+    def open_spider(self, spider):
+        self.counters = AggregateCounters(self.server, self.key % {'spider': spider.name},
+                                          capacity=spider.settings.getint('BLOOMFILTER_CAPACITY', 1000000),
+                                          error_rate=spider.settings.getfloat('BLOOMFILTER_ERROR_RATE', 0.001))
+        super().open_spider(spider)
+
+    def process_item(self, item, spider):
+        listing_type = item_type_name(item)
+        if listing_type is not None:
+            super().process_item((listing_type, ItemAdapter(item).asdict()), spider)
+        return item
+
+    def _write(self, batch):
+        start = time.perf_counter()
+        added = self.counters.record(batch)
+        if self.stats:
+            from twisted.internet import reactor
+            reactor.callFromThread(self.stats.inc_value, 'aggregates/duplicates', len(batch) - added)
+        return len(batch), time.perf_counter() - start
+
+
+class QuantileSketchPipeline:
+    # 按类型/城市/行政区维护 price_wan、unit_price_yuan 的 t-digest（见 sketches.py），
+    # 每隔 SKETCHES_FLUSH_INTERVAL 秒把有变化的草图整份写进这个节点的哈希。
+    # 同一个 origin_url 只在第一次见到时加入草图：条目先攒着，成批用布隆过滤器 <key>:bloom
+    # 在线程里检查（和 aggregates.py 同一个脚本，但不共用 key，否则先记计数的一方会把另一方全挡掉）
+    def __init__(self, server, key, node_id, compression=100, interval=30.0, stats=None, ttl=7 * 86400,
+                 batch_size=500, capacity=1000000, error_rate=0.001):
+        self.server = server
+        self.key = key
+        self.node_id = node_id
+        self.ttl = ttl
+        self.compression = compression
+        self.interval = interval
+        self.stats = stats
+        self.batch_size = batch_size
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.digests = {}
+        self.dirty = set()
+        # 等待检查的 [(origin_url, [(字段, 数值)])]
+        self.waiting = []
+        self.pending = set()
+        self.timer = LoopingCall(self.flush)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool('SKETCHES_ENABLED'):
+            raise NotConfigured
+        return cls(
+            connection.from_settings(settings),
+            key=settings.get('SKETCHES_KEY', '%(spider)s:sketch'),
+            # 草图按节点存，节点名要跨重启不变，所以默认只用主机名；同一台机器跑多个进程时要各自设置 NODE_ID
+            node_id=settings.get('NODE_ID') or socket.gethostname(),
+            compression=settings.getint('SKETCHES_COMPRESSION', 100),
+            interval=settings.getfloat('SKETCHES_FLUSH_INTERVAL', 30.0),
+            stats=crawler.stats,
+            ttl=settings.getfloat('SKETCHES_NODE_TTL', 7 * 86400),
+            batch_size=settings.getint('REDIS_BATCH_SIZE', 500),
+            capacity=settings.getint('BLOOMFILTER_CAPACITY', 1000000),
+            error_rate=settings.getfloat('BLOOMFILTER_ERROR_RATE', 0.001),
+        )
+
+    async def open_spider(self, spider):
+        key = self.key % {'spider': spider.name}
+        self.store = SketchStore(self.server, key, self.node_id, self.ttl)
+        self.bloom = BloomFilter(self.server, f'{key}:bloom', capacity=self.capacity, error_rate=self.error_rate)
+        # 接着这个节点之前的草图累加
+        self.digests = await maybe_deferred_to_future(deferToThread(self.store.load_node))
+        self.timer.start(self.interval, now=False)
+
+    def process_item(self, item, spider):
+        listing_type = item_type_name(item)
+        if listing_type is None:
+            return item
+        adapter = ItemAdapter(item)
+        values = [(f'{listing_type}:{metric}:{scope}', adapter[metric])
+                  for metric in METRICS if adapter.get(metric) is not None
+                  for scope in scopes(adapter)]
+        if values:
+            self.waiting.append((adapter.get('origin_url'), values))
+            if len(self.waiting) >= self.batch_size:
+                self._track(self._check())
+        return item
+
+    def _track(self, d):
+        self.pending.add(d)
+        d.addBoth(self._done, d)
+        return d
+
+    def _check(self):
+        batch, self.waiting = self.waiting, []
+        urls = [origin_url for origin_url, _ in batch if origin_url]
+        d = deferToThread(self.bloom.add_many, urls) if urls else defer.succeed([])
+        d.addCallbacks(self._add_values, self._check_failed, callbackArgs=(batch,), errbackArgs=(batch,))
+        return d
+
+    def _add_values(self, seen, batch):
+        seen = iter(seen)
+        for origin_url, values in batch:
+            # 没有 origin_url 的条目没法去重，照样加入
+            if origin_url and next(seen):
+                if self.stats:
+                    self.stats.inc_value('sketches/duplicates')
+                continue
+            for field, value in values:
+                digest = self.digests.get(field)
+                if digest is None:
+                    digest = self.digests[field] = TDigest(self.compression)
+                digest.add(value)
+                self.dirty.add(field)
+
+    def _check_failed(self, failure, batch):
+        logger.error("检查分位数草图的 origin_url 失败，%d 个条目下次重试: %s", len(batch), failure.getErrorMessage())
+        if self.stats:
+            self.stats.inc_value('sketches/errors')
+        self.waiting[:0] = batch
+
+    def flush(self):
+        return self._track(self._check().addCallback(lambda _: self._save()))
+
+    def _save(self):
+        if not self.dirty:
+            return None
+        # 序列化在 reactor 线程里做，写线程拿到的是不会再变的字节
+        fields, self.dirty = self.dirty, set()
+        data = {field: self.digests[field].to_bytes() for field in fields}
+        start = time.perf_counter()
+        d = deferToThread(self.store.save, data)
+        d.addCallbacks(self._saved, self._failed, callbackArgs=(len(data), start), errbackArgs=(fields,))
+        return d
+
+    def _saved(self, result, size, start):
+        if self.stats:
+            self.stats.inc_value('sketches/flushes')
+            self.stats.max_value('sketches/digests_max', size)
+            self.stats.max_value('sketches/flush_latency_ms_max', int((time.perf_counter() - start) * 1000))
+
+    def _failed(self, failure, fields):
+        logger.error("写入分位数草图失败，%d 个草图下次重试: %s", len(fields), failure.getErrorMessage())
+        if self.stats:
+            self.stats.inc_value('sketches/errors')
+        self.dirty |= fields
+
+    def _done(self, result, d):
+        self.pending.discard(d)
+        return result
+
+    def close_spider(self, spider):
+        if self.timer.running:
+            self.timer.stop()
+        return defer.DeferredList(list(self.pending)).addCallback(lambda _: self.flush())
+
+
+class ParquetPipeline(BackgroundWriterPipeline):
+    # 按省份/城市分区写 Parquet（见 parquet.py），每次 flush 给每个分区写一个 row group
+    settings_prefix = 'PARQUET'
+
+    def __init__(self, *args, max_open_files=64, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.max_open_files = max_open_files
+        self.parquet_writers = {}
+
+    @classmethod
+    def writer_options(cls, settings):
+        options = super().writer_options(settings)
+        options['max_open_files'] = settings.getint('PARQUET_MAX_OPEN_FILES', 64)
+        return options
+
+    def open_writer(self, name, item_cls):
+        # 换文件时关闭的是各分区当前的文件，同一个 writer 之后会接着编号打开新文件
+        writer = self.parquet_writers.get(item_cls)
+        if writer is None:
+            writer = self.parquet_writers[item_cls] = PartitionedParquetWriter(
+                os.path.join(self.base_dir, name), item_schema(item_cls),
+                node_id=self.node_id, run_id=self.run_id, max_open_files=self.max_open_files)
+        return writer
+
+
+class ListingStoreWriter:
+    # 一种房源一个连接，都写同一个库
+    def __init__(self, path, listing_type):
+        self.store = ListingStore(path)
+        self.listing_type = listing_type
+
+    def write(self, rows):
+        self.store.upsert(self.listing_type, rows)
+
+    def size(self):
+        return 0
+
+    def close(self):
+        self.store.close()
+
+
+class ListingStorePipeline(BackgroundWriterPipeline):
+    # 按 origin_url 更新本地房源库 <LISTING_STORE_DIR>/listings.db（见 store.py）
+    settings_prefix = 'LISTING_STORE'
+
+    def open_writer(self, name, item_cls):
+        os.makedirs(self.base_dir, exist_ok=True)
+        return ListingStoreWriter(os.path.join(self.base_dir, 'listings.db'), name)
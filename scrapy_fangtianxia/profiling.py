@@ -0,0 +1,332 @@
+# 性能剖析：每个回调、中间件、pipeline 方法的 wall/CPU 时间，以及按需打开的采样剖析器
+#
+#   PROFILING_ENABLED = True    从爬虫启动开始记录，关闭时输出
+#   kill -USR1 <pid>            运行中的节点开始记录，再发一次结束并输出（PROFILING_SIGNAL，Windows 不支持）
+#
+# 输出在 PROFILING_DIR 下，文件名带 NODE_ID 和时间：
+#   timings-*.tsv       每个方法的调用次数、wall/CPU 总时间、平均和最长 wall 时间，按 CPU 时间排序
+#   profile-*.collapsed 采样得到的调用栈（"帧;帧;帧 次数"），flamegraph.pl、speedscope 可以直接打开
+# 同时写进 stats 的 profile/<类别>/<名称>/*，打开 TelemetryExtension 时在 fang_stat 里能看到。
+#
+# 计时的方法：引擎启动后替换下载器中间件、爬虫中间件、pipeline 管理器 methods 里的方法，
+# 再在爬虫中间件链最靠近爬虫的位置插入一层，给回调的每次迭代计时（回调是生成器，代码在迭代时才执行）。
+# 这些是 Scrapy 的内部结构，版本变了找不到时只打警告，跳过对应部分的计时。
+# 时间是独占的：嵌套的被计时调用用掉的时间会从外层扣掉；协程只算真正在执行的步骤，
+# 等下载、等线程的时间不算。返回 Deferred 的方法只算同步部分。没在记录时包装只多一次判断。
+import functools
+import inspect
+import logging
+import os
+import signal
+import sys
+import threading
+import time
+from collections import Counter, deque
+
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+from twisted.internet.defer import Deferred
+
+from scrapy_fangtianxia.pipelines import default_node_id
+
+logger = logging.getLogger(__name__)
+
+# 要计时的管理器方法
+MANAGER_METHODS = {
+    'downloader': ('process_request', 'process_response', 'process_exception'),
+    'spidermw': ('process_spider_input', 'process_spider_exception'),
+    'pipeline': ('process_item',),
+}
+
+
+def method_name(method):
+    owner = getattr(method, '__self__', None)
+    name = getattr(method, '__name__', repr(method))
+    return f'{type(owner).__name__}.{name}' if owner is not None else name
+
+
+class Timings:
+    def __init__(self):
+        # (类别, 名称) -> [调用次数, wall 总时间, CPU 总时间, 最长 wall 时间]
+        self.values = {}
+        self.active = False
+        # 正在计时的调用各自的 [嵌套调用用掉的 wall, CPU]
+        self._children = []
+
+    def start(self):
+        self._children.append([0.0, 0.0])
+        return time.perf_counter(), time.thread_time()
+
+    def stop(self, started):
+        wall, cpu = time.perf_counter() - started[0], time.thread_time() - started[1]
+        child = self._children.pop()
+        if self._children:
+            parent = self._children[-1]
+            parent[0] += wall
+            parent[1] += cpu
+        return wall - child[0], cpu - child[1]
+
+    def add(self, key, wall, cpu):
+        value = self.values.get(key)
+        if value is None:
+            value = self.values[key] = [0, 0.0, 0.0, 0.0]
+        value[0] += 1
+        value[1] += wall
+        value[2] += cpu
+        value[3] = max(value[3], wall)
+
+    def wrap(self, key, method):
+        @functools.wraps(method)
+        def timed(*args, **kwargs):
+            if not self.active:
+                return method(*args, **kwargs)
+            started = self.start()
+            try:
+                result = method(*args, **kwargs)
+            finally:
+                wall, cpu = self.stop(started)
+            if inspect.isawaitable(result) and not isinstance(result, Deferred):
+                return TimedAwaitable(self, result, [wall, cpu], functools.partial(self._done, key))
+            self.add(key, wall, cpu)
+            return result
+        return timed
+
+    def _done(self, key, totals):
+        self.add(key, *totals)
+
+    def rows(self):
+        # [(类别, 名称, 调用次数, wall, CPU, 最长 wall)]，按 CPU 时间从多到少
+        rows = [(kind, name, *value) for (kind, name), value in self.values.items()]
+        return sorted(rows, key=lambda row: row[4], reverse=True)
+
+    def clear(self):
+        self.values = {}
+
+
+class TimedAwaitable:
+    # 逐步驱动 awaitable，只累计每一步真正执行的时间，结束时调用 done(totals)
+    def __init__(self, timings, awaitable, totals, done=None):
+        self.timings = timings
+        self.awaitable = awaitable
+        self.totals = totals
+        self.done = done
+
+    def __await__(self):
+        timings, totals = self.timings, self.totals
+        iterator = self.awaitable.__await__()
+        send, value = iterator.send, None
+        try:
+            while True:
+                started = timings.start()
+                try:
+                    yielded = send(value)
+                except StopIteration as e:
+                    return e.value
+                finally:
+                    wall, cpu = timings.stop(started)
+                    totals[0] += wall
+                    totals[1] += cpu
+                try:
+                    value, send = (yield yielded), iterator.send
+                except BaseException as e:
+                    value, send = e, iterator.throw
+        finally:
+            if self.done is not None:
+                self.done(totals)
+
+
+class SamplingProfiler:
+    # 后台线程每隔 interval 秒用 sys._current_frames() 取一次调用栈，按栈计数
+    def __init__(self, interval=0.01, thread_ids=None):
+        self.interval = interval
+        # None 表示所有线程（采样线程自己除外）
+        self.thread_ids = thread_ids
+        self.counts = Counter()
+        self.samples = 0
+        self._labels = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None
+
+    def start(self):
+        self.counts.clear()
+        self.samples = 0
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+    def _run(self):
+        me = threading.get_ident()
+        names = {}
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == me or (self.thread_ids is not None and thread_id not in self.thread_ids):
+                    continue
+                if thread_id not in names:
+                    names = {t.ident: t.name for t in threading.enumerate()}
+                self.counts[self._stack(names.get(thread_id, str(thread_id)), frame)] += 1
+            self.samples += 1
+
+    def _label(self, code):
+        label = self._labels.get(code)
+        if label is None:
+            label = self._labels[code] = (f'{code.co_name} ({os.path.basename(code.co_filename)}:'
+                                          f'{code.co_firstlineno})').replace(';', ':')
+        return label
+
+    def _stack(self, thread_name, frame):
+        labels = deque()
+        while frame is not None:
+            labels.appendleft(self._label(frame.f_code))
+            frame = frame.f_back
+        labels.appendleft(thread_name.replace(';', ':'))
+        return ';'.join(labels)
+
+    def write(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, count in self.counts.most_common():
+                f.write(f'{stack} {count}\n')
+
+
+class ProfilingExtension:
+    def __init__(self, crawler):
+        settings = crawler.settings
+        self.enabled = settings.getbool('PROFILING_ENABLED')
+        self.use_signal = settings.getbool('PROFILING_SIGNAL') and hasattr(signal, 'SIGUSR1')
+        if not self.enabled and not self.use_signal:
+            raise NotConfigured
+        self.crawler = crawler
+        self.stats = crawler.stats
+        self.directory = settings.get('PROFILING_DIR', 'profiles')
+        self.node_id = settings.get('NODE_ID') or default_node_id()
+        self.all_threads = settings.getbool('PROFILING_SAMPLE_ALL_THREADS')
+        self.timings = Timings()
+        self.sampler = SamplingProfiler(settings.getfloat('PROFILING_SAMPLE_INTERVAL', 0.01))
+        self.started = None
+
+        crawler.signals.connect(self.engine_started, signal=signals.engine_started)
+        crawler.signals.connect(self.spider_closed, signal=signals.spider_closed)
+        if self.use_signal:
+            signal.signal(signal.SIGUSR1, self._on_signal)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler)
+
+    def engine_started(self):
+        engine = self.crawler.engine
+        managers = {
+            'downloader': engine.downloader.middleware,
+            'spidermw': engine.scraper.spidermw,
+            'pipeline': engine.scraper.itemproc,
+        }
+        for kind, manager in managers.items():
+            self._wrap_manager(kind, manager)
+        # 插在最靠近爬虫的位置，拿到的就是回调本身的输出；process_spider_exception 的下标要对齐
+        methods = getattr(engine.scraper.spidermw, 'methods', None)
+        if methods is not None and 'process_spider_output' in methods and 'process_spider_exception' in methods:
+            methods['process_spider_output'].appendleft(self._time_callback)
+            methods['process_spider_exception'].appendleft(None)
+        else:
+            logger.warning("SpiderMiddlewareManager.methods 不是预期的结构，不给回调计时")
+        if self.enabled:
+            self.start()
+
+    def _wrap_manager(self, kind, manager):
+        manager_methods = getattr(manager, 'methods', None)
+        requiring_spider = getattr(manager, '_mw_methods_requiring_spider', None)
+        if manager_methods is None or requiring_spider is None:
+            logger.warning("%s 缺少 methods 或 _mw_methods_requiring_spider，不给 %s 计时",
+                           type(manager).__name__, kind)
+            return
+        for methodname in MANAGER_METHODS[kind]:
+            methods = manager_methods.get(methodname)
+            if not methods:
+                continue
+            wrapped = []
+            for method in methods:
+                if method is None:
+                    wrapped.append(None)
+                    continue
+                timed = self.timings.wrap((kind, method_name(method)), method)
+                # 管理器按方法对象判断要不要传 spider 参数
+                if method in requiring_spider:
+                    requiring_spider.add(timed)
+                wrapped.append(timed)
+            methods.clear()
+            methods.extend(wrapped)
+
+    async def _time_callback(self, response, result):
+        if not self.timings.active:
+            async for output in result:
+                yield output
+            return
+        request = response.request
+        callback = getattr(request, 'callback', None) or 'parse'
+        key = ('callback', getattr(callback, '__name__', str(callback)))
+        totals = [0.0, 0.0]
+        iterator = result.__aiter__()
+        try:
+            while True:
+                try:
+                    output = await TimedAwaitable(self.timings, iterator.__anext__(), totals)
+                except StopAsyncIteration:
+                    break
+                yield output
+        finally:
+            self.timings.add(key, *totals)
+
+    def _on_signal(self, signum, frame):
+        from twisted.internet import reactor
+        reactor.callFromThread(self.toggle)
+
+    def toggle(self):
+        if self.timings.active:
+            self.stop()
+        else:
+            self.start()
+
+    def start(self):
+        # 在 reactor 线程里调用
+        self.timings.clear()
+        self.timings.active = True
+        # 默认只采样 reactor 所在的线程，回调、中间件、pipeline 都在这个线程里执行
+        self.sampler.thread_ids = None if self.all_threads else {threading.get_ident()}
+        self.sampler.start()
+        self.started = time.time()
+        logger.warning("Profiling started (node %s)", self.node_id)
+
+    def stop(self):
+        self.timings.active = False
+        self.sampler.stop()
+        os.makedirs(self.directory, exist_ok=True)
+        suffix = f'{self.node_id}-{time.strftime("%Y%m%d%H%M%S", time.localtime(self.started))}'
+        timings_path = os.path.join(self.directory, f'timings-{suffix}.tsv')
+        profile_path = os.path.join(self.directory, f'profile-{suffix}.collapsed')
+        self._write_timings(timings_path)
+        self.sampler.write(profile_path)
+        logger.warning("Profiling stopped after %.0fs, %d samples: %s, %s", time.time() - self.started,
+                       self.sampler.samples, timings_path, profile_path)
+
+    def _write_timings(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write('kind\tname\tcalls\twall_ms\tcpu_ms\tmean_wall_ms\tmax_wall_ms\n')
+            for kind, name, calls, wall, cpu, wall_max in self.timings.rows():
+                f.write(f'{kind}\t{name}\t{calls}\t{wall * 1000:.1f}\t{cpu * 1000:.1f}\t'
+                        f'{wall / calls * 1000:.3f}\t{wall_max * 1000:.1f}\n')
+                prefix = f'profile/{kind}/{name}'
+                self.stats.set_value(f'{prefix}/calls', calls)
+                self.stats.set_value(f'{prefix}/wall_ms', int(wall * 1000))
+                self.stats.set_value(f'{prefix}/cpu_ms', int(cpu * 1000))
+
+    def spider_closed(self, spider):
+        if self.timings.active:
+            self.stop()
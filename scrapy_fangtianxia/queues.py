@@ -0,0 +1,87 @@
+# 按域名分片、轮询出队的 scrapy-redis 调度队列
+#
+# 所有请求放在同一个优先级队列里时，北京这种大城市的翻页请求会堆在队头，
+# 其他 worker 拿到的全是同一个域名的请求，只能在 per-domain 的并发限制下空等。
+# 这里每个域名一个子队列，再用一个轮转列表记录有请求的域名：
+#   <key>:host:<host>     该域名的请求（有序集合，分数为 -priority）
+#   <key>:hosts           有请求的域名，出队时轮转（RPOPLPUSH）
+#   <key>:hostset         同上，用来判断域名是否已经在轮转列表里
+#   <key>:count           请求总数
+#   <key>:backoff:<host>  处于退避期的域名，出队时跳过
+from scrapy.utils.httpobj import urlparse_cached
+from scrapy_redis.queue import Base
+
+PUSH_SCRIPT = """
+if redis.call('zadd', KEYS[3], ARGV[2], ARGV[3]) == 1 then
+    redis.call('incr', KEYS[4])
+end
+if redis.call('sadd', KEYS[2], ARGV[1]) == 1 then
+    redis.call('rpush', KEYS[1], ARGV[1])
+end
+"""
+
+POP_SCRIPT = """
+local n = redis.call('llen', KEYS[1])
+for i = 1, n do
+    local host = redis.call('rpoplpush', KEYS[1], KEYS[1])
+    if not host then
+        return nil
+    end
+    if redis.call('exists', ARGV[2] .. host) == 0 then
+        local queue = ARGV[1] .. host
+        local items = redis.call('zrange', queue, 0, 0)
+        if #items > 0 then
+            redis.call('zremrangebyrank', queue, 0, 0)
+            redis.call('decr', KEYS[3])
+        end
+        if redis.call('zcard', queue) == 0 then
+            redis.call('lrem', KEYS[1], 1, host)
+            redis.call('srem', KEYS[2], host)
+        end
+        if #items > 0 then
+            return items[1]
+        end
+    end
+end
+return nil
+"""
+
+
+class HostRoundRobinQueue(Base):
+    def __init__(self, server, spider, key, serializer=None):
+        super().__init__(server, spider, key, serializer)
+        self.hosts_key = f'{self.key}:hosts'
+        self.hostset_key = f'{self.key}:hostset'
+        self.count_key = f'{self.key}:count'
+        self.host_prefix = f'{self.key}:host:'
+        self.backoff_prefix = f'{self.key}:backoff:'
+        self._push = server.register_script(PUSH_SCRIPT)
+        self._pop = server.register_script(POP_SCRIPT)
+
+    def __len__(self):
+        return int(self.server.get(self.count_key) or 0)
+
+    def push(self, request):
+        host = urlparse_cached(request).hostname or ''
+        self._push(
+            keys=[self.hosts_key, self.hostset_key, self.host_prefix + host, self.count_key],
+            args=[host, -request.priority, self._encode_request(request)],
+        )
+
+    def pop(self, timeout=0):
+        # timeout not support in this queue class
+        data = self._pop(
+            keys=[self.hosts_key, self.hostset_key, self.count_key],
+            args=[self.host_prefix, self.backoff_prefix],
+        )
+        if data:
+            return self._decode_request(data)
+
+    def backoff(self, host, seconds):
+        # 整个集群暂停从这个域名出队
+        self.server.set(self.backoff_prefix + host, 1, px=max(int(seconds * 1000), 1))
+
+    def clear(self):
+        hosts = self.server.smembers(self.hostset_key)
+        keys = [self.host_prefix + (h.decode() if isinstance(h, bytes) else h) for h in hosts]
+        self.server.delete(self.hosts_key, self.hostset_key, self.count_key, *keys)
@@ -0,0 +1,114 @@
+# 按城市、房源类型安排重新爬取（需要同时打开 INCREMENTAL_CRAWL）
+#
+#   <key>:state    哈希，<类型>:<城市> -> {"rate": 每小时变化率, "last": 上次访问时间, "visits": 访问次数}
+#   <key>:payload  哈希，<类型>:<城市> -> 重新爬取时放进 start_urls 的 JSON（列表第一页）
+#   <key>:due      有序集合，<类型>:<城市> -> 下次访问的时间
+#
+# 每次访问一个城市列表的第一页，用新出现的和内容变了的房源（价格等）占这一页的比例估计变化速度：
+# 假设每套房源按泊松过程变化，Δt 小时内变化的比例 f = 1 - exp(-rate·Δt)，每次的估计
+# -ln(1-f)/Δt 做指数加权平均。下次访问安排在预计有 RECRAWL_TARGET_STALE 比例的房源已经变了
+# 的时候，即 -ln(1-target)/rate，限制在 RECRAWL_MIN_INTERVAL 和 RECRAWL_MAX_INTERVAL 之间。
+# 大城市变化快的二手房很快就会再来，小城市的新房很久才来一次。
+#
+# 爬虫空闲时把到期的城市（每次最多 RECRAWL_BATCH 个）推进 start_urls。推出去的同时把到期时间
+# 推迟 RECRAWL_MAX_INTERVAL 作为租约，请求失败、没有访问到第一页时，最晚到那时会再安排一次。
+import json
+import math
+import time
+
+# 一页全变了时 -ln(1-f) 是无穷大
+MAX_CHANGED_FRACTION = 0.95
+
+# KEYS: due, payload, start_urls；ARGV: 当前时间, 个数, 租约到期时间, start_urls 是否是集合
+PUSH_DUE_SCRIPT = """
+local members = redis.call('zrangebyscore', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, tonumber(ARGV[2]))
+local pushed = 0
+for _, member in ipairs(members) do
+    redis.call('zadd', KEYS[1], ARGV[3], member)
+    local payload = redis.call('hget', KEYS[2], member)
+    if payload then
+        if ARGV[4] == '1' then
+            redis.call('sadd', KEYS[3], payload)
+        else
+            redis.call('rpush', KEYS[3], payload)
+        end
+        pushed = pushed + 1
+    end
+end
+return pushed
+"""
+
+
+class RecrawlPlanner:
+    def __init__(self, server, key='fang:recrawl', target_stale=0.2, min_interval=3600,
+                 max_interval=7 * 86400, initial_interval=86400, alpha=0.3):
+        self.server = server
+        self.key = key
+        self.target_stale = target_stale
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.initial_interval = initial_interval
+        self.alpha = alpha
+        self._push_due = server.register_script(PUSH_DUE_SCRIPT)
+
+    @classmethod
+    def from_spider(cls, spider):
+        settings = spider.settings
+        return cls(
+            spider.server,
+            key=settings.get('RECRAWL_KEY', '%(spider)s:recrawl') % {'spider': spider.name},
+            target_stale=settings.getfloat('RECRAWL_TARGET_STALE', 0.2),
+            min_interval=settings.getfloat('RECRAWL_MIN_INTERVAL', 3600),
+            max_interval=settings.getfloat('RECRAWL_MAX_INTERVAL', 7 * 86400),
+            initial_interval=settings.getfloat('RECRAWL_INITIAL_INTERVAL', 86400),
+            alpha=settings.getfloat('RECRAWL_ALPHA', 0.3),
+        )
+
+    def interval(self, rate):
+        # 秒；还没有估计时用 initial_interval，一直没变化时用最长间隔
+        if rate is None:
+            return self.initial_interval
+        if rate <= 0:
+            return self.max_interval
+        seconds = -math.log(1 - self.target_stale) / rate * 3600
+        return min(max(seconds, self.min_interval), self.max_interval)
+
+    def state(self, listing_type, city):
+        data = self.server.hget(f'{self.key}:state', f'{listing_type}:{city}')
+        return json.loads(data) if data else {}
+
+    def observe(self, listing_type, province, city, url, total, changed, now=None):
+        # 访问了一次城市列表的第一页：total 套房源里 changed 套是新的或者内容变了。返回下次访问的间隔
+        now = time.time() if now is None else now
+        segment = f'{listing_type}:{city}'
+        state = self.state(listing_type, city)
+        rate, last = state.get('rate'), state.get('last')
+        if last is not None and total:
+            hours = max((now - last) / 3600, 1 / 60)
+            fraction = min(changed / total, MAX_CHANGED_FRACTION)
+            observed = -math.log(1 - fraction) / hours
+            rate = observed if rate is None else self.alpha * observed + (1 - self.alpha) * rate
+        interval = self.interval(rate)
+        # recrawl 标记让后续页也绕过去重，见 FangSpider.paginate
+        payload = {'url': url, 'listing_type': listing_type, 'province': province, 'city': city,
+                   'recrawl': True}
+        pipe = self.server.pipeline(transaction=False)
+        pipe.hset(f'{self.key}:state', segment, json.dumps(
+            {'rate': rate, 'last': now, 'visits': state.get('visits', 0) + 1}))
+        pipe.hset(f'{self.key}:payload', segment, json.dumps(payload, ensure_ascii=False))
+        pipe.zadd(f'{self.key}:due', {segment: now + interval})
+        pipe.execute()
+        return interval
+
+    def push_due(self, start_urls_key, limit, as_set=False, now=None):
+        # 把到期的城市推进 start_urls，返回推了几个
+        now = time.time() if now is None else now
+        return self._push_due(
+            keys=[f'{self.key}:due', f'{self.key}:payload', start_urls_key],
+            args=[now, limit, now + self.max_interval, '1' if as_set else '0'],
+        )
+
+    def schedule(self, limit=20):
+        # [(<类型>:<城市>, 下次访问时间)]，按时间排序
+        return [(member.decode(), score) for member, score in self.server.zrangebyscore(
+            f'{self.key}:due', '-inf', '+inf', start=0, num=limit, withscores=True)]
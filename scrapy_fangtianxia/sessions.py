@@ -0,0 +1,82 @@
+# 滑块验证后的会话（Cookie）保存在 Redis 里，所有 worker 共用
+#
+# <key>:<scope>        验证通过后的 Cookie，带过期时间
+# <key>:<scope>:lock   正在验证的 worker 持有的锁，其他 worker 等待结果
+import json
+import time
+import uuid
+
+from scrapy_redis import connection
+
+# 只有锁的持有者才能释放锁
+RELEASE_LOCK_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+def session_scope(host, scope='domain'):
+    # host: 每个子域名一套会话；domain: fang.com 下所有子域名共用一套会话
+    if scope == 'host' or not host:
+        return host
+    return '.'.join(host.split('.')[-2:])
+
+
+class RedisSessionStore:
+    def __init__(self, server, key='fang:sessions', ttl=1800, lock_timeout=60, refresh_interval=5):
+        self.server = server
+        self.key = key
+        self.ttl = ttl
+        self.lock_timeout = lock_timeout
+        # 本地缓存的有效期，避免每个请求都访问一次 Redis
+        self.refresh_interval = refresh_interval
+        self._cache = {}
+        self._release = server.register_script(RELEASE_LOCK_SCRIPT)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        key = settings.get('CAPTCHA_SESSION_KEY', '%(spider)s:sessions')
+        return cls(
+            connection.from_settings(settings),
+            key=key % {'spider': crawler.spider.name},
+            ttl=settings.getint('CAPTCHA_SESSION_TTL', 1800),
+            lock_timeout=settings.getint('CAPTCHA_SESSION_LOCK_TIMEOUT', 60),
+            refresh_interval=settings.getfloat('CAPTCHA_SESSION_REFRESH_INTERVAL', 5),
+        )
+
+    def get(self, scope):
+        data = self.server.get(f'{self.key}:{scope}')
+        session = json.loads(data) if data else None
+        self._cache[scope] = (time.monotonic(), session)
+        return session
+
+    def stale(self, scope):
+        # 本地缓存过期了，需要调用 get() 重新读
+        fetched_at = self._cache.get(scope, (None, None))[0]
+        return fetched_at is None or time.monotonic() - fetched_at >= self.refresh_interval
+
+    def cached(self, scope):
+        if self.stale(scope):
+            return self.get(scope)
+        return self._cache[scope][1]
+
+    def save(self, scope, cookies):
+        session = {'version': uuid.uuid4().hex, 'cookies': cookies}
+        self.server.set(f'{self.key}:{scope}', json.dumps(session), ex=self.ttl)
+        self._cache[scope] = (time.monotonic(), session)
+        return session
+
+    def acquire(self, scope):
+        token = uuid.uuid4().hex
+        if self.server.set(f'{self.key}:{scope}:lock', token, nx=True, ex=self.lock_timeout):
+            return token
+        return None
+
+    def release(self, scope, token):
+        self._release(keys=[f'{self.key}:{scope}:lock'], args=[token])
+
+    def locked(self, scope):
+        return bool(self.server.exists(f'{self.key}:{scope}:lock'))
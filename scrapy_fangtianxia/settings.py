@@ -12,6 +12,8 @@ BOT_NAME = "scrapy_fangtianxia"
 
 SPIDER_MODULES = ["scrapy_fangtianxia.spiders"]
 NEWSPIDER_MODULE = "scrapy_fangtianxia.spiders"
+# 自定义命令，例如 scrapy compact
+COMMANDS_MODULE = "scrapy_fangtianxia.commands"
 LOG_LEVEL = 'WARNING'
 
 # Crawl responsibly by identifying yourself (and your website) on the user-agent
@@ -26,14 +28,26 @@ ROBOTSTXT_OBEY = False
 # Configure a delay for requests for the same website (default: 0)
 # See https://docs.scrapy.org/en/latest/topics/settings.html#download-delay
 # See also autothrottle settings and docs
-DOWNLOAD_DELAY = 3
+# 每个域名的初始延迟，之后由 AdaptiveThrottleMiddleware 按域名调整
+DOWNLOAD_DELAY = 1
 RANDOMIZE_DOWNLOAD_DELAY = True
 # The download delay setting will honor only one of:
 #CONCURRENT_REQUESTS_PER_DOMAIN = 16
 #CONCURRENT_REQUESTS_PER_IP = 16
 
-CONCURRENT_REQUESTS = 4  # 每次只处理1个请求，确保Cookie独立
-CONCURRENT_REQUESTS_PER_DOMAIN = 4
+CONCURRENT_REQUESTS = 64  # 全局并发上限
+CONCURRENT_REQUESTS_PER_DOMAIN = 2  # 每个城市子域名的初始并发
+
+# 按域名自适应并发和延迟（AIMD），根据响应延迟、出错率、验证码命中率调整
+ADAPTIVE_THROTTLE_ENABLED = True
+ADAPTIVE_THROTTLE_MIN_DELAY = 0.25
+ADAPTIVE_THROTTLE_MAX_DELAY = 30
+# 单个域名的最大并发
+ADAPTIVE_THROTTLE_MAX_CONCURRENCY = 8
+# 平均响应时间超过这个值（秒）就不再加速
+ADAPTIVE_THROTTLE_TARGET_LATENCY = 2.0
+# 打印每次调整
+ADAPTIVE_THROTTLE_DEBUG = False
 
 # Disable cookies (enabled by default)
 # COOKIES_ENABLED = False
@@ -61,23 +75,105 @@ DEFAULT_REQUEST_HEADERS = {
     'user-agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/117.0.0.0 Safari/537.36',
 }
 
+# 从列表第一页读出总页数后，一次最多放进队列的页数（0 表示逐页翻）
+PAGINATION_FANOUT_MAX = 50
+
+# 增量爬取：跳过内容没变的房源，某一页全是见过的房源时停止翻页（此时不会一次性生成所有页）
+INCREMENTAL_CRAWL = False
+
+# 按每个城市、每种房源的变化速度安排重新爬取（需要打开 INCREMENTAL_CRAWL），见 recrawl.py
+RECRAWL_ENABLED = False
+# 安排在预计有多少比例的房源已经变化时再来
+RECRAWL_TARGET_STALE = 0.2
+# 重新爬取的间隔（秒）：最短、最长、还没有估计出变化速度时
+RECRAWL_MIN_INTERVAL = 3600
+RECRAWL_MAX_INTERVAL = 7 * 86400
+RECRAWL_INITIAL_INTERVAL = 86400
+# 变化率指数加权平均时新观测的权重
+RECRAWL_ALPHA = 0.3
+# 爬虫空闲时一次最多推进 start_urls 的城市数
+RECRAWL_BATCH = 20
+
+# 启动时从城市目录生成所有城市的列表页请求；关掉后只处理 start_urls（用 `scrapy seed` 推送选定城市）
+START_FROM_DIRECTORY = True
+# 城市目录缓存在 Redis 里，超过这个时间（秒）才重新下载 SoufunFamily.htm，见 directory.py
+CITY_DIRECTORY_KEY = '%(spider)s:directory'
+CITY_DIRECTORY_MAX_AGE = 7 * 86400
+# 下载城市目录页时带上的 cookie，格式 'a=1; b=2'
+FANG_COOKIES = ''
+
 # Enable or disable spider middlewares
 # See https://docs.scrapy.org/en/latest/topics/spider-middleware.html
 #SPIDER_MIDDLEWARES = {
 #    "scrapy_fangtianxia.middlewares.ScrapyFangtianxiaSpiderMiddleware": 543,
 #}
+SPIDER_MIDDLEWARES = {
+    # 最靠近引擎，给 fang_pipeline_latency_seconds 记条目进入 pipeline 的时间；TELEMETRY_ENABLED 关闭时不启用
+    "scrapy_fangtianxia.telemetry.TelemetrySpiderMiddleware": 10,
+}
 
 # Enable or disable downloader middlewares
 # See https://docs.scrapy.org/en/latest/topics/downloader-middleware.html
 DOWNLOADER_MIDDLEWARES = {
-    "scrapy_fangtianxia.middlewares.SliderCaptchaMiddleware":700,
+    # 排在 CookiesMiddleware(700) 前面，共享会话的 Cookie 才能进入 cookiejar
+    "scrapy_fangtianxia.middlewares.SliderCaptchaMiddleware":650,
+    # 靠近下载器，看到的是原始的响应和异常
+    "scrapy_fangtianxia.throttle.AdaptiveThrottleMiddleware": 900,
 }
 
+# 滑块验证浏览器池配置
+CHROMEDRIVER_PATH = r'D:\chromedriver-win64\chromedriver-win64\chromedriver.exe'
+# 最多同时开几个浏览器（也就是最多同时处理几个验证码）
+CAPTCHA_BROWSER_POOL_SIZE = 2
+# 每个浏览器最多处理多少次验证后重启
+CAPTCHA_BROWSER_MAX_USES = 50
+# 浏览器空闲多少秒后关闭
+CAPTCHA_BROWSER_IDLE_TIMEOUT = 300
+# 等待滑块出现、等待验证通过的最长时间（秒）
+CAPTCHA_SOLVE_TIMEOUT = 10
+
+# 验证后的会话保存在 Redis（与调度器同一个 Redis），所有 worker 共用
+CAPTCHA_SESSION_ENABLED = True
+# domain: fang.com 下所有子域名共用一套会话；host: 每个子域名单独一套
+CAPTCHA_SESSION_SCOPE = 'domain'
+# 会话的有效期（秒）
+CAPTCHA_SESSION_TTL = 1800
+# 验证锁的超时时间（秒），其他 worker 最多等待这么久
+CAPTCHA_SESSION_LOCK_TIMEOUT = 60
+
 # Enable or disable extensions
 # See https://docs.scrapy.org/en/latest/topics/extensions.html
 #EXTENSIONS = {
 #    "scrapy.extensions.telnet.TelnetConsole": None,
 #}
+EXTENSIONS = {
+    # Prometheus 格式的运行指标，见 telemetry.py
+    "scrapy_fangtianxia.telemetry.TelemetryExtension": 500,
+    # 回调、中间件、pipeline 的耗时和采样剖析，见 profiling.py
+    "scrapy_fangtianxia.profiling.ProfilingExtension": 510,
+}
+
+# 运行指标端点 http://<TELEMETRY_HOST>:<端口>/metrics，端口在范围里挑第一个空闲的（同一台机器上多个节点）
+TELEMETRY_ENABLED = False
+# 让 Prometheus 从别的机器抓取时改成 '0.0.0.0'
+TELEMETRY_HOST = '127.0.0.1'
+TELEMETRY_PORT = [9410, 9420]
+# 多少秒查一次队列长度、算一次产出速度
+TELEMETRY_INTERVAL = 10
+# 产出速度按最近多少秒算
+TELEMETRY_RATE_WINDOW = 60
+# 下载延迟直方图的桶（秒）
+# TELEMETRY_LATENCY_BUCKETS = [0.05, 0.1, 0.25, 0.5, 1, 2, 4, 8, 16, 30, 60]
+
+# 从启动开始记录回调、中间件、pipeline 的 wall/CPU 时间并采样调用栈，关闭时写到 PROFILING_DIR
+PROFILING_ENABLED = False
+# 打开后 kill -USR1 <pid> 开始记录，再发一次结束并写文件（Windows 不支持）
+PROFILING_SIGNAL = False
+PROFILING_DIR = 'profiles'
+# 采样间隔（秒）
+PROFILING_SAMPLE_INTERVAL = 0.01
+# 默认只采样 reactor 线程，打开后也采样写文件、验证码等后台线程
+PROFILING_SAMPLE_ALL_THREADS = False
 
 # Configure item pipelines
 # See https://docs.scrapy.org/en/latest/topics/item-pipeline.html
@@ -114,12 +210,89 @@ FEED_EXPORT_ENCODING = "utf-8"
 
 # scrapy-redis 相关配置
 SCHEDULER = "scrapy_redis.scheduler.Scheduler"
-# 确保所有爬虫共享相同的去重指纹
-DUPEFILTER_CLASS = "scrapy_redis.dupefilter.RFPDupeFilter"
+# 按城市子域名分片的队列，各 worker 轮流从不同城市取请求，退避中的城市会被跳过
+SCHEDULER_QUEUE_CLASS = "scrapy_fangtianxia.queues.HostRoundRobinQueue"
+# 确保所有爬虫共享相同的去重指纹（布隆过滤器，内存占用固定）
+DUPEFILTER_CLASS = "scrapy_fangtianxia.dupefilter.BloomDupeFilter"
+# 布隆过滤器每个分片的容量和总误判率，第一次创建后以 Redis 里记录的为准
+BLOOMFILTER_CAPACITY = 1000000
+BLOOMFILTER_ERROR_RATE = 0.001
 # 设置redis为item pipeline
 ITEM_PIPELINES = {
-   'scrapy_redis.pipelines.RedisPipeline': 300
+   # 按 origin_url 和内容摘要去重，内容没变的房源不再写入 Redis
+   'scrapy_fangtianxia.pipelines.BloomDupeItemPipeline': 250,
+   # 价格、面积、年代等文本解析成数值字段
+   'scrapy_fangtianxia.pipelines.NormalizePipeline': 280,
+   # 批量写入 Redis，替代 scrapy_redis.pipelines.RedisPipeline
+   'scrapy_fangtianxia.pipelines.RedisBatchPipeline': 300,
+   # 按省份/城市分区写 Parquet，设置了 PARQUET_DIR 才启用
+   'scrapy_fangtianxia.pipelines.ParquetPipeline': 310,
+   # 按 origin_url 更新本地 SQLite 房源库，设置了 LISTING_STORE_DIR 才启用
+   'scrapy_fangtianxia.pipelines.ListingStorePipeline': 320,
+   # 在 Redis 里累加画图用的计数，AGGREGATES_ENABLED 打开才启用
+   'scrapy_fangtianxia.pipelines.AggregateCounterPipeline': 330,
+   # 按城市/行政区维护价格的分位数草图，SKETCHES_ENABLED 打开才启用
+   'scrapy_fangtianxia.pipelines.QuantileSketchPipeline': 340,
 }
+# 每批最多多少个条目、最多隔多少秒写一次
+REDIS_BATCH_SIZE = 500
+REDIS_BATCH_INTERVAL = 1.0
+# 连接断开、超时的批次最多写几次，之后丢弃；其他错误不重试
+REDIS_BATCH_MAX_RETRIES = 5
+# 归一化之后是否保留 price、area、year 等原始文本
+NORMALIZE_KEEP_RAW = False
+
+# 文件名、草图和运行指标里的节点名，默认 <主机名>-<进程号>；草图默认只用主机名，
+# 这样重启后还是同一个节点。同一台机器跑多个爬虫进程时必须各自设置不同的 NODE_ID
+# NODE_ID = 'worker-1'
+
+# 写文件的 pipeline（CSV、Parquet）在后台线程里写，以下配置的前缀分别是 CSV_ / PARQUET_：
+#   <PREFIX>_BATCH_SIZE      攒够多少条写一次
+#   <PREFIX>_FLUSH_INTERVAL  最多隔多少秒写一次
+#   <PREFIX>_QUEUE_SIZE      等待写入的条目上限，满了之后条目处理会等磁盘
+#   <PREFIX>_ROLL_SIZE       文件超过多少字节换新文件（Parquet 按所有分区的总大小算），0 表示不换
+#   <PREFIX>_ROLL_INTERVAL   文件打开超过多少秒换新文件，0 表示不换
+
+# CSV 输出目录（ScrapyFangtianxiaPipeline，默认当前目录）
+# CSV_DIR = 'data/csv'
+
+# Parquet 输出目录（需要安装 pyarrow），不设置时不写 Parquet
+# PARQUET_DIR = 'data/parquet'
+PARQUET_BATCH_SIZE = 5000
+PARQUET_FLUSH_INTERVAL = 30
+PARQUET_QUEUE_SIZE = 20000
+# 每小时换一批文件，写完的文件可以被读取和合并
+PARQUET_ROLL_INTERVAL = 3600
+# 同时打开的分区文件数上限
+PARQUET_MAX_OPEN_FILES = 64
+
+# 本地 SQLite 房源库所在目录（listings.db），complete_demo.py 会优先从这里统计
+# LISTING_STORE_DIR = 'data'
+LISTING_STORE_BATCH_SIZE = 500
+LISTING_STORE_FLUSH_INTERVAL = 2
+
+# 按类型/城市/价格区间等累加计数，按 origin_url 用布隆过滤器去重（容量和误判率同 BLOOMFILTER_*，HyperLogLog 只估计每个城市的条目数），
+# complete_demo.py 有这些计数时直接画图。批量大小和间隔同 REDIS_BATCH_*
+AGGREGATES_ENABLED = True
+AGGREGATES_KEY = '%(spider)s:agg'
+# 价格、单价的 t-digest 分位数草图（按类型、城市、行政区），每个节点定期写一次自己的那份，
+# 读的时候合并所有节点的草图；COMPRESSION 越大越准，每个草图大约 COMPRESSION 个质心
+SKETCHES_ENABLED = True
+SKETCHES_KEY = '%(spider)s:sketch'
+SKETCHES_COMPRESSION = 100
+SKETCHES_FLUSH_INTERVAL = 30
+# 节点超过这么多秒没有写草图就不再合并，它的哈希也随之过期，清掉不再运行的节点留下的草图。
+# 同一个 origin_url 只计入一次，用的布隆过滤器 <SKETCHES_KEY>:bloom 容量和误判率同 BLOOMFILTER_*
+SKETCHES_NODE_TTL = 7 * 86400
+# complete_demo.py 分块统计 Redis 里的数据时每块的条数和进程数（默认 CPU 核数）
+ANALYSIS_CHUNK_SIZE = 5000
+# ANALYSIS_WORKERS = 4
+# 条目在 Redis 里的编码：'json' 或 'msgpack'（字段名只存一次，体积小很多，需要安装 msgpack）
+ITEM_CODEC = 'json'
+# 在编码之后再用 zstd 压缩，可以指定用 benchmarks/bench_codec.py 训练出的共享字典（需要安装 zstandard）
+ITEM_CODEC_ZSTD = False
+# ITEM_CODEC_ZSTD_DICT = 'item_codec.dict'
+
 # 在redis中保持scrapy-redis用到的队列，不会清理redis中的队列，从而可以实现暂停和恢复的功
 # 能。
 SCHEDULER_PERSIST = True
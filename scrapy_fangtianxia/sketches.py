@@ -0,0 +1,210 @@
+# 可合并的分位数草图（t-digest），按城市/行政区统计价格中位数、p90 不用排序全部数据
+#
+# 每个爬虫节点在内存里维护自己的草图，定期整份写进自己的哈希，节点之间没有读改写的竞争：
+#
+#   <key>:nodes:updated  有序集合，节点 -> 最后一次写入草图的时间
+#   <key>:node:<节点>     哈希，<类型>:<字段>:<范围> -> TDigest.to_bytes()，带过期时间
+#
+# 范围是 all、city:<城市>、district:<城市>:<行政区>。读的时候把 ttl 秒内写过的节点的同一个字段合并。
+# 节点名是 NODE_ID，没有设置时是主机名，节点重启后先读回自己原来的草图接着累加；
+# 不再运行的节点的草图在 ttl 秒后过期。同一个 origin_url 只在第一次见到时加入草图（见 pipelines.py），
+# 重复抓取和重启后重新抓取不会让同一套房源被算多次。
+import math
+import struct
+import time
+from array import array
+
+# 统计分位数的数值字段和范围
+METRICS = ('price_wan', 'unit_price_yuan')
+HEADER = struct.Struct('<BdddI')
+VERSION = 1
+
+
+def scopes(item):
+    city = item.get('city')
+    result = ['all']
+    if city:
+        result.append(f'city:{city}')
+        if item.get('district'):
+            result.append(f'district:{city}:{item["district"]}')
+    return result
+
+
+class TDigest:
+    # 合并式 t-digest（Dunning & Ertl），用 k1 尺度函数：两端的质心小，分位数越靠近 0/1 越准。
+    # compression 越大越准、越占空间，质心数量大约不超过 compression 个
+    def __init__(self, compression=100):
+        self.compression = compression
+        self.means = []
+        self.weights = []
+        self.buffer = []
+        self.total = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def __len__(self):
+        return int(self.total + sum(w for _, w in self.buffer))
+
+    def add(self, value, weight=1.0):
+        if value is None or value != value:
+            return
+        value = float(value)
+        self.buffer.append((value, weight))
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+        if len(self.buffer) >= self.compression * 5:
+            self._compress()
+
+    def update(self, values):
+        for value in values:
+            self.add(value)
+
+    def _k(self, q):
+        return self.compression / (2 * math.pi) * math.asin(2 * q - 1)
+
+    def _q_limit(self, q):
+        k = self._k(q) + 1
+        if k >= self.compression / 4:
+            return 1.0
+        return (math.sin(k * 2 * math.pi / self.compression) + 1) / 2
+
+    def _compress(self):
+        if not self.buffer:
+            return
+        points = sorted(list(zip(self.means, self.weights)) + self.buffer)
+        self.buffer = []
+        total = sum(w for _, w in points)
+        means, weights = [], []
+        mean, weight = points[0]
+        so_far = 0.0
+        limit = self._q_limit(0.0)
+        for m, w in points[1:]:
+            if (so_far + weight + w) / total <= limit:
+                weight += w
+                mean += (m - mean) * w / weight
+            else:
+                means.append(mean)
+                weights.append(weight)
+                so_far += weight
+                limit = self._q_limit(so_far / total)
+                mean, weight = m, w
+        means.append(mean)
+        weights.append(weight)
+        self.means, self.weights, self.total = means, weights, total
+
+    def merge(self, other):
+        other._compress()
+        self.buffer.extend(zip(other.means, other.weights))
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self._compress()
+        return self
+
+    def quantile(self, q):
+        self._compress()
+        if not self.total:
+            return math.nan
+        means, weights = self.means, self.weights
+        if q <= 0:
+            return self.min
+        if q >= 1:
+            return self.max
+        if len(means) == 1:
+            return means[0]
+        target = q * self.total
+        # 第一个质心中心之前、最后一个质心中心之后按 min/max 插值
+        if target < weights[0] / 2:
+            return self.min + (means[0] - self.min) * target / (weights[0] / 2)
+        if target > self.total - weights[-1] / 2:
+            tail = self.total - target
+            return self.max - (self.max - means[-1]) * tail / (weights[-1] / 2)
+        center = weights[0] / 2
+        for i in range(len(means) - 1):
+            step = (weights[i] + weights[i + 1]) / 2
+            if target <= center + step:
+                return means[i] + (means[i + 1] - means[i]) * (target - center) / step
+            center += step
+        return means[-1]
+
+    def quantiles(self, qs):
+        return [self.quantile(q) for q in qs]
+
+    def to_bytes(self):
+        self._compress()
+        n = len(self.means)
+        return (HEADER.pack(VERSION, self.compression, self.min, self.max, n)
+                + array('d', self.means).tobytes() + array('d', self.weights).tobytes())
+
+    @classmethod
+    def from_bytes(cls, data):
+        version, compression, low, high, n = HEADER.unpack_from(data)
+        if version != VERSION:
+            raise ValueError(f"不支持的草图版本: {version}")
+        values = array('d')
+        values.frombytes(data[HEADER.size:HEADER.size + 16 * n])
+        digest = cls(compression)
+        digest.means, digest.weights = list(values[:n]), list(values[n:])
+        digest.total = sum(digest.weights)
+        digest.min, digest.max = low, high
+        return digest
+
+
+class SketchStore:
+    def __init__(self, server, key, node_id=None, ttl=7 * 86400):
+        self.server = server
+        self.key = key
+        self.node_id = node_id
+        self.ttl = ttl
+        self.nodes_key = f'{key}:nodes:updated'
+
+    def node_key(self, node_id):
+        return f'{self.key}:node:{node_id}'
+
+    def load_node(self):
+        # 这个节点之前写过的草图，{字段: TDigest}
+        return {field.decode(): TDigest.from_bytes(data)
+                for field, data in self.server.hgetall(self.node_key(self.node_id)).items()}
+
+    def save(self, digests):
+        # digests 是 {字段: 序列化好的草图}，整份覆盖这个节点的对应字段，同时延长过期时间
+        now = time.time()
+        node_key = self.node_key(self.node_id)
+        pipe = self.server.pipeline(transaction=False)
+        pipe.zadd(self.nodes_key, {self.node_id: now})
+        # 顺便清掉已经过期的节点
+        pipe.zremrangebyscore(self.nodes_key, '-inf', now - self.ttl)
+        pipe.hset(node_key, mapping=digests)
+        pipe.expire(node_key, int(self.ttl))
+        pipe.execute()
+
+    def nodes(self):
+        # ttl 秒内写过草图的节点
+        since = time.time() - self.ttl
+        return sorted(n.decode() for n in self.server.zrangebyscore(self.nodes_key, since, '+inf'))
+
+    def digest(self, listing_type, metric='price_wan', scope='all'):
+        # 合并所有节点的草图，没有数据时返回空的 TDigest
+        field = f'{listing_type}:{metric}:{scope}'
+        pipe = self.server.pipeline(transaction=False)
+        for node in self.nodes():
+            pipe.hget(self.node_key(node), field)
+        result = None
+        for data in pipe.execute():
+            if data is not None:
+                digest = TDigest.from_bytes(data)
+                result = digest if result is None else result.merge(digest)
+        return TDigest() if result is None else result
+
+    def quantiles(self, listing_type, metric='price_wan', scope='all', qs=(0.5, 0.9)):
+        return self.digest(listing_type, metric, scope).quantiles(qs)
+
+    def scopes(self, listing_type, metric='price_wan', prefix='city:'):
+        # 有数据的范围，比如所有城市 city:<城市>
+        start = f'{listing_type}:{metric}:'
+        result = set()
+        for node in self.nodes():
+            for field in self.server.hscan_iter(self.node_key(node), match=f'{start}{prefix}*'):
+                result.add(field[0].decode()[len(start):])
+        return sorted(result)
@@ -1,12 +1,20 @@
 
 import scrapy
+import json
 import re
+import time
 
 from scrapy import Request
 
 from scrapy_fangtianxia.items import NewHouseItem
 from scrapy_fangtianxia.items import ESFHouseItem
+from scrapy_fangtianxia.directory import DIRECTORY_URL, CityDirectory, content_hash, parse_cookies, parse_directory
+from scrapy_fangtianxia.incremental import SeenListings
+from scrapy_fangtianxia.recrawl import RecrawlPlanner
 from scrapy_redis.spiders import RedisSpider
+
+# 列表页的页码：新房 /house/s/b9<N>/，二手房 /house/i3<N>/
+PAGE_PATTERN = re.compile(r'/(b9|i3)(\d+)')
 # scrapy.Spider
 class FangSpider(RedisSpider):
     name = "fang"
@@ -18,62 +26,91 @@ class FangSpider(RedisSpider):
     ]
     # start_urls = ["https://www.fang.com/SoufunFamily.htm"]
     redis_key = 'fang:start_urls'
+    # 增量模式下记录已经见过的房源，见 INCREMENTAL_CRAWL
+    seen = None
+    # 按城市的变化速度安排重新爬取，见 RECRAWL_ENABLED
+    recrawl = None
+
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        spider = super().from_crawler(crawler, *args, **kwargs)
+        if crawler.settings.getbool('INCREMENTAL_CRAWL'):
+            spider.seen = SeenListings.from_spider(spider)
+        if crawler.settings.getbool('RECRAWL_ENABLED'):
+            if spider.seen is None:
+                # 变化速度要靠增量模式记录的房源摘要来判断
+                spider.logger.warning("RECRAWL_ENABLED 需要同时打开 INCREMENTAL_CRAWL，不安排重新爬取")
+            else:
+                spider.recrawl = RecrawlPlanner.from_spider(spider)
+        return spider
+
+    def make_request_from_data(self, data):
+        # RecrawlPlanner 推进 start_urls 的是某个城市列表第一页的 JSON，其他数据按 scrapy_redis 的方式处理
+        try:
+            payload = json.loads(data)
+        except ValueError:
+            payload = None
+        if not isinstance(payload, dict) or 'listing_type' not in payload:
+            return super().make_request_from_data(data)
+        callback = self.parse_newhouse if payload['listing_type'] == 'newhouse' else self.parse_esf
+        # 同一个地址之前请求过，要绕过去重
+        return scrapy.Request(url=payload['url'], callback=callback, dont_filter=True,
+                              meta={'info': (payload['province'], payload['city']),
+                                    'recrawl': payload.get('recrawl', False)})
+
+    def spider_idle(self):
+        # 先把到期的城市推进 start_urls，scrapy_redis 接着就会读出来
+        if self.recrawl is not None:
+            pushed = self.recrawl.push_due(self.redis_key, self.settings.getint('RECRAWL_BATCH', 20),
+                                           as_set=self.settings.getbool('REDIS_START_URLS_AS_SET'))
+            if pushed:
+                self.crawler.stats.inc_value('recrawl/pushed', pushed)
+        return super().spider_idle()
 
     def start_requests(self):
-        url = "https://www.fang.com/SoufunFamily.htm"
-        cookie_str = '你可以填写的cookie'
-        cookie_dict = {}
-        for item in cookie_str.split(';'):
-            item = item.strip()  # 去除前后空格
-            if item:  # 避免空字符串
-                k, v = item.split("=", 1)  # 只按第一个 "=" 分割（防止值含 "="）
-                cookie_dict[k] = v
+        if not self.settings.getbool('START_FROM_DIRECTORY', True):
+            # 只处理 start_urls 里的请求（`scrapy seed` 推进去的城市列表页等）
+            yield from super().start_requests()
+            return
+        # 城市目录缓存还新鲜时直接生成列表页请求，不用再下载目录页
+        directory = self.city_directory()
+        _, updated, entries = directory.load()
+        max_age = self.settings.getfloat('CITY_DIRECTORY_MAX_AGE', 7 * 86400)
+        if entries and time.time() - updated < max_age:
+            yield from self.listing_requests(entries)
+            return
         yield scrapy.Request(
-            url=url,
-            cookies=cookie_dict,  # 或直接传字符串：cookies=cookies
-            callback=self.parse
+            url=DIRECTORY_URL,
+            cookies=parse_cookies(self.settings.get('FANG_COOKIES')),
+            callback=self.parse,
+            dont_filter=self.seen is not None,
         )
 
-    def parse(self, response,**kwargs):
-        trs = response.xpath('//div[@class="outCont"]//tr')
-        province = None
-        for tr in trs:
-            tds = tr.xpath('.//td[not(@class)]')
-            province_td = tds[0]
-            province_text = province_td.xpath('.//strong//text()').get(default='')
-            province_text = re.sub(r'\s', '', province_text)
-            if province_text:
-                province = province_text
-                if province == '其它':
-                    continue
-            city_td = tds[1]
-            city_links = city_td.xpath('.//a')
-            for city_link in city_links:
-                city = city_link.xpath('.//text()').extract_first()
-                city_url = city_link.xpath('.//@href').extract_first()
-                # 构建新房的链接
-                url_module = city_url.split('.',1)
-                scheme = url_module[0]
-                domain = url_module[1]
-                if '/' in domain:
-                    newhouse_url = scheme + '.newhouse.' + domain + 'house/s/'
-                            # 构建二手房的链接
-                    esf_url = scheme + '.esf.' + domain
-                else:
-                    newhouse_url = scheme + '.newhouse.' + domain + '/' +'house/s/'
-                    # 构建二手房的链接
-                    esf_url = scheme + '.esf.' + domain + '/'
-
-                yield scrapy.Request(url=newhouse_url, callback=self.parse_newhouse,
-                                     meta={'info':(province, city)})
-
-                yield scrapy.Request(url=esf_url, callback=self.parse_esf,
-                                     meta={'info':(province, city)})
+    def city_directory(self):
+        key = self.settings.get('CITY_DIRECTORY_KEY', '%(spider)s:directory')
+        return CityDirectory(self.server, key % {'spider': self.name})
+
+    def parse(self, response, **kwargs):
+        entries = list(parse_directory(response))
+        if entries:
+            self.city_directory().save(content_hash(response.body), entries)
+        yield from self.listing_requests(entries)
+
+    def listing_requests(self, entries):
+        # 增量模式每次都要重新看列表页，持久化的去重只留给详情页
+        dont_filter = self.seen is not None
+        for entry in entries:
+            info = (entry['province'], entry['city'])
+            yield scrapy.Request(url=entry['newhouse'], callback=self.parse_newhouse, meta={'info': info},
+                                 dont_filter=dont_filter)
+            yield scrapy.Request(url=entry['esf'], callback=self.parse_esf, meta={'info': info},
+                                 dont_filter=dont_filter)
 
 
     def parse_newhouse(self,response):
         province, city = response.meta.get('info')
         lis = response.xpath('//div[contains(@class, "nl_con clearfix")]//ul//li')
+        items = []
         for li in lis:
             name = li.xpath('.//div[@class="nlcd_name"]/a/text()').get().strip()
             rooms = li.xpath('.//div[contains(@class,"house_type clearfix")]//a//text()').getall()
@@ -89,16 +126,22 @@ class FangSpider(RedisSpider):
             item = NewHouseItem(name=name, rooms=rooms, area=area, district=district, address=address,
                                  sale=sale, price=price, origin_url=origin_url, province=province,
                                  city=city)
-            yield item
+            items.append(item)
 
+        items, all_seen = self.check_seen('newhouse', response, items)
+        yield from items
+        if all_seen or response.meta.get('fanout'):
+            # 这一页全是见过的房源，或者后续页已经由第一页一次性生成了
+            return
         next_url = response.xpath('//div[@class="page"]//a[@class="next"]/@href').get()
         if next_url:
-            yield scrapy.Request(url=response.urljoin(next_url), callback=self.parse_newhouse,
-                                 meta={'info':(province,city)})
+            yield from self.paginate(response, response.urljoin(next_url), '//div[@class="page"]',
+                                     self.parse_newhouse, (province, city))
 
     def parse_esf(self,response):
         province, city = response.meta.get('info')
         lists = response.xpath('//div[contains(@class, "shop_list shop_list_4")]//dl')
+        items = []
         for lis in lists:
             item = ESFHouseItem(province=province, city=city)
             name = lis.xpath('.//p[@class="add_shop"]/a/text()').get()
@@ -126,9 +169,64 @@ class FangSpider(RedisSpider):
             item['price'] = price
             item['unit_price'] = unit_price
             item['origin_url'] = origin_url
-            yield item
+            items.append(item)
+
+        items, all_seen = self.check_seen('esf', response, items)
+        yield from items
+        if all_seen or response.meta.get('fanout'):
+            return
         next_url = response.xpath('//div[@class="page_box"]//p[1]//a/@href').get()
         if next_url:
             # next_url = response.urljoin(next_url)
-            yield scrapy.Request(url=response.urljoin(next_url), callback=self.parse_esf,
-                                 meta={'info': (province, city)})
+            yield from self.paginate(response, response.urljoin(next_url), '//div[@class="page_box"]',
+                                     self.parse_esf, (province, city))
+
+    def check_seen(self, listing_type, response, items):
+        # 增量模式：去掉内容没变的房源，并判断这一页是否全都见过
+        if self.seen is None:
+            return items, False
+        province, city = response.meta.get('info')
+        total = len(items)
+        items, all_seen = self.seen.filter(listing_type, city, items)
+        self.crawler.stats.inc_value('incremental/unchanged', total - len(items))
+        if all_seen:
+            self.crawler.stats.inc_value('incremental/stopped')
+        if self.recrawl is not None and not PAGE_PATTERN.search(response.url):
+            # 只按第一页估计变化速度，同一次访问的后续页隔得太近
+            self.recrawl.observe(listing_type, province, city, response.url, total, len(items))
+            self.crawler.stats.inc_value('recrawl/observed')
+        return items, all_seen
+
+    def paginate(self, response, next_url, page_xpath, callback, info):
+        # 从第一页读出总页数，把剩下的页一次性放进队列（每批最多 PAGINATION_FANOUT_MAX 页），
+        # 各页可以并行下载。读不到总页数时退回到按"下一页"逐页翻。
+        # 增量模式要在遇到见过的页时停下，所以只能逐页翻
+        max_pages = self.settings.getint('PAGINATION_FANOUT_MAX', 50) if self.seen is None else 0
+        match = PAGE_PATTERN.search(next_url)
+        total = self.page_count(response, page_xpath) if max_pages and match else None
+        # 重新爬取时后续页之前也请求过，同样要绕过持久化的去重
+        recrawl = response.meta.get('recrawl', False)
+        dont_filter = self.seen is not None or recrawl
+        if not total or total < int(match.group(2)):
+            yield scrapy.Request(url=next_url, callback=callback, meta={'info': info, 'recrawl': recrawl},
+                                 dont_filter=dont_filter)
+            return
+
+        first = int(match.group(2))
+        last = min(total, first + max_pages - 1)
+        for page in range(first, last + 1):
+            url = next_url[:match.start()] + f'/{match.group(1)}{page}' + next_url[match.end():]
+            # 超过上限的部分，由最后一页接着按"下一页"往后翻
+            yield scrapy.Request(url=url, callback=callback, dont_filter=dont_filter,
+                                 meta={'info': info, 'recrawl': recrawl, 'fanout': page < last or last == total})
+
+    def page_count(self, response, page_xpath):
+        page_box = response.xpath(page_xpath)
+        text = ''.join(page_box.xpath('.//text()').getall())
+        count = re.search(r'共\s*(\d+)\s*页', text)
+        if count:
+            return int(count.group(1))
+        # 没有"共N页"时，取分页链接（包括"尾页"）里最大的页码
+        pages = [int(m.group(2)) for href in page_box.xpath('.//a/@href').getall()
+                 for m in [PAGE_PATTERN.search(href)] if m]
+        return max(pages, default=None)
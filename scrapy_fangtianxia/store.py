@@ -0,0 +1,158 @@
+# 本地的房源库（SQLite），由 ListingStorePipeline 写入
+#
+# 按 origin_url 去重：再次爬到同一个房源时更新内容和 last_seen，first_seen 保持不变。
+# 只保存 NormalizePipeline 解析出来的数值字段和常用的文本字段，(city, district) 和价格上有索引，
+# 按城市、行政区、价格筛选和分组统计都不用全表扫描：
+#
+#   store = ListingStore('data/listings.db')
+#   store.count_by('city', 'esf')
+#   store.price_ranges('esf', city='广州')
+#   store.query('esf', city='广州', min_price=300, columns=['name', 'price_wan'], limit=100)
+import sqlite3
+import time
+from datetime import datetime
+
+from scrapy_fangtianxia.buckets import (
+    AGE_BINS, AGE_LABELS, AGE_ORDER, PRICE_BINS, PRICE_LABELS, PRICE_ORDER, UNKNOWN,
+)
+
+COLUMNS = (
+    'origin_url', 'listing_type', 'province', 'city', 'district', 'name', 'address', 'sale', 'toward',
+    'price_wan', 'unit_price_yuan', 'area_m2', 'year_built', 'floor_level', 'total_floors',
+    'room_count', 'hall_count',
+)
+# 可以用来筛选的列
+FILTERS = ('listing_type', 'province', 'city', 'district', 'sale', 'room_count')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS listings (
+    origin_url TEXT PRIMARY KEY,
+    listing_type TEXT NOT NULL,
+    province TEXT,
+    city TEXT,
+    district TEXT,
+    name TEXT,
+    address TEXT,
+    sale TEXT,
+    toward TEXT,
+    price_wan REAL,
+    unit_price_yuan REAL,
+    area_m2 REAL,
+    year_built INTEGER,
+    floor_level INTEGER,
+    total_floors INTEGER,
+    room_count INTEGER,
+    hall_count INTEGER,
+    first_seen REAL NOT NULL,
+    last_seen REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS listings_city_district ON listings (city, district);
+CREATE INDEX IF NOT EXISTS listings_price ON listings (price_wan);
+CREATE INDEX IF NOT EXISTS listings_type_city ON listings (listing_type, city);
+"""
+
+UPSERT = "INSERT INTO listings ({columns}, first_seen, last_seen) VALUES ({values}, ?, ?) " \
+         "ON CONFLICT(origin_url) DO UPDATE SET {updates}, last_seen = excluded.last_seen".format(
+             columns=', '.join(COLUMNS),
+             values=', '.join('?' for _ in COLUMNS),
+             updates=', '.join(f'{c} = excluded.{c}' for c in COLUMNS[1:]),
+         )
+
+
+def _bucket_sql(expression, bins, labels, op):
+    cases = ' '.join(f"WHEN {expression} {op} {bound} THEN '{label}'" for bound, label in zip(bins, labels))
+    return f"CASE WHEN {expression} IS NULL THEN '{UNKNOWN}' {cases} ELSE '{labels[-1]}' END"
+
+
+def _text(value):
+    # 新房的 rooms 等字段是列表；其他非字符串的值原样交给 sqlite
+    if isinstance(value, (list, tuple)):
+        return ''.join(str(v) for v in value if v)
+    return value
+
+
+class ListingStore:
+    def __init__(self, path, timeout=30):
+        self.path = path
+        self.conn = sqlite3.connect(path, timeout=timeout)
+        self.conn.row_factory = sqlite3.Row
+        # WAL 模式下分析脚本读的时候爬虫可以继续写
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.executescript(SCHEMA)
+
+    def upsert(self, listing_type, rows, seen_at=None):
+        # rows 是条目字典，没有 origin_url 的跳过；返回写入的条数
+        seen_at = seen_at or time.time()
+        params = [
+            (row['origin_url'], listing_type) + tuple(_text(row.get(c)) for c in COLUMNS[2:]) + (seen_at, seen_at)
+            for row in rows if row.get('origin_url')
+        ]
+        with self.conn:
+            self.conn.executemany(UPSERT, params)
+        return len(params)
+
+    def _where(self, listing_type=None, min_price=None, max_price=None, **filters):
+        clauses, params = [], []
+        if listing_type:
+            filters['listing_type'] = listing_type
+        for column, value in filters.items():
+            if column not in FILTERS:
+                raise ValueError(f"不能按 {column} 筛选")
+            if value is not None:
+                clauses.append(f'{column} = ?')
+                params.append(value)
+        if min_price is not None:
+            clauses.append('price_wan >= ?')
+            params.append(min_price)
+        if max_price is not None:
+            clauses.append('price_wan < ?')
+            params.append(max_price)
+        return (' WHERE ' + ' AND '.join(clauses)) if clauses else '', params
+
+    def _grouped(self, expression, listing_type, filters):
+        where, params = self._where(listing_type, **filters)
+        sql = f'SELECT {expression} AS value, COUNT(*) AS n FROM listings{where} GROUP BY value ORDER BY n DESC'
+        return [(row['value'], row['n']) for row in self.conn.execute(sql, params)]
+
+    def count_by(self, column, listing_type=None, **filters):
+        # [(值, 房源数)]，按数量从多到少
+        if column not in COLUMNS:
+            raise ValueError(f"没有 {column} 这一列")
+        return self._grouped(column, listing_type, filters)
+
+    def price_ranges(self, listing_type=None, **filters):
+        # [(价格区间, 房源数)]，按 PRICE_ORDER 排序，没有房源的区间不返回
+        counts = dict(self._grouped(_bucket_sql('price_wan', PRICE_BINS, PRICE_LABELS, '<'), listing_type, filters))
+        return [(label, counts[label]) for label in PRICE_ORDER if label in counts]
+
+    def age_ranges(self, listing_type=None, current_year=None, **filters):
+        age = f'({int(current_year or datetime.now().year)} - year_built)'
+        counts = dict(self._grouped(_bucket_sql(age, AGE_BINS, AGE_LABELS, '<='), listing_type, filters))
+        return [(label, counts[label]) for label in AGE_ORDER if label in counts]
+
+    def summary(self, listing_type=None, **filters):
+        where, params = self._where(listing_type, **filters)
+        row = self.conn.execute(
+            'SELECT COUNT(*) AS count, AVG(price_wan) AS price_mean, MIN(price_wan) AS price_min, '
+            'MAX(price_wan) AS price_max, AVG(year_built) AS year_mean, MIN(year_built) AS year_min, '
+            f'MAX(year_built) AS year_max FROM listings{where}', params).fetchone()
+        return dict(row)
+
+    def query(self, listing_type=None, columns=None, order_by=None, limit=None, **filters):
+        # 逐行返回字典
+        columns = list(columns or COLUMNS + ('first_seen', 'last_seen'))
+        for column in columns + ([order_by.lstrip('-')] if order_by else []):
+            if column not in COLUMNS + ('first_seen', 'last_seen'):
+                raise ValueError(f"没有 {column} 这一列")
+        where, params = self._where(listing_type, **filters)
+        sql = f'SELECT {", ".join(columns)} FROM listings{where}'
+        if order_by:
+            sql += f' ORDER BY {order_by.lstrip("-")} {"DESC" if order_by.startswith("-") else "ASC"}'
+        if limit:
+            sql += ' LIMIT ?'
+            params.append(int(limit))
+        for row in self.conn.execute(sql, params):
+            yield dict(row)
+
+    def close(self):
+        self.conn.close()
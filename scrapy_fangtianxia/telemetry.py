@@ -0,0 +1,309 @@
+# 运行指标：在本机开一个 Prometheus 格式的 HTTP 端点（/metrics），生产环境 LOG_LEVEL 是 WARNING 时
+# 也能看到每个节点的时间花在哪里：
+#
+#   fang_download_latency_seconds{host}       下载延迟直方图（request.meta['download_latency']）
+#   fang_responses_total{host, status}        响应数
+#   fang_captcha_total{host, event}           验证码 detected/solved/failed，来自 SliderCaptchaMiddleware 的信号
+#   fang_captcha_solve_seconds{phase}         验证各阶段（load/drag/verify/total）耗时直方图
+#   fang_items_total{type, callback}          产出的房源数
+#   fang_items_per_second{type}               最近 TELEMETRY_RATE_WINDOW 秒的产出速度
+#   fang_pipeline_latency_seconds{type}       一个条目经过所有 pipeline 的耗时直方图
+#   fang_queue_depth{queue}                   Redis 调度队列、start_urls 的长度，下载器中的请求数
+#   fang_stat{stat}                           Scrapy stats 里的数值（captcha/session_reused、redis_batch/* 等）
+#
+# 所有序列都带 node（NODE_ID，默认 <主机名>-<进程号>）和 spider 标签。
+# 热路径上只有字典和列表的加法，队列长度每 TELEMETRY_INTERVAL 秒在线程里查一次 Redis，
+# 抓取 /metrics 时只读内存里的值，可以一直开着。
+#
+# pipeline 耗时从 TelemetrySpiderMiddleware 看到条目离开爬虫中间件链时开始，
+# 到 item_scraped/item_dropped/item_error 信号为止，要同时启用这个爬虫中间件。
+import logging
+import time
+from bisect import bisect_left
+from collections import deque
+
+from itemadapter import is_item
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+from scrapy.utils.defer import maybe_deferred_to_future
+from scrapy.utils.httpobj import urlparse_cached
+from scrapy.utils.reactor import listen_tcp
+from twisted.internet.task import LoopingCall
+from twisted.internet.threads import deferToThread
+from twisted.web import resource, server
+
+from scrapy_fangtianxia.middlewares import captcha_detected, captcha_failed, captcha_solved
+from scrapy_fangtianxia.pipelines import default_node_id, item_type_name
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2, 4, 8, 16, 30, 60)
+SOLVE_BUCKETS = (0.5, 1, 2, 4, 8, 15, 30, 60)
+PIPELINE_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5)
+# 超过这么多秒还没有结果的条目（pipeline 换掉了条目对象等）不再等它的信号
+PIPELINE_START_TIMEOUT = 600
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def _labels(names, values):
+    return ','.join(f'{n}="{_escape(v)}"' for n, v in zip(names, values))
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    # 一个指标的所有序列，键是标签值的元组
+    type = 'untyped'
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+
+    def samples(self):
+        # [(后缀, 标签名, 标签值, 值)]
+        return [('', self.labelnames, labels, value) for labels, value in self.values.items()]
+
+    def render(self, constnames, constvalues):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.type}']
+        for suffix, names, values, value in self.samples():
+            labels = _labels(constnames + names, constvalues + values)
+            lines.append(f'{self.name}{suffix}{{{labels}}} {_number(value)}')
+        return lines
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, labels=(), amount=1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def set(self, labels, value):
+        self.values[labels] = value
+
+
+class Histogram(Metric):
+    # 每个序列是 [各个桶的数量..., 超过最大桶的数量, 总和]，输出时再累加成 Prometheus 的 le 桶
+    type = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(float(b) for b in buckets))
+
+    def observe(self, labels, value):
+        counts = self.values.get(labels)
+        if counts is None:
+            counts = self.values[labels] = [0] * (len(self.buckets) + 2)
+        counts[bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    def samples(self):
+        samples = []
+        le_names = self.labelnames + ('le',)
+        for labels, counts in self.values.items():
+            total = 0
+            for bound, n in zip(self.buckets + (float('inf'),), counts):
+                total += n
+                samples.append(('_bucket', le_names, labels + (_number(bound),), total))
+            samples.append(('_sum', self.labelnames, labels, counts[-1]))
+            samples.append(('_count', self.labelnames, labels, total))
+        return samples
+
+
+class MetricsResource(resource.Resource):
+    isLeaf = True
+
+    def __init__(self, telemetry):
+        super().__init__()
+        self.telemetry = telemetry
+
+    def render_GET(self, request):
+        request.setHeader(b'Content-Type', b'text/plain; version=0.0.4; charset=utf-8')
+        return self.telemetry.render().encode('utf-8')
+
+
+class TelemetryExtension:
+    def __init__(self, crawler):
+        settings = crawler.settings
+        if not settings.getbool('TELEMETRY_ENABLED'):
+            raise NotConfigured
+        self.crawler = crawler
+        self.host = settings.get('TELEMETRY_HOST', '127.0.0.1')
+        self.portrange = [int(p) for p in settings.getlist('TELEMETRY_PORT', [9410, 9420])]
+        self.interval = settings.getfloat('TELEMETRY_INTERVAL', 10)
+        self.rate_window = settings.getfloat('TELEMETRY_RATE_WINDOW', 60)
+        self.node_id = settings.get('NODE_ID') or default_node_id()
+        buckets = settings.getlist('TELEMETRY_LATENCY_BUCKETS') or LATENCY_BUCKETS
+
+        self.download_latency = Histogram('fang_download_latency_seconds', '下载延迟', ('host',), buckets)
+        self.responses = Counter('fang_responses_total', '收到的响应', ('host', 'status'))
+        self.captcha = Counter('fang_captcha_total', '滑块验证码', ('host', 'event'))
+        self.solve_time = Histogram('fang_captcha_solve_seconds', '滑块验证各阶段耗时', ('phase',),
+                                    SOLVE_BUCKETS)
+        self.items = Counter('fang_items_total', '产出的房源', ('type', 'callback'))
+        self.item_rate = Gauge('fang_items_per_second', f'最近 {self.rate_window:g} 秒每秒产出的房源', ('type',))
+        self.pipeline_latency = Histogram('fang_pipeline_latency_seconds', '条目经过所有 pipeline 的耗时',
+                                          ('type',), PIPELINE_BUCKETS)
+        self.queue_depth = Gauge('fang_queue_depth', '队列长度', ('queue',))
+        self.metrics = [self.download_latency, self.responses, self.captcha, self.solve_time, self.items,
+                        self.item_rate, self.pipeline_latency, self.queue_depth]
+
+        # 每种房源的累计产出数，采样时记下来算速度
+        self.item_counts = {}
+        # id(条目) -> 进入 pipeline 的时间
+        self.item_started = {}
+        self.item_samples = deque()
+        self.spider = None
+        self.port = None
+        self.sampler = LoopingCall(self.sample)
+
+        crawler.signals.connect(self.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(self.spider_closed, signal=signals.spider_closed)
+        crawler.signals.connect(self.response_received, signal=signals.response_received)
+        crawler.signals.connect(self.item_scraped, signal=signals.item_scraped)
+        crawler.signals.connect(self.item_finished, signal=signals.item_dropped)
+        crawler.signals.connect(self.item_finished, signal=signals.item_error)
+        crawler.signals.connect(self.captcha_detected, signal=captcha_detected)
+        crawler.signals.connect(self.captcha_solved, signal=captcha_solved)
+        crawler.signals.connect(self.captcha_failed, signal=captcha_failed)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler)
+
+    def spider_opened(self, spider):
+        self.spider = spider
+        site = server.Site(MetricsResource(self))
+        site.noisy = False
+        self.port = listen_tcp(self.portrange, self.host, site)
+        address = self.port.getHost()
+        logger.info("Telemetry listening on http://%s:%d/metrics", address.host, address.port)
+        self.crawler.stats.set_value('telemetry/port', address.port)
+        self.sampler.start(self.interval, now=True)
+
+    async def spider_closed(self, spider):
+        if self.sampler.running:
+            self.sampler.stop()
+        if self.port is not None:
+            await maybe_deferred_to_future(self.port.stopListening())
+
+    def response_received(self, response, request, spider):
+        host = urlparse_cached(request).hostname or ''
+        latency = request.meta.get('download_latency')
+        if latency is not None:
+            self.download_latency.observe((host,), latency)
+        self.responses.inc((host, response.status))
+
+    def item_entered(self, item):
+        # TelemetrySpiderMiddleware 在条目交给 pipeline 之前调用
+        self.item_started[id(item)] = time.perf_counter()
+
+    def item_finished(self, item):
+        # 丢弃、出错、写完的条目都算 pipeline 耗时
+        start = self.item_started.pop(id(item), None)
+        if start is not None:
+            self.pipeline_latency.observe((item_type_name(item) or type(item).__name__,),
+                                          time.perf_counter() - start)
+
+    def item_scraped(self, item, response, spider):
+        self.item_finished(item)
+        name = item_type_name(item) or type(item).__name__
+        callback = getattr(getattr(response, 'request', None), 'callback', None)
+        self.items.inc((name, getattr(callback, '__name__', 'parse')))
+        self.item_counts[name] = self.item_counts.get(name, 0) + 1
+
+    def captcha_detected(self, host):
+        self.captcha.inc((host, 'detected'))
+
+    def captcha_solved(self, host, timings):
+        self.captcha.inc((host, 'solved'))
+        for phase, seconds in timings.items():
+            self.solve_time.observe((phase,), seconds)
+
+    def captcha_failed(self, host):
+        self.captcha.inc((host, 'failed'))
+
+    def sample(self):
+        # 产出速度在 reactor 线程里算，Redis 的队列长度放到线程里查
+        now = time.monotonic()
+        self.item_samples.append((now, dict(self.item_counts)))
+        while len(self.item_samples) > 2 and now - self.item_samples[1][0] >= self.rate_window:
+            self.item_samples.popleft()
+        since, old = self.item_samples[0]
+        for name, count in self.item_counts.items():
+            self.item_rate.set((name,), (count - old.get(name, 0)) / (now - since) if now > since else 0.0)
+        deadline = time.perf_counter() - PIPELINE_START_TIMEOUT
+        for key in [key for key, start in self.item_started.items() if start < deadline]:
+            del self.item_started[key]
+
+        engine = self.crawler.engine
+        if engine is not None and engine.downloader is not None:
+            self.queue_depth.set(('downloading',), len(engine.downloader.active))
+        d = deferToThread(self._redis_depths, engine.scheduler if engine is not None else None)
+        d.addCallback(self._update_depths)
+        d.addErrback(lambda f: logger.warning("Telemetry queue sampling failed: %s", f.value))
+        return d
+
+    def _redis_depths(self, scheduler):
+        depths = {}
+        if scheduler is not None:
+            depths['scheduled'] = len(scheduler)
+        spider = self.spider
+        if spider is not None and getattr(spider, 'server', None) is not None:
+            key = spider.redis_key
+            if spider.settings.getbool('REDIS_START_URLS_AS_SET'):
+                depths['start_urls'] = spider.server.scard(key)
+            else:
+                depths['start_urls'] = spider.server.llen(key)
+        return depths
+
+    def _update_depths(self, depths):
+        for name, value in depths.items():
+            self.queue_depth.set((name,), value)
+
+    def render(self):
+        spider = self.spider.name if self.spider is not None else ''
+        constnames, constvalues = ('node', 'spider'), (self.node_id, spider)
+        lines = []
+        for metric in self.metrics:
+            if metric.values:
+                lines += metric.render(constnames, constvalues)
+        stats = Gauge('fang_stat', 'Scrapy stats 里的数值', ('stat',))
+        for name, value in self.crawler.stats.get_stats().items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                stats.set((name,), value)
+        lines += stats.render(constnames, constvalues)
+        return '\n'.join(lines) + '\n'
+
+
+class TelemetrySpiderMiddleware:
+    # 放在爬虫中间件链最靠近引擎的位置，记下每个条目交给 pipeline 的时间
+    def __init__(self, telemetry):
+        self.telemetry = telemetry
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        telemetry = next((ext for ext in crawler.extensions.middlewares
+                          if isinstance(ext, TelemetryExtension)), None)
+        if telemetry is None:
+            raise NotConfigured
+        return cls(telemetry)
+
+    async def process_spider_output(self, response, result):
+        item_entered = self.telemetry.item_entered
+        async for output in result:
+            if is_item(output):
+                item_entered(output)
+            yield output
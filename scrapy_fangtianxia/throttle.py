@@ -0,0 +1,139 @@
+# 按域名自适应调整并发和下载延迟（AIMD）
+#
+# 每个城市子域名（<city>.newhouse.fang.com、<city>.esf.fang.com）都有自己的反爬额度，
+# 所以每个下载 slot 单独维护一个控制器：
+#   - 延迟正常、没有报错和验证码时，并发 +1、延迟减少一点（加性增长）
+#   - 出错或遇到验证码时，并发减半、延迟翻倍（乘性减少）
+# 全局上限仍由 CONCURRENT_REQUESTS 控制。
+import logging
+
+from scrapy.exceptions import NotConfigured
+
+from scrapy_fangtianxia.middlewares import is_captcha_response
+
+logger = logging.getLogger(__name__)
+
+# 这些状态码说明被限流或者服务器扛不住了
+BACKOFF_HTTP_CODES = {403, 429, 500, 502, 503, 504}
+
+
+class HostController:
+    def __init__(self, concurrency, delay, min_delay=0.25, max_delay=30, max_concurrency=8,
+                 target_latency=2.0, delay_step=0.25, smoothing=0.2):
+        self.concurrency = max(1, concurrency)
+        self.delay = delay
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.max_concurrency = max_concurrency
+        self.target_latency = target_latency
+        self.delay_step = delay_step
+        self.smoothing = smoothing
+        # 指数加权平均的延迟、出错率、验证码命中率
+        self.latency = None
+        self.error_rate = 0.0
+        self.captcha_rate = 0.0
+        # 上次调整之后收到的响应数，至少等一轮并发的响应回来再调整
+        self.since_change = 0
+        self.last_action = None
+
+    def observe(self, latency=None, error=False, captcha=False):
+        a = self.smoothing
+        if latency is not None:
+            self.latency = latency if self.latency is None else a * latency + (1 - a) * self.latency
+        self.error_rate = a * error + (1 - a) * self.error_rate
+        self.captcha_rate = a * captcha + (1 - a) * self.captcha_rate
+        self.since_change += 1
+        # 刚退避过时，还在路上的请求可能继续出错，等它们回来之后再判断
+        settled = self.since_change >= self.concurrency
+
+        if error or captcha:
+            if self.last_action == 'backoff' and not settled:
+                return None
+            self.concurrency = max(1, self.concurrency // 2)
+            self.delay = min(self.max_delay, max(self.delay * 2, self.min_delay))
+            return self._changed('backoff')
+        if not settled:
+            return None
+        if self.latency is not None and self.latency > self.target_latency:
+            # 响应变慢，保持不动
+            return None
+        if self.error_rate < 0.05 and self.captcha_rate < 0.05:
+            self.concurrency = min(self.max_concurrency, self.concurrency + 1)
+            self.delay = max(self.min_delay, self.delay - self.delay_step)
+            return self._changed('increase')
+        return None
+
+    def _changed(self, action):
+        self.since_change = 0
+        self.last_action = action
+        return action
+
+
+class AdaptiveThrottleMiddleware:
+    def __init__(self, crawler):
+        settings = crawler.settings
+        if not settings.getbool('ADAPTIVE_THROTTLE_ENABLED'):
+            raise NotConfigured
+        self.crawler = crawler
+        self.stats = crawler.stats
+        self.debug = settings.getbool('ADAPTIVE_THROTTLE_DEBUG')
+        self.options = dict(
+            min_delay=settings.getfloat('ADAPTIVE_THROTTLE_MIN_DELAY', 0.25),
+            max_delay=settings.getfloat('ADAPTIVE_THROTTLE_MAX_DELAY', 30),
+            max_concurrency=settings.getint('ADAPTIVE_THROTTLE_MAX_CONCURRENCY', 8),
+            target_latency=settings.getfloat('ADAPTIVE_THROTTLE_TARGET_LATENCY', 2.0),
+        )
+        self.hosts = {}
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler)
+
+    def process_response(self, request, response, spider):
+        captcha = is_captcha_response(response)
+        error = response.status in BACKOFF_HTTP_CODES
+        self._observe(request, request.meta.get('download_latency'), error, captcha)
+        return response
+
+    def process_exception(self, request, exception, spider):
+        self._observe(request, None, True, False)
+        return None
+
+    def _observe(self, request, latency, error, captcha):
+        key = request.meta.get('download_slot')
+        slot = self.crawler.engine.downloader.slots.get(key)
+        if slot is None:
+            return
+        controller = self.hosts.get(key)
+        if controller is None:
+            controller = self.hosts[key] = HostController(slot.concurrency, slot.delay, **self.options)
+        action = controller.observe(latency, error, captcha)
+        # 空闲的 slot 会被下载器回收后重建，每次都同步一下
+        slot.concurrency = controller.concurrency
+        slot.delay = controller.delay
+        if action is None:
+            return
+        if action == 'backoff':
+            queue = self._scheduler_queue()
+            if hasattr(queue, 'backoff'):
+                # 让所有 worker 在退避期内都不从这个域名出队
+                queue.backoff(key, controller.delay)
+        self.stats.inc_value(f'adaptive_throttle/{action}')
+        if self.debug:
+            logger.info(
+                "slot: %(slot)s | %(action)s | conc:%(concurrency)2d | delay:%(delay)5d ms | "
+                "latency:%(latency)5d ms | errors:%(errors).2f | captchas:%(captchas).2f",
+                {
+                    'slot': key, 'action': action,
+                    'concurrency': controller.concurrency,
+                    'delay': controller.delay * 1000,
+                    'latency': (controller.latency or 0) * 1000,
+                    'errors': controller.error_rate,
+                    'captchas': controller.captcha_rate,
+                },
+            )
+
+    def _scheduler_queue(self):
+        engine = self.crawler.engine
+        scheduler = getattr(engine, 'scheduler', None) or getattr(getattr(engine, 'slot', None), 'scheduler', None)
+        return getattr(scheduler, 'queue', None)
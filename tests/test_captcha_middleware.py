@@ -0,0 +1,146 @@
+# 滑块验证在工作线程里进行时，其他响应照常通过中间件，reactor 不被卡住
+import threading
+import time
+
+from scrapy import Request, Spider
+from scrapy.http import HtmlResponse
+from scrapy.statscollectors import MemoryStatsCollector
+from scrapy.utils.test import get_crawler
+from twisted.internet import defer, task
+from selenium.webdriver.remote.webelement import WebElement
+from twisted.trial import unittest
+
+from scrapy_fangtianxia.middlewares import CAPTCHA_HOST, SliderCaptchaMiddleware
+
+# 假浏览器打开验证页要花的时间
+LOAD_SECONDS = 0.5
+LISTING_URL = 'https://bj.newhouse.fang.com/house/s/'
+
+
+class FakeElement(WebElement):
+    # ActionChains 只接受 WebElement
+    def value_of_css_property(self, name):
+        return '300px'
+
+
+class FakeDriver:
+    # 不启动 Chrome，只实现 _solve 用到的 WebDriver 接口：打开页面时睡一段时间，
+    # 收到拖动滑块的动作之后跳回列表页，并在注入的 Cookie 之外发一个新的
+    def __init__(self):
+        self.cookies = {}
+        self.injected = {}
+        self.current_url = 'about:blank'
+        self.threads = []
+        self.quit_called = False
+
+    def execute_cdp_cmd(self, cmd, params):
+        if cmd == 'Network.clearBrowserCookies':
+            self.cookies = {}
+        elif cmd == 'Network.setCookie':
+            self.cookies[params['name']] = params['value']
+            self.injected[params['name']] = params['value']
+        return {}
+
+    def get(self, url):
+        self.threads.append(threading.get_ident())
+        time.sleep(LOAD_SECONDS)
+        self.current_url = url
+
+    def find_element(self, by, value):
+        return FakeElement(self, value)
+
+    def execute(self, command, params=None):
+        # ActionChains.perform() 发过来的 W3C 动作，当作滑块拖到了头
+        self.current_url = LISTING_URL
+        self.cookies['verified'] = '1'
+        return {'value': None}
+
+    def get_cookies(self):
+        if CAPTCHA_HOST in self.current_url:
+            return []
+        return [{'name': name, 'value': value} for name, value in self.cookies.items()]
+
+    @property
+    def page_source(self):
+        return '<html><body>房源列表</body></html>'
+
+    def quit(self):
+        self.quit_called = True
+
+
+class FakeBrowserMiddleware(SliderCaptchaMiddleware):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.drivers = []
+
+    def _create_driver(self):
+        driver = FakeDriver()
+        self.drivers.append(driver)
+        return driver
+
+
+class CaptchaThroughputTest(unittest.TestCase):
+    def setUp(self):
+        self.spider = Spider('test')
+        self.stats = MemoryStatsCollector(get_crawler(Spider))
+        self.mw = FakeBrowserMiddleware(sessions=None, pool_size=1, stats=self.stats)
+        self.closed = False
+
+    def tearDown(self):
+        if not self.closed:
+            self.mw.close(self.spider)
+
+    @defer.inlineCallbacks
+    def test_other_responses_flow_during_solve(self):
+        captcha_request = Request(LISTING_URL, cookies={'city': 'bj'})
+        captcha_response = HtmlResponse(f'https://{CAPTCHA_HOST}/?r=1', body='拖动滑块验证'.encode('utf-8'),
+                                        encoding='utf-8', request=captcha_request)
+        solving = defer.Deferred.fromCoroutine(
+            self.mw.process_response(captcha_request, captcha_response, self.spider))
+
+        # 验证期间每 20ms 处理一个普通响应
+        passed = []
+
+        def normal_response():
+            if solving.called:
+                return
+            request = Request(f'https://sh.esf.fang.com/house/i3{len(passed) + 2}/')
+            response = HtmlResponse(request.url, body=b'<html>ok</html>', request=request)
+            d = defer.Deferred.fromCoroutine(self.mw.process_response(request, response, self.spider))
+            d.addCallback(lambda result: passed.append((time.monotonic(), result is response)))
+
+        loop = task.LoopingCall(normal_response)
+        loop.start(0.02)
+        started = time.monotonic()
+        solved = yield solving
+        finished = time.monotonic()
+        loop.stop()
+
+        self.assertGreaterEqual(finished - started, LOAD_SECONDS)
+        # 普通响应原样返回，而且是在验证结束之前处理完的
+        self.assertTrue(all(same for _, same in passed))
+        self.assertGreaterEqual(len([t for t, _ in passed if t < finished]), int(LOAD_SECONDS / 0.02) // 2)
+
+        # 验证在工作线程里完成，请求的 Cookie 先注入浏览器，验证后的 Cookie 带回请求
+        [driver] = self.mw.drivers
+        self.assertNotIn(threading.get_ident(), driver.threads)
+        self.assertEqual(driver.injected, {'city': 'bj'})
+        self.assertEqual(solved.url, LISTING_URL)
+        self.assertIs(solved.request, captcha_request)
+        self.assertIn('房源列表', solved.text)
+        self.assertEqual(captcha_request.cookies, {'city': 'bj', 'verified': '1'})
+        # 用完之后清掉浏览器里的 Cookie
+        self.assertEqual(driver.cookies, {})
+
+        # 各阶段耗时记进 stats
+        stats = self.stats.get_stats()
+        self.assertEqual(stats['captcha/detected'], 1)
+        self.assertEqual(stats['captcha/solved'], 1)
+        for phase in ('load', 'drag', 'verify', 'total'):
+            self.assertIn(f'captcha/time/{phase}_ms', stats)
+        self.assertGreaterEqual(stats['captcha/time/load_ms'], LOAD_SECONDS * 1000)
+
+        # 关闭中间件时退出浏览器
+        self.mw.close(self.spider)
+        self.closed = True
+        self.assertTrue(driver.quit_called)
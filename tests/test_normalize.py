@@ -0,0 +1,38 @@
+# 爬取时把原始文本解析成数值字段
+from unittest import TestCase
+
+from itemadapter import ItemAdapter
+
+from scrapy_fangtianxia.items import ESFHouseItem
+from scrapy_fangtianxia.normalize import normalize, parse_area, parse_price, parse_unit_price
+
+# (原始价格, (总价 万元, 单价 元/㎡))
+PRICE_CASES = [
+    ('350万', (350.0, None)),
+    ('1.2亿', (12000.0, None)),
+    ('35000元/㎡', (None, 35000.0)),
+    ('售价1,200万', (1200.0, None)),
+    ('售价1，200万', (1200.0, None)),
+    ('35,000元/㎡', (None, 35000.0)),
+    ('1,234,567元', (123.4567, None)),
+    ('售价待定', (None, None)),
+]
+
+
+class NormalizeTest(TestCase):
+    def test_parse_price(self):
+        for text, expected in PRICE_CASES:
+            with self.subTest(text=text):
+                self.assertEqual(parse_price(text), expected)
+
+    def test_thousands_separator_only_between_digit_groups(self):
+        self.assertEqual(parse_unit_price('39,325元/㎡'), 39325.0)
+        # 逗号后面不是正好三位数字的不是千分位，照旧取第一个数
+        self.assertEqual(parse_area('89,1435平米'), 89.0)
+
+    def test_normalize_item(self):
+        adapter = normalize(ItemAdapter(ESFHouseItem(price='1,200万', area='89.5㎡', rooms='3室2厅')))
+        self.assertEqual(adapter['price_wan'], 1200.0)
+        self.assertEqual(adapter['area_m2'], 89.5)
+        self.assertEqual((adapter['room_count'], adapter['hall_count']), (3, 2))
+        self.assertNotIn('price', adapter)
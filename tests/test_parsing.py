@@ -0,0 +1,84 @@
+# 按列的价格/年份解析、区间划分和原来逐行的单值函数结果一致；有没有 pyarrow 都要一致
+from unittest import TestCase, mock
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.bench_parsing import make_prices, make_years
+from fang_analysis import parsing
+from fang_analysis.parsing import (
+    age_ranges, get_age_range_label, get_price_range_label, parse_price_to_wan, parse_prices,
+    parse_year, parse_years, price_ranges,
+)
+
+CURRENT_YEAR = 2024
+# 随机数据的条数，和手写的边界情况一起检查
+RANDOM_CASES = 20000
+
+PRICE_CASES = [
+    '', None, np.nan, 0, 150, 149.99, 300.0, '150万', '1.2亿', '5000元/㎡', '85000元', '售价待定',
+    '约320万/套', '1000', '999.9万', '2亿3000万', '3万-5万', '万', '.5万', True, float('inf'),
+    -1, '1e3万', ['150万'],
+]
+YEAR_CASES = [
+    '', None, np.nan, 2005, 2005.7, '2005年建', '1899年建', '1900年', '12345', '建于2010年', '3000年',
+    '年份未知', '98年建', 0, -5.5, float('inf'), ['2005'],
+]
+
+
+def first_mismatch(expected, actual):
+    # 第一个不一致的下标，都是缺失值算一致
+    expected = pd.Series(expected, dtype=object)
+    actual = pd.Series(actual, dtype=object)
+    for i, (a, b) in enumerate(zip(expected, actual)):
+        if pd.isna(a) and pd.isna(b):
+            continue
+        if pd.isna(a) or pd.isna(b) or a != b:
+            return i
+    return None
+
+
+def scalar_or_nan(func, value):
+    # 原来的单值函数遇到 '1.2.3' 这种值会抛异常，按列版本返回缺失
+    try:
+        return func(value)
+    except ValueError:
+        return np.nan
+
+
+class ParsingParityTest(TestCase):
+    def assertSame(self, name, expected, actual, inputs):
+        self.assertEqual(len(expected), len(actual))
+        bad = first_mismatch(expected, actual)
+        if bad is not None:
+            self.fail(f'{name} 结果不一致: 输入 {inputs[bad]!r}，逐行 {expected[bad]!r}，按列 {actual[bad]!r}')
+
+    def check_prices(self):
+        prices = PRICE_CASES + make_prices(RANDOM_CASES, seed=1)
+        expected = [scalar_or_nan(parse_price_to_wan, v) for v in prices]
+        actual = parse_prices(pd.Series(prices, dtype=object))
+        self.assertSame('price', expected, list(actual), prices)
+        self.assertSame('price_range', [get_price_range_label(v) for v in expected],
+                        list(price_ranges(actual)), prices)
+
+    def check_years(self):
+        years = YEAR_CASES + make_years(RANDOM_CASES, seed=1)
+        expected = [parse_year(v, CURRENT_YEAR) for v in years]
+        actual = parse_years(pd.Series(years, dtype=object), CURRENT_YEAR)
+        self.assertSame('year', expected, list(actual), years)
+        self.assertSame('age_range', [get_age_range_label(v, CURRENT_YEAR) for v in expected],
+                        list(age_ranges(actual, CURRENT_YEAR)), years)
+
+    def test_prices(self):
+        self.check_prices()
+
+    def test_years(self):
+        self.check_years()
+
+    def test_prices_without_pyarrow(self):
+        with mock.patch.object(parsing, 'pa', None):
+            self.check_prices()
+
+    def test_years_without_pyarrow(self):
+        with mock.patch.object(parsing, 'pa', None):
+            self.check_years()
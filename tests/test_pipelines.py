@@ -0,0 +1,122 @@
+# 写文件的 pipeline 在目录不可写时不能卡住爬虫；布隆过滤器去重成批在线程里查；
+# 分位数草图每个 origin_url 只计一次，重启后还是同一个节点
+import os
+import socket
+import tempfile
+import threading
+
+import fakeredis
+
+from scrapy import Spider
+from scrapy.statscollectors import MemoryStatsCollector
+from scrapy.exceptions import DropItem
+from scrapy.utils.test import get_crawler
+from twisted.internet import defer
+from twisted.trial import unittest
+
+from scrapy_fangtianxia.dupefilter import BloomFilter
+from scrapy_fangtianxia.items import NewHouseItem
+from scrapy_fangtianxia.pipelines import BloomDupeItemPipeline, QuantileSketchPipeline, ScrapyFangtianxiaPipeline
+
+
+class UnwritableDirTest(unittest.TestCase):
+    timeout = 10
+
+    def setUp(self):
+        self.spider = Spider('test')
+        self.stats = MemoryStatsCollector(get_crawler(Spider))
+        # 父路径是一个普通文件，root 也建不了这个目录
+        fd, self.blocker = tempfile.mkstemp()
+        os.close(fd)
+        self.pipeline = ScrapyFangtianxiaPipeline(os.path.join(self.blocker, 'csv'), batch_size=1,
+                                                  flush_interval=0.05, queue_size=2, stats=self.stats)
+
+    def tearDown(self):
+        os.remove(self.blocker)
+
+    @defer.inlineCallbacks
+    def test_close_spider_returns(self):
+        self.pipeline.open_spider(self.spider)
+        # 比队列大得多，写线程一旦退出，process_item 就会一直等
+        for i in range(20):
+            item = NewHouseItem(name=f'楼盘{i}', origin_url=f'https://bj.newhouse.fang.com/{i}.htm')
+            result = yield defer.Deferred.fromCoroutine(self.pipeline.process_item(item, self.spider))
+            self.assertIs(result, item)
+        self.assertTrue(self.pipeline.thread.is_alive())
+        yield self.pipeline.close_spider(self.spider)
+        self.assertFalse(self.pipeline.thread.is_alive())
+        self.assertGreater(self.stats.get_value('csv/errors', 0), 0)
+        self.assertIsNone(self.stats.get_value('csv/items'))
+
+
+class BatchedBloomFilter(BloomFilter):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.calls = []
+
+    def add_many(self, values):
+        self.calls.append((threading.get_ident(), len(values)))
+        return super().add_many(values)
+
+
+class BloomDupeItemPipelineTest(unittest.TestCase):
+    @defer.inlineCallbacks
+    def test_items_checked_in_one_batch_off_the_reactor(self):
+        bloom = BatchedBloomFilter(fakeredis.FakeRedis(), 'test:items:bloom', capacity=1000)
+        pipeline = BloomDupeItemPipeline(bloom)
+        spider = Spider('test')
+        items = [NewHouseItem(name=name, origin_url=f'https://bj.newhouse.fang.com/{name}.htm')
+                 for name in ('a', 'b', 'a', 'c')]
+        # 同一轮 reactor 循环里送进来，和引擎并行处理一个回调的输出一样
+        results = yield defer.DeferredList(
+            [defer.Deferred.fromCoroutine(pipeline.process_item(item, spider)) for item in items],
+            consumeErrors=True)
+        self.assertEqual([ok for ok, _ in results], [True, True, False, True])
+        self.assertTrue(results[2][1].check(DropItem))
+        [(thread_id, size)] = bloom.calls
+        self.assertEqual(size, 4)
+        self.assertNotEqual(thread_id, threading.get_ident())
+
+        # 下一批里见过的照样去掉，内容变了的保留
+        changed = NewHouseItem(name='b', price='300万', origin_url='https://bj.newhouse.fang.com/b.htm')
+        result = yield defer.Deferred.fromCoroutine(pipeline.process_item(changed, spider))
+        self.assertIs(result, changed)
+        with self.assertRaises(DropItem):
+            yield defer.Deferred.fromCoroutine(pipeline.process_item(items[0], spider))
+
+
+class QuantileSketchPipelineTest(unittest.TestCase):
+    def setUp(self):
+        self.server = fakeredis.FakeRedis()
+        self.spider = Spider('test')
+
+    def make_pipeline(self):
+        crawler = get_crawler(Spider, {'SKETCHES_ENABLED': True, 'SKETCHES_FLUSH_INTERVAL': 60,
+                                       'BLOOMFILTER_CAPACITY': 1000})
+        pipeline = QuantileSketchPipeline.from_crawler(crawler)
+        pipeline.server = self.server
+        return pipeline
+
+    @defer.inlineCallbacks
+    def crawl(self, pipeline, items):
+        yield defer.Deferred.fromCoroutine(pipeline.open_spider(self.spider))
+        for item in items:
+            pipeline.process_item(item, self.spider)
+        yield pipeline.close_spider(self.spider)
+
+    @defer.inlineCallbacks
+    def test_origin_url_counted_once_across_restarts(self):
+        items = [NewHouseItem(price_wan=float(i), city='北京', origin_url=f'https://bj.newhouse.fang.com/{i}.htm')
+                 for i in (1, 2, 1, 3)]
+        first = self.make_pipeline()
+        self.assertEqual(first.node_id, socket.gethostname())
+        yield self.crawl(first, items)
+        self.assertEqual(len(first.store.digest('newhouse')), 3)
+
+        # 重启后还是同一个节点，重新抓到的房源不再加入
+        second = self.make_pipeline()
+        new = NewHouseItem(price_wan=4.0, city='北京', origin_url='https://bj.newhouse.fang.com/4.htm')
+        yield self.crawl(second, items + [new])
+        self.assertEqual(second.store.nodes(), [socket.gethostname()])
+        self.assertEqual(len(second.store.digest('newhouse')), 4)
+        self.assertEqual(len(second.store.digest('newhouse', scope='city:北京')), 4)
@@ -0,0 +1,67 @@
+# 打开 PROFILING_ENABLED 跑一次爬虫，timings 里要有回调、中间件和 pipeline 的行
+import csv
+import glob
+import os
+import shutil
+import tempfile
+
+from scrapy import Request, Spider
+from scrapy.utils.test import get_crawler
+from twisted.internet import defer
+from twisted.trial import unittest
+
+
+class PageSpider(Spider):
+    name = 'profiled'
+
+    def __init__(self, url=None, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.url = url
+
+    async def start(self):
+        yield Request(self.url, callback=self.parse_page)
+
+    def parse_page(self, response):
+        yield {'url': response.url}
+
+
+class CollectPipeline:
+    def __init__(self):
+        self.items = []
+
+    def process_item(self, item):
+        self.items.append(item)
+        return item
+
+
+class ProfilingExtensionTest(unittest.TestCase):
+    timeout = 30
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.page = os.path.join(self.directory, 'page.html')
+        with open(self.page, 'w', encoding='utf-8') as f:
+            f.write('<html></html>')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    @defer.inlineCallbacks
+    def test_timings_cover_callback_middleware_and_pipeline(self):
+        crawler = get_crawler(PageSpider, {
+            'PROFILING_ENABLED': True,
+            'PROFILING_DIR': os.path.join(self.directory, 'profiles'),
+            'NODE_ID': 'test',
+            'EXTENSIONS': {'scrapy_fangtianxia.profiling.ProfilingExtension': 510},
+            'ITEM_PIPELINES': {f'{__name__}.CollectPipeline': 100},
+        })
+        yield crawler.crawl(url=f'file://{self.page}')
+
+        [path] = glob.glob(os.path.join(self.directory, 'profiles', 'timings-test-*.tsv'))
+        with open(path, encoding='utf-8') as f:
+            rows = {(row['kind'], row['name']): int(row['calls']) for row in csv.DictReader(f, delimiter='\t')}
+        self.assertEqual(rows[('callback', 'parse_page')], 1)
+        self.assertEqual(rows[('pipeline', 'CollectPipeline.process_item')], 1)
+        self.assertTrue(any(kind == 'downloader' for kind, _ in rows))
+        self.assertTrue(any(kind == 'spidermw' for kind, _ in rows))
+        self.assertEqual(crawler.stats.get_value('profile/callback/parse_page/calls'), 1)